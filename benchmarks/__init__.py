@@ -0,0 +1,12 @@
+"""
+    This package contains the generators of synthetic Heat templates of
+    arbitrary size and the benchmark which measures heat2arm's performance
+    when converting them, as well as the check of the CLI's startup time.
+
+        Usage example:
+
+    $ python -m benchmarks.run --sizes 10,100,1000 --output results.json
+    $ python -m benchmarks.run --sizes 10,100,1000 --compare results.json
+    $ python -m benchmarks.generators --kind mixed --size 500 > stack.yaml
+    $ python -m benchmarks.startup --budget help=100
+"""
@@ -0,0 +1,240 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Contains the generators of synthetic Heat templates used for benchmarking.
+
+    Each generator takes a size N and returns the data of a template holding
+    N instances together with all their auxiliary resources, as well as the
+    text of the template in its usual format (YAML for HOT and JSON for CFN).
+"""
+
+import argparse
+import json
+import sys
+
+import yaml
+
+# NOVA_IMAGE, NOVA_FLAVOR, EC2_IMAGE and EC2_INSTANCE_TYPE are the images and
+# flavors used in all the generated templates, which are all mapped by the
+# default configuration:
+NOVA_IMAGE = "ubuntu.12.04.LTS.x86_64"
+NOVA_FLAVOR = "m1.small"
+EC2_IMAGE = "U10-x86_64-cfntools"
+EC2_INSTANCE_TYPE = "m1.small"
+
+# USER_DATA is the script passed to all the generated instances:
+USER_DATA = "#!/bin/bash\necho 'Hello from heat2arm benchmarks'\n"
+
+
+def _add_nova_servers(resources, size, prefix="server"):
+    """ _add_nova_servers is a helper function which adds the given number of
+    Nova servers, each with a Neutron port, floating IP and an attached Cinder
+    volume to the given HOT resources, all on a single Neutron network.
+    """
+    resources["%s_net" % prefix] = {
+        "type": "OS::Neutron::Net",
+        "properties": {"name": "%s_net" % prefix},
+    }
+    resources["%s_subnet" % prefix] = {
+        "type": "OS::Neutron::Subnet",
+        "properties": {
+            "network_id": {"get_resource": "%s_net" % prefix},
+            "cidr": "10.0.0.0/16",
+        },
+    }
+
+    for i in range(size):
+        name = "%s%d" % (prefix, i)
+        resources[name] = {
+            "type": "OS::Nova::Server",
+            "properties": {
+                "image": {"get_param": "image"},
+                "flavor": {"get_param": "flavor"},
+                "user_data": USER_DATA,
+                "networks": [{"port": {"get_resource": "%s_port" % name}}],
+            },
+        }
+        resources["%s_port" % name] = {
+            "type": "OS::Neutron::Port",
+            "properties": {
+                "network_id": {"get_resource": "%s_net" % prefix},
+            },
+        }
+        resources["%s_floating_ip" % name] = {
+            "type": "OS::Neutron::FloatingIP",
+            "properties": {
+                "floating_network": "public",
+                "port_id": {"get_resource": "%s_port" % name},
+            },
+        }
+        resources["%s_volume" % name] = {
+            "type": "OS::Cinder::Volume",
+            "properties": {"size": "10"},
+        }
+        resources["%s_volume_attachment" % name] = {
+            "type": "OS::Cinder::VolumeAttachment",
+            "properties": {
+                "instance_uuid": {"get_resource": name},
+                "volume_id": {"get_resource": "%s_volume" % name},
+                "mountpoint": "/dev/vdb",
+            },
+        }
+
+
+def _add_ec2_instances(resources, size, prefix="Instance", ref="Ref"):
+    """ _add_ec2_instances is a helper function which adds the given number of
+    EC2 instances, each with an EIP, a security group and an attached EBS
+    volume to the given resources, using the given reference function.
+    """
+    for i in range(size):
+        name = "%s%d" % (prefix, i)
+        resources["%sSecurityGroup" % name] = {
+            "Type": "AWS::EC2::SecurityGroup",
+            "Properties": {
+                "GroupDescription": "Security group of %s" % name,
+                "SecurityGroupIngress": [{
+                    "IpProtocol": "tcp", "FromPort": "22", "ToPort": "22",
+                    "CidrIp": "0.0.0.0/0",
+                }],
+                "SecurityGroupEgress": [{
+                    "IpProtocol": "tcp", "FromPort": "80", "ToPort": "80",
+                    "CidrIp": "0.0.0.0/0",
+                }],
+            },
+        }
+        resources[name] = {
+            "Type": "AWS::EC2::Instance",
+            "Properties": {
+                "ImageId": EC2_IMAGE,
+                "InstanceType": EC2_INSTANCE_TYPE,
+                "SecurityGroups": [{ref: "%sSecurityGroup" % name}],
+                "UserData": {"Fn::Base64": USER_DATA},
+            },
+        }
+        resources["%sIPAddress" % name] = {
+            "Type": "AWS::EC2::EIP",
+        }
+        resources["%sIPAssoc" % name] = {
+            "Type": "AWS::EC2::EIPAssociation",
+            "Properties": {
+                "InstanceId": {ref: name},
+                "EIP": {ref: "%sIPAddress" % name},
+            },
+        }
+        resources["%sVolume" % name] = {
+            "Type": "AWS::EC2::Volume",
+            "Properties": {"Size": "10", "AvailabilityZone": "nova"},
+        }
+        resources["%sVolumeAttachment" % name] = {
+            "Type": "AWS::EC2::VolumeAttachment",
+            "Properties": {
+                "InstanceId": {ref: name},
+                "VolumeId": {ref: "%sVolume" % name},
+                "Device": "/dev/vdb",
+            },
+        }
+
+
+def nova_stack(size):
+    """ nova_stack returns the data and text of a HOT template holding the
+    given number of Nova servers.
+    """
+    resources = {}
+    _add_nova_servers(resources, size)
+
+    data = {
+        "heat_template_version": "2013-05-23",
+        "description": "Synthetic stack of %d Nova servers." % size,
+        "parameters": {
+            "image": {"type": "string", "default": NOVA_IMAGE},
+            "flavor": {"type": "string", "default": NOVA_FLAVOR},
+        },
+        "resources": resources,
+    }
+
+    return data, yaml.safe_dump(data, default_flow_style=False)
+
+
+def ec2_stack(size):
+    """ ec2_stack returns the data and text of a CFN template holding the
+    given number of EC2 instances.
+    """
+    resources = {}
+    _add_ec2_instances(resources, size)
+
+    data = {
+        "AWSTemplateFormatVersion": "2010-09-09",
+        "Description": "Synthetic stack of %d EC2 instances." % size,
+        "Resources": resources,
+    }
+
+    return data, json.dumps(data, indent=2)
+
+
+def mixed_stack(size):
+    """ mixed_stack returns the data and text of a HOT template holding the
+    given number of instances, half of them Nova servers and the other half
+    EC2 instances.
+    """
+    resources = {}
+    _add_nova_servers(resources, (size + 1) // 2)
+
+    ec2_resources = {}
+    _add_ec2_instances(ec2_resources, size // 2, ref="get_resource")
+    for name, definition in ec2_resources.items():
+        resources[name] = {
+            "type": definition["Type"],
+            "properties": definition.get("Properties", {}),
+        }
+
+    data = {
+        "heat_template_version": "2013-05-23",
+        "description": "Synthetic stack of %d mixed instances." % size,
+        "parameters": {
+            "image": {"type": "string", "default": NOVA_IMAGE},
+            "flavor": {"type": "string", "default": NOVA_FLAVOR},
+        },
+        "resources": resources,
+    }
+
+    return data, yaml.safe_dump(data, default_flow_style=False)
+
+
+# GENERATORS maps the names of all the kinds of stacks to their generators:
+GENERATORS = {
+    "nova": nova_stack,
+    "ec2": ec2_stack,
+    "mixed": mixed_stack,
+}
+
+
+def main():
+    """ main writes a generated template of the requested kind and size to
+    the standard output.
+    """
+    parser = argparse.ArgumentParser(
+        description="Generates synthetic Heat templates.")
+    parser.add_argument("--kind", choices=sorted(GENERATORS), default="mixed",
+                        help="Kind of stack to generate")
+    parser.add_argument("--size", type=int, default=100,
+                        help="Number of instances in the stack")
+    args = parser.parse_args()
+
+    sys.stdout.write(GENERATORS[args.kind](args.size)[1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Benchmarks the conversion of synthetic Heat templates of increasing sizes,
+    timing each phase of the conversion separately:
+        - parse: loading the template's text.
+        - heat_init, template_validate, stack_build, resource_validate:
+        building the Heat stack, or only stack_build for the template model.
+        - index: indexing the references between the stack's resources.
+        - translators: setting up the translators.
+        - resolve_mappings: resolving the mapping lookups of the translators.
+        - translate: translating all the resources into fragments.
+        - merge: merging the fragments into the context.
+        - update_context: running all the context updates.
+        - assemble: assembling the final ARM template data.
+        - dependencies, variables, copy_loops: the enabled optimizations.
+        - schema_validate, limits: the enabled checks; schema_validate being
+        only enabled with --validate.
+        - serialize: dumping the ARM template to JSON.
+
+    All the phases but parse and serialize are timed by the engine itself
+    as it runs the public steps of convert_template.
+
+    The results may be saved as JSON and compared to those of previous runs.
+"""
+
+import argparse
+import gc
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from oslo_config import cfg
+
+from benchmarks import generators
+from heat2arm import profiling
+from heat2arm import serialization
+from heat2arm import translation_engine as engine
+
+CONF = cfg.CONF
+
+# PHASES is the ordered list of the names of all the timed phases:
+PHASES = ["parse", "heat_init", "template_validate", "stack_build",
+          "resource_validate", "index", "translators", "resolve_mappings",
+          "translate", "merge", "update_context", "assemble", "dependencies",
+          "variables", "copy_loops", "schema_validate", "limits",
+          "serialize"]
+
+
+def _run_phases(text, fast, validate):
+    """ _run_phases is a helper function which converts the given template
+    text and returns the dict of the time in seconds spent in each phase,
+    along with the number of resulting ARM resources.
+    """
+    CONF.set_override("validate_arm_template_schema", validate)
+    profiler = profiling.Profiler()
+
+    with profiler.phase("parse"):
+        data = serialization.load_heat_template(text)
+
+    (context, translators) = engine.prepare_translation(data, fast, profiler)
+    arm_template_data = engine.get_arm_template(translators, context,
+                                                profiler)
+    engine.check_arm_template(arm_template_data, profiler)
+
+    with profiler.phase("serialize"):
+        serialization.dumps_arm_template(arm_template_data)
+
+    timings = dict((phase, stats["wall"])
+                   for (phase, stats) in profiler.phases.items())
+    return timings, len(arm_template_data["resources"])
+
+
+def _measure_peak_memory(text, fast, validate):
+    """ _measure_peak_memory is a helper function which returns the peak
+    number of bytes allocated while converting the given template text, or
+    None if tracemalloc is not available.
+    """
+    if tracemalloc is None:
+        return None
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        _run_phases(text, fast, validate)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_scenario(kind, size, repeat, fast, validate, memory):
+    """ run_scenario benchmarks the conversion of a generated template of the
+    given kind and size and returns the dict of its results, keeping the best
+    timing of each phase over the given number of repetitions.
+    """
+    (_, text) = generators.GENERATORS[kind](size)
+
+    best = {}
+    for _ in range(repeat):
+        gc.collect()
+        (timings, arm_resources) = _run_phases(text, fast, validate)
+        for phase, elapsed in timings.items():
+            best[phase] = min(best.get(phase, elapsed), elapsed)
+
+    total = sum(best.values())
+    result = {
+        "kind": kind,
+        "size": size,
+        "template_bytes": len(text),
+        "arm_resources": arm_resources,
+        "phases": best,
+        "total": total,
+        "instances_per_second": size / total if total else None,
+    }
+
+    if memory:
+        result["peak_memory_bytes"] = _measure_peak_memory(
+            text, fast, validate)
+
+    return result
+
+
+def _add_scaling(results):
+    """ _add_scaling is a helper function which adds to each result the
+    exponent k of the best fitting total ~ size ^ k curve between it and the
+    previous result of the same kind; k close to 1 means linear scaling.
+    """
+    previous = {}
+    for result in results:
+        prev = previous.get(result["kind"])
+        if prev and prev["total"] and result["total"]:
+            result["scaling_exponent"] = (
+                math.log(result["total"] / prev["total"]) /
+                math.log(float(result["size"]) / prev["size"]))
+        previous[result["kind"]] = result
+
+
+def _get_commit():
+    """ _get_commit is a helper function which returns the git commit the
+    benchmark is run on, if available.
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            stderr=subprocess.STDOUT).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(report, stream, baseline=None):
+    """ write_report writes a human-readable table of the given benchmark
+    report to the given stream, comparing it to the given baseline report.
+    """
+    baseline_results = {}
+    if baseline:
+        stream.write("Comparing against commit %s.\n" % baseline["commit"])
+        for result in baseline["results"]:
+            baseline_results[(result["kind"], result["size"])] = result
+
+    phases = [p for p in PHASES
+              if any(p in r["phases"] for r in report["results"])]
+    header = ["kind", "size"] + phases + ["total", "inst/s", "peak MB", "k"]
+    # NOTE: each column is at least wide enough for its header:
+    widths = [max(12, len(h) + 1) for h in header]
+    stream.write("".join("%*s" % (w, h) for (w, h) in zip(widths, header)) +
+                 "\n")
+
+    for result in report["results"]:
+        row = [result["kind"], "%d" % result["size"]]
+        for phase in phases + ["total"]:
+            if phase == "total":
+                elapsed = result["total"]
+            else:
+                elapsed = result["phases"].get(phase, 0)
+            row.append("%.4fs" % elapsed)
+
+        row.append("%.1f" % (result["instances_per_second"] or 0))
+
+        peak = result.get("peak_memory_bytes")
+        row.append("%.1f" % (peak / 1048576.) if peak else "-")
+
+        exponent = result.get("scaling_exponent")
+        row.append("%.2f" % exponent if exponent else "-")
+        stream.write("".join("%*s" % (w, c) for (w, c) in zip(widths, row)) +
+                     "\n")
+
+        base = baseline_results.get((result["kind"], result["size"]))
+        if base:
+            row = ["", "vs base"]
+            for phase in phases + ["total"]:
+                if phase == "total":
+                    (new, old) = (result["total"], base["total"])
+                else:
+                    new = result["phases"].get(phase, 0)
+                    old = base["phases"].get(phase, 0)
+                row.append("%.2fx" % (new / old) if old else "-")
+            stream.write("".join("%*s" % (w, c)
+                                 for (w, c) in zip(widths, row)) + "\n")
+
+
+def main():
+    """ main runs the benchmark and reports its results. """
+    parser = argparse.ArgumentParser(
+        description="Benchmarks heat2arm conversions.")
+    parser.add_argument("--kinds", default="nova,ec2,mixed",
+                        help="Comma-separated kinds of stacks to benchmark")
+    parser.add_argument("--sizes", default="10,100,1000",
+                        help="Comma-separated numbers of instances per stack")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs per scenario; the best timing "
+                        "of each phase is kept")
+    parser.add_argument("--fast", action="store_true",
+                        help="Use the lightweight template model")
+    parser.add_argument("--validate", action="store_true",
+                        help="Also time the ARM schema validation")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="Skip the peak memory measurement")
+    parser.add_argument("--config-file", type=str,
+                        help="Path to an optional configuration file")
+    parser.add_argument("--output", type=str,
+                        help="Path to save the JSON results to")
+    parser.add_argument("--compare", type=str,
+                        help="Path of previously saved JSON results to "
+                        "compare against")
+    args = parser.parse_args()
+
+    if args.config_file:
+        CONF(["--config-file", args.config_file])
+
+    results = []
+    for kind in args.kinds.split(","):
+        for size in sorted(int(s) for s in args.sizes.split(",")):
+            results.append(run_scenario(kind, size, args.repeat, args.fast,
+                                        args.validate, args.memory))
+    _add_scaling(results)
+
+    report = {
+        "commit": _get_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fast": args.fast,
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    write_report(report, sys.stdout, baseline)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Checks the startup time of the heat2arm command line tool against a time
+    budget, and that it does not import any of the heavy modules which are
+    only needed on demand.
+
+    Each scenario runs the CLI in a fresh interpreter with `-X importtime`
+    (Python 3.7+) and fails if either its total import time exceeds its
+    budget or any of its forbidden modules got imported. The exit code is
+    non-zero if any scenario failed, which makes it usable in CI.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import generators
+
+# HEAVY_MODULES are the modules which must only be imported on demand:
+HEAVY_MODULES = ["heat.engine", "heat.tests", "requests", "jsonschema"]
+
+# SCENARIOS maps the names of all the checked scenarios to the arguments of
+# the CLI they run, the default budget of their import time in milliseconds
+# and the modules they may not import:
+SCENARIOS = {
+    "help": (["--help"], 150, HEAVY_MODULES + [
+        "oslo_config", "heat2arm.translation_engine", "heat2arm.batch",
+        "heat2arm.server"]),
+    "convert": (["--fast", "--in", "{template}", "--out", os.devnull], 500,
+                HEAVY_MODULES + ["heat2arm.batch", "heat2arm.server"]),
+}
+
+
+def _parse_importtime(output):
+    """ _parse_importtime is a helper function which returns the total import
+    time in microseconds and the set of the names of all the modules imported
+    out of the given output of `python -X importtime`.
+    """
+    total = 0
+    modules = set()
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        (_, cumulative, name) = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            # the header line:
+            continue
+
+        modules.add(name.strip())
+        if not name.startswith("  "):
+            # only top-level imports, as their times include their children:
+            total += int(cumulative)
+
+    return total, modules
+
+
+def _is_forbidden(module, forbidden):
+    """ _is_forbidden is a helper function which checks whether the given
+    module is, or is part of, any of the given forbidden modules.
+    """
+    return any(module == fmod or module.startswith(fmod + ".")
+               for fmod in forbidden)
+
+
+def run_scenario(args, forbidden, repeat):
+    """ run_scenario runs the CLI with the given arguments the given number of
+    times and returns the best wall time and import time in milliseconds,
+    along with the sorted list of the forbidden modules which got imported.
+
+    The import time is None on Pythons which do not support -X importtime.
+    """
+    importtime = sys.version_info >= (3, 7)
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-m", "heat2arm.main"] + args
+
+    best_wall = None
+    best_import = None
+    imported = set()
+    for _ in range(repeat):
+        start = time.time()
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        (_, err) = proc.communicate()
+        wall = (time.time() - start) * 1000
+        if proc.returncode:
+            raise Exception('Running "%s" failed:\n%s' % (
+                " ".join(command), err.decode("utf-8", "replace")))
+
+        best_wall = min(best_wall or wall, wall)
+        if importtime:
+            (total, imported) = _parse_importtime(
+                err.decode("utf-8", "replace"))
+            best_import = min(best_import or total, total)
+
+    if best_import is not None:
+        best_import /= 1000.
+
+    return best_wall, best_import, sorted(
+        mod for mod in imported if _is_forbidden(mod, forbidden))
+
+
+def main():
+    """ main runs all the requested scenarios and reports their results. """
+    parser = argparse.ArgumentParser(
+        description="Checks the startup time of the heat2arm CLI.")
+    parser.add_argument("--scenarios", default=",".join(sorted(SCENARIOS)),
+                        help="Comma-separated scenarios to check")
+    parser.add_argument("--budget", action="append", default=[],
+                        metavar="SCENARIO=MS",
+                        help="Override the import time budget of a scenario")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of runs per scenario; the best timing "
+                        "is kept")
+    args = parser.parse_args()
+
+    budgets = dict((name, budget) for (name, (_, budget, _))
+                   in SCENARIOS.items())
+    for override in args.budget:
+        (name, _, budget) = override.partition("=")
+        budgets[name] = float(budget)
+
+    (fd, template_path) = tempfile.mkstemp(suffix=".yaml")
+    try:
+        with os.fdopen(fd, "w") as template:
+            template.write(generators.nova_stack(2)[1])
+
+        failed = False
+        sys.stdout.write("%-10s %12s %12s %12s  %s\n" % (
+            "scenario", "wall (ms)", "import (ms)", "budget (ms)", "status"))
+        for name in args.scenarios.split(","):
+            (cli_args, _, forbidden) = SCENARIOS[name]
+            cli_args = [arg.replace("{template}", template_path)
+                        for arg in cli_args]
+
+            (wall, imports, heavy) = run_scenario(cli_args, forbidden,
+                                                  args.repeat)
+
+            problems = []
+            if imports is not None and imports > budgets[name]:
+                problems.append("over budget")
+            if heavy:
+                problems.append("imported %s" % ", ".join(heavy))
+            failed = failed or bool(problems)
+
+            sys.stdout.write("%-10s %12.1f %12s %12.1f  %s\n" % (
+                name, wall, "-" if imports is None else "%.1f" % imports,
+                budgets[name], "; ".join(problems) or "ok"))
+    finally:
+        os.remove(template_path)
+
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
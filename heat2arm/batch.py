@@ -0,0 +1,273 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Contains the logic for converting a whole batch of Heat templates into
+    ARM templates using a pool of worker processes.
+
+    The batch of templates may be given as either:
+        - a directory, which is searched recursively for templates.
+        - a manifest file listing the paths of the templates one per line.
+        - a glob pattern matching the paths of the templates.
+"""
+
+import glob
+import logging
+import multiprocessing
+import os
+import time
+
+from oslo_config import cfg
+
+from heat2arm import cache
+from heat2arm import constants
+from heat2arm import serialization
+from heat2arm import translation_engine as engine
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+# TEMPLATE_EXTENSIONS are the extensions of the files considered to be Heat
+# templates when searching a directory for them:
+TEMPLATE_EXTENSIONS = (".yaml", ".yml", ".template", ".json")
+
+
+def _read_manifest(manifest_path):
+    """ _read_manifest is a helper function which returns the list of paths
+    listed in the given manifest file. Empty lines and lines starting with
+    a '#' are ignored and relative paths are relative to the manifest.
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    paths = []
+    with open(manifest_path) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            paths.append(os.path.join(base_dir, line))
+
+    return paths
+
+
+def _common_dir(paths):
+    """ _common_dir is a helper function which returns the deepest directory
+    which contains all the given paths.
+    """
+    dir_parts = [os.path.dirname(os.path.abspath(path)).split(os.sep)
+                 for path in paths]
+
+    common = os.path.commonprefix(dir_parts)
+    return os.sep.join(common) or os.sep
+
+
+def collect_templates(source):
+    """ collect_templates returns the sorted list of (template path, output
+    name) tuples of all the Heat templates designated by the given source.
+
+    The source may be a directory, a manifest file or a glob pattern. The
+    output name is the path of the template relative to the source directory
+    or to the common directory of all the templates, with a .json extension.
+    """
+    if os.path.isdir(source):
+        base_dir = source
+        paths = []
+        for dirpath, _, filenames in os.walk(source):
+            for filename in filenames:
+                if filename.endswith(TEMPLATE_EXTENSIONS):
+                    paths.append(os.path.join(dirpath, filename))
+    else:
+        if os.path.isfile(source):
+            paths = _read_manifest(source)
+        else:
+            paths = glob.glob(source)
+
+        if not paths:
+            return []
+        base_dir = _common_dir(paths)
+
+    templates = []
+    seen = {}
+    for path in sorted(paths):
+        rel_path = os.path.relpath(os.path.abspath(path),
+                                   os.path.abspath(base_dir))
+        out_name = "%s.json" % os.path.splitext(rel_path)[0]
+
+        if out_name in seen:
+            raise Exception(
+                'Templates "%s" and "%s" would both be converted to "%s".' % (
+                    seen[out_name], path, out_name))
+        seen[out_name] = path
+
+        templates.append((path, out_name))
+
+    return templates
+
+
+def convert_file(template_path, output_path, compact=False,
+                 cache_stats=None):
+    """ convert_file converts the Heat template at the given path and writes
+    the resulting ARM template at the given output path, compacted if
+    requested. It returns whether the translation was cached, recording the
+    use of the translation cache into the given statistics, if any.
+    """
+    with open(template_path, "rb") as heat_template:
+        heat_template_data = serialization.load_heat_template(heat_template)
+
+    translation_cache = cache.get_translation_cache()
+    if translation_cache is not None:
+        (text, hit) = translation_cache.convert(
+            heat_template_data, compact, stats=cache_stats)
+    else:
+        arm_template_data = engine.convert_template(heat_template_data)
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.isdir(output_dir):
+        try:
+            os.makedirs(output_dir)
+        except OSError:
+            # another worker may have just created it:
+            if not os.path.isdir(output_dir):
+                raise
+
+    with open(output_path, "w") as arm_template:
+        if translation_cache is not None:
+            arm_template.write(text)
+            return hit
+
+        serialization.dump_arm_template(arm_template_data, arm_template,
+                                        compact)
+
+    return False
+
+
+def init_worker(config_file, api_version):
+    """ init_worker sets up the configuration of a worker process from the
+    given configuration file and ARM API version.
+    """
+    if config_file:
+        # NOTE: the mapping providers are only imported once required, as
+        # they load the instance translators:
+        from heat2arm.translators.instances import mapping_providers
+
+        CONF(["--config-file", config_file])
+        mapping_providers.invalidate()
+
+    if api_version:
+        constants.ARM_API_VERSION = api_version
+
+
+def _convert_job(job):
+    """ _convert_job is a helper function which runs the conversion of a
+    single template inside a worker process and returns a tuple of the
+    template path, output path, error message if the conversion failed,
+    whether the translation was cached and the statistics of the use of the
+    translation cache.
+    """
+    (template_path, output_path, compact) = job
+
+    cache_stats = cache.new_stats()
+    try:
+        cached = convert_file(template_path, output_path, compact,
+                              cache_stats)
+    except Exception as ex:
+        LOG.debug('Failed converting "%s":', template_path, exc_info=True)
+        return (template_path, output_path, "%s: %s" % (
+            ex.__class__.__name__, ex), False, cache_stats)
+
+    return (template_path, output_path, None, cached, cache_stats)
+
+
+def run_batch(templates, out_dir, workers=None, config_file=None,
+              api_version=None, compact=False):
+    """ run_batch converts all the given (template path, output name) tuples
+    into ARM templates inside the given output directory using a pool of the
+    given number of worker processes, compacting them if requested.
+
+    It returns the list of (template path, output path, error, cached,
+    cache stats) tuples, where error is None for all the successful
+    conversions, cached whether the translation was found in the translation
+    cache and cache stats the statistics of the use of the cache by the
+    conversion.
+
+    NOTE: with a single worker, the templates are converted in the current
+    process, whose configuration is expected to have already been set up.
+    """
+    jobs = [(path, os.path.join(out_dir, out_name), compact)
+            for (path, out_name) in templates]
+    if not jobs:
+        return []
+
+    if workers == 1:
+        return sorted(_convert_job(job) for job in jobs)
+
+    pool = multiprocessing.Pool(
+        processes=workers or None,
+        initializer=init_worker,
+        initargs=(config_file, api_version),
+    )
+    try:
+        results = list(pool.imap_unordered(_convert_job, jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+    return sorted(results)
+
+
+def write_summary(results, elapsed, stream):
+    """ write_summary writes a summary of the given results of run_batch to
+    the given stream.
+    """
+    failures = [res for res in results if res[2] is not None]
+
+    stream.write("Converted %d out of %d templates in %.2fs.\n" % (
+        len(results) - len(failures), len(results), elapsed))
+
+    if cache.get_translation_cache() is not None:
+        # NOTE: the statistics are aggregated across all the workers:
+        cache_stats = cache.new_stats()
+        for res in results:
+            cache.add_stats(cache_stats, res[4])
+
+        stream.write("%d translations were cached.\n" % (
+            len([res for res in results if res[3]])))
+        stream.write(cache.format_stats(cache_stats) + "\n")
+
+    if failures:
+        stream.write("%d templates failed:\n" % len(failures))
+        for (template_path, _, error, _, _) in failures:
+            stream.write("  %s: %s\n" % (template_path, error))
+
+
+def main(source, out_dir, workers=None, config_file=None, api_version=None,
+         stream=None, compact=False):
+    """ main converts all the templates designated by the given source and
+    writes a summary of the conversions to the given stream. It returns the
+    exit code of the batch, which is non-zero if any conversion failed.
+    """
+    start = time.time()
+
+    templates = collect_templates(source)
+    if not templates:
+        LOG.warn('No Heat templates found for "%s".', source)
+
+    results = run_batch(templates, out_dir, workers, config_file, api_version,
+                        compact)
+
+    if stream is not None:
+        write_summary(results, time.time() - start, stream)
+
+    return int(any(res[2] is not None for res in results))
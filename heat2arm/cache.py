@@ -0,0 +1,357 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Contains the on-disk cache of translations, which maps Heat templates to
+    the JSON of the ARM templates they were converted into.
+
+    Entries are keyed by a hash of:
+        - the normalized data of the Heat template.
+        - the values of all the configuration options affecting translations.
+        - the size and modification time of the mapping file, if any.
+        - the ARM API version and the output mode.
+        - the source code of heat2arm itself, so that upgrading it
+        invalidates all the previous entries.
+
+    Entries are written atomically, so the cache may be shared between
+    concurrent processes, and the least recently used ones are evicted
+    once the cache grows beyond its maximum size.
+
+    The statistics of the use of the cache are kept per TranslationCache,
+    and may also be recorded per conversion into the dicts returned by
+    new_stats; so that those of worker processes can be aggregated.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from oslo_config import cfg
+
+from heat2arm import constants
+from heat2arm.translators import mapping_options  # noqa
+
+LOG = logging.getLogger(__name__)
+
+CONF = cfg.CONF
+CONF.register_opts([
+    cfg.StrOpt(
+        'translation_cache_dir',
+        default=None,
+        help='Directory in which translations are cached; translations are '
+             'not cached if unset'),
+    cfg.IntOpt(
+        'translation_cache_max_size',
+        default=512 * 1024 * 1024,
+        help='Maximum size in bytes of the translation cache, beyond which '
+             'the least recently used translations are evicted'),
+])
+
+# KEY_OPTIONS are the names of all the configuration options which affect
+# the resulting ARM templates:
+KEY_OPTIONS = [
+    "default_azure_location",
+    "default_azure_storage_account_type",
+    "default_storage_container_name",
+    "validate_arm_template_schema",
+    "check_arm_limits",
+    "fast_template_parser",
+    "reduce_arm_dependencies",
+    "deduplicate_arm_variables",
+    "arm_copy_loops",
+    "arm_copy_loop_min_count",
+    "vm_default_size",
+    "nova_vm_flavor_size_map",
+    "nova_vm_image_map",
+    "ec2_vm_type_to_size_map",
+    "ec2_vm_image_map",
+    "vm_mapping_provider",
+    "vm_mapping_file",
+]
+
+# _replace atomically replaces the destination path with the source one:
+_replace = getattr(os, "replace", os.rename)
+
+# _CODE_FINGERPRINT is the hash of heat2arm's source code, computed once:
+_CODE_FINGERPRINT = None
+
+
+def _get_code_fingerprint():
+    """ _get_code_fingerprint is a helper function which returns the hash of
+    all the Python source files of heat2arm.
+    """
+    global _CODE_FINGERPRINT
+
+    if _CODE_FINGERPRINT is None:
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for (dirpath, dirnames, filenames) in os.walk(package_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.endswith(".py"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                digest.update(os.path.relpath(path, package_dir).encode(
+                    "utf-8"))
+                with open(path, "rb") as source:
+                    digest.update(source.read())
+        _CODE_FINGERPRINT = digest.hexdigest()
+
+    return _CODE_FINGERPRINT
+
+
+def _get_file_fingerprint(path):
+    """ _get_file_fingerprint is a helper function which returns the size
+    and modification time of the file at the given path, if any, so that
+    changes to it invalidate all the entries translated with it.
+    """
+    if not path:
+        return None
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return [stat.st_size, stat.st_mtime]
+
+
+def get_key(heat_template_data, compact=False):
+    """ get_key returns the cache key of the translation of the given Heat
+    template data with the current configuration into an ARM template in
+    the given output mode.
+    """
+    key_data = {
+        "template": heat_template_data,
+        "options": dict((opt, getattr(CONF, opt)) for opt in KEY_OPTIONS),
+        "mapping_file": _get_file_fingerprint(CONF.vm_mapping_file),
+        "api_version": constants.ARM_API_VERSION,
+        "compact": compact,
+        "code": _get_code_fingerprint(),
+    }
+
+    return hashlib.sha256(json.dumps(
+        key_data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+# STATS_FIELDS are the names of the statistics of the use of the cache:
+STATS_FIELDS = ("hits", "misses", "writes", "evictions")
+
+
+def new_stats():
+    """ new_stats returns the initial statistics of the use of the cache. """
+    return dict((field, 0) for field in STATS_FIELDS)
+
+
+def add_stats(total, stats):
+    """ add_stats adds the given statistics of the use of the cache to the
+    given total ones.
+    """
+    for field in STATS_FIELDS:
+        total[field] += stats.get(field, 0)
+
+
+def format_stats(stats):
+    """ format_stats returns the human-readable summary of the given
+    statistics of the use of the cache.
+    """
+    return ("Translation cache: %(hits)d hits, %(misses)d misses, "
+            "%(writes)d writes, %(evictions)d evictions." % stats)
+
+
+class TranslationCache(object):
+    """ TranslationCache is the on-disk cache of translations within the given
+    directory, which holds at most the given number of bytes.
+
+    Each entry is stored as <dir>/<first 2 chars of the key>/<key>.json,
+    whose modification time is updated on every hit to track its use.
+    """
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+        self.stats = new_stats()
+
+        # size is the approximate total size of all the entries, which is
+        # computed on first write:
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _get_path(self, key):
+        """ _get_path is a helper method which returns the path of the entry
+        with the given key.
+        """
+        return os.path.join(self.directory, key[:2], "%s.json" % key)
+
+    def _record(self, field, stats=None):
+        """ _record is a helper method which counts an occurrence of the
+        given statistic, both in the cache's statistics and in the given
+        ones of the current conversion, if any.
+
+        NOTE: the cache's lock must be held.
+        """
+        self.stats[field] += 1
+        if stats is not None:
+            stats[field] += 1
+
+    def get(self, key, stats=None):
+        """ get returns the cached JSON of the ARM template with the given
+        key, or None if it is not cached, recording the lookup into the
+        given statistics, if any.
+        """
+        path = self._get_path(key)
+        try:
+            with open(path, "rb") as entry:
+                text = entry.read().decode("utf-8")
+            os.utime(path, None)
+        except (IOError, OSError):
+            # missing, or just evicted by another process:
+            with self._lock:
+                self._record("misses", stats)
+            return None
+
+        with self._lock:
+            self._record("hits", stats)
+        return text
+
+    def put(self, key, text, stats=None):
+        """ put atomically stores the given JSON of an ARM template under the
+        given key, evicting the least recently used entries if the cache
+        grows beyond its maximum size, and recording both into the given
+        statistics, if any.
+        """
+        path = self._get_path(key)
+        data = text.encode("utf-8")
+
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError:
+                    # another process may have just created it:
+                    if not os.path.isdir(os.path.dirname(path)):
+                        raise
+
+            (fd, temp_path) = tempfile.mkstemp(
+                dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as entry:
+                    entry.write(data)
+                _replace(temp_path, path)
+            except Exception:
+                os.remove(temp_path)
+                raise
+        except (IOError, OSError) as ex:
+            LOG.warn('Could not cache translation "%s": %s', key, ex)
+            return
+
+        with self._lock:
+            self._record("writes", stats)
+            if self._size is not None:
+                self._size += len(data)
+            if self._size is None or self._size > self.max_size:
+                self._evict(stats)
+
+    def _list_entries(self):
+        """ _list_entries is a helper method which returns the list of the
+        (modification time, size, path) tuples of all the entries.
+        """
+        entries = []
+        for (dirpath, _, filenames) in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        return entries
+
+    def _evict(self, stats=None):
+        """ _evict is a helper method which removes the least recently used
+        entries until the cache is back within its maximum size, recording
+        the evictions into the given statistics, if any.
+        """
+        entries = self._list_entries()
+        self._size = sum(size for (_, size, _) in entries)
+
+        for (_, size, path) in sorted(entries):
+            if self._size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # already evicted by another process:
+                pass
+            self._size -= size
+            self._record("evictions", stats)
+
+    def convert(self, heat_template_data, compact=False, profiler=None,
+                stats=None):
+        """ convert returns a tuple of the JSON of the ARM template the given
+        Heat template data is converted into and whether it was cached,
+        converting and caching it if it was not, and recording the use of
+        the cache into the given statistics, if any.
+        """
+        from heat2arm import serialization
+        from heat2arm import translation_engine as engine
+
+        key = get_key(heat_template_data, compact)
+        text = self.get(key, stats)
+        if text is not None:
+            return (text, True)
+
+        arm_template_data = engine.convert_template(heat_template_data,
+                                                    profiler=profiler)
+        text = serialization.dumps_arm_template(arm_template_data, compact)
+        self.put(key, text, stats)
+
+        return (text, False)
+
+    def write_stats(self, stream):
+        """ write_stats writes the statistics of the use of the cache to the
+        given stream.
+        """
+        with self._lock:
+            stream.write(format_stats(self.stats) + "\n")
+
+
+# _CACHE is the TranslationCache set up from the configuration on first use:
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_translation_cache():
+    """ get_translation_cache returns the TranslationCache configured through
+    the translation_cache_* configuration options, or None if caching is
+    disabled.
+    """
+    global _CACHE
+
+    if not CONF.translation_cache_dir:
+        return None
+
+    with _CACHE_LOCK:
+        if _CACHE is None or (
+                _CACHE.directory != CONF.translation_cache_dir):
+            _CACHE = TranslationCache(CONF.translation_cache_dir,
+                                      CONF.translation_cache_max_size)
+        return _CACHE
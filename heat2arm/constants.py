@@ -24,6 +24,10 @@ ARM_SCHEMA_URL_2015_01_01 = ("https://schema.management.azure.com/schemas/"
 # the version of the API to be used in all definitions:
 ARM_API_VERSION = ARM_API_2015_05_01_PREVIEW
 
+# ARM_DEPLOYMENTS_API_VERSION is the version of the API of the
+# Microsoft.Resources/deployments resources which deploy linked templates:
+ARM_DEPLOYMENTS_API_VERSION = "2015-01-01"
+
 # ARM_SCHEMA_URL is the default URL for fetching the ARM template JSON schema:
 ARM_SCHEMA_URL = ARM_SCHEMA_URL_2015_01_01
 
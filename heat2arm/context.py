@@ -19,21 +19,44 @@
     which have already been declared.
 """
 
+import collections
+
 from oslo_config import cfg
 
 from heat2arm import constants
 
+# DEFAULT_RESOURCE_INDEXES is the list of tuples of resource fields which are
+# indexed by default for looking up resources in the context:
+DEFAULT_RESOURCE_INDEXES = [
+    ("type", "name"),
+]
+
 
 class Context(object):
     """ Context represents the specific context of the ongoing translation.
     It holds and provides access to all already declared parameters, variables
     and resources, as well as some important aspects to be kept in mind.
     """
-    def __init__(self, location=constants.DEFAULT_LOCATION):
+    def __init__(self, location=constants.DEFAULT_LOCATION,
+                 resource_indexes=None):
         self.parameters = {}
         self.variables = {}
         self.resources = []
 
+        # resource_indexes is a mapping between sorted tuples of resource
+        # fields and the dicts which map the values of those fields to the
+        # first resource added which has them:
+        self._resource_indexes = {}
+        if resource_indexes is None:
+            resource_indexes = DEFAULT_RESOURCE_INDEXES
+        for fields in resource_indexes:
+            self.add_resource_index(fields)
+
+        # references is a mapping between the names of Heat resources and
+        # the list of (referrer name, property name, referrer type) tuples
+        # describing the Heat resources which reference them:
+        self.references = collections.defaultdict(list)
+
         # availability_set_names is a list of the names of availability sets
         # registered so far to exist. It is necessary due to the fact that it
         # is mostly the translator's jobs to add new ones if necessary.
@@ -47,6 +70,11 @@ class Context(object):
         # is required to be created for the deployment
         self.__new_virtual_network_required = False
 
+        # strings maps all the strings added to the context so far to
+        # themselves, so that identical strings built by the translators for
+        # each resource are only held in memory once:
+        self._strings = {}
+
         self.variables["location"] = location
 
     def get_template_data(self):
@@ -59,6 +87,10 @@ class Context(object):
         if self.__new_virtual_network_required:
             self.__set_virtual_network_resource()
 
+        # NOTE: the strings within the template data are already shared, so
+        # the table is no longer needed:
+        self._strings.clear()
+
         return {
             "parameters": self.parameters,
             "variables": self.variables,
@@ -68,17 +100,97 @@ class Context(object):
     def add_parameters(self, parameters):
         """ add_parameters adds the given parameters to the context.
         """
-        self.parameters.update(parameters)
+        self.parameters.update(self._share_strings(parameters))
 
     def add_variables(self, variables):
         """ add_variables adds the given dict of variables to the context.
         """
-        self.variables.update(variables)
+        self.variables.update(self._share_strings(variables))
 
     def add_resource(self, resource):
         """ add_resource adds a resource to the context's resources.
         """
-        self.resources.append(resource)
+        self.resources.append(self._share_strings(resource))
+        self.__index_resource(resource)
+
+    def _share_strings(self, value):
+        """ _share_strings is a helper method which replaces all the strings
+        within the given value in place by the identical ones added to the
+        context before, if any, and returns it.
+        """
+        if isinstance(value, dict):
+            for key, val in value.items():
+                value[key] = self._share_strings(val)
+        elif isinstance(value, list):
+            for i, val in enumerate(value):
+                value[i] = self._share_strings(val)
+        elif hasattr(value, "lower"):
+            return self._strings.setdefault(value, value)
+
+        return value
+
+    def apply_fragment(self, fragment):
+        """ apply_fragment adds all the parameters, variables and resources
+        recorded within the given ContextFragment to the context, and flags
+        any of the default resources it requires.
+
+        It raises an exception if any of the fragment's parameters or
+        variables was already added with a different value.
+        """
+        for (kind, added, new) in [("parameter", self.parameters,
+                                    fragment.parameters),
+                                   ("variable", self.variables,
+                                    fragment.variables)]:
+            for (name, value) in new.items():
+                if name in added and added[name] != value:
+                    raise Exception(
+                        'The translation of "%s" conflicts with the existing '
+                        'ARM template %s "%s".' % (fragment.name, kind, name))
+
+        self.add_parameters(fragment.parameters)
+        self.add_variables(fragment.variables)
+        for res in fragment.resources:
+            self.add_resource(res)
+
+        if fragment.storage_account_required:
+            self.set_storage_account_required()
+        if fragment.virtual_network_required:
+            self.set_virtual_network_required()
+
+    def add_resource_index(self, fields):
+        """ add_resource_index declares the given fields as a lookup key for
+        get_resource and indexes all the resources added so far by it.
+
+        NOTE: the values of the indexed fields of a resource are expected not
+        to change after the resource has been added to the context.
+        """
+        fields = tuple(sorted(fields))
+        if fields in self._resource_indexes:
+            return
+
+        self._resource_indexes[fields] = {}
+        for res in self.resources:
+            self.__index_resource(res, [fields])
+
+    def add_reference(self, referenced, referrer, property_name,
+                      referrer_type):
+        """ add_reference records that the Heat resource named referrer of
+        the given type references the resource named referenced through the
+        given property.
+        """
+        self.references[referenced].append(
+            (referrer, property_name, referrer_type))
+
+    def get_referrers(self, referenced, referrer_type=None,
+                      property_name=None):
+        """ get_referrers returns the list of (referrer name, property name,
+        referrer type) tuples of all the Heat resources which reference the
+        given one, optionally filtered by the type of the referrer and the
+        name of the property the reference is made through.
+        """
+        return [ref for ref in self.references.get(referenced, [])
+                if (referrer_type is None or ref[2] == referrer_type) and
+                (property_name is None or ref[1] == property_name)]
 
     def set_storage_account_required(self):
         """ set_storage_account_required sets the
@@ -95,12 +207,43 @@ class Context(object):
     def get_resource(self, resource):
         """ get_resource returns the dict of the resource which matches the
         given fields.
+
+        Lookups on fields which have been declared as an index are done in
+        constant time; any other lookup falls back to a linear scan.
         """
+        fields = tuple(sorted(resource))
+        index = self._resource_indexes.get(fields)
+        if index is not None:
+            try:
+                return index.get(tuple(resource[f] for f in fields))
+            except TypeError:
+                # the given values are unhashable; so do a full scan:
+                pass
+
         for res in self.resources:
             if all((k in res and res[k] == v) for k, v in
                    resource.items()):
                 return res
 
+    def __index_resource(self, resource, indexes=None):
+        """ __index_resource is a helper method which adds the given resource
+        to the given indexes, or to all the indexes if none are provided.
+        """
+        if indexes is None:
+            indexes = self._resource_indexes
+
+        for fields in indexes:
+            if not all(f in resource for f in fields):
+                continue
+
+            try:
+                self._resource_indexes[fields].setdefault(
+                    tuple(resource[f] for f in fields), resource)
+            except TypeError:
+                # NOTE: resources with unhashable values for the indexed
+                # fields are only reachable through the linear scan.
+                pass
+
     def __set_storage_account_resource(self):
         """ __set_storage_account_resource is a helper method which sets the
         parameters, variables and resource data for the default storage account
@@ -122,7 +265,7 @@ class Context(object):
                 cfg.CONF.default_storage_container_name,
         })
 
-        self.resources.append({
+        self.add_resource({
             "type": "Microsoft.Storage/storageAccounts",
             "name": "[parameters('newStorageAccountName')]",
             "apiVersion": constants.ARM_API_VERSION,
@@ -156,7 +299,7 @@ class Context(object):
                                 "'/subnets/',variables('defaultSubnetName'))]"
         })
 
-        self.resources.append({
+        self.add_resource({
             "type": "Microsoft.Network/virtualNetworks",
             "name": "[parameters('newVirtualNetworkName')]",
             "apiVersion": constants.ARM_API_VERSION,
@@ -175,3 +318,93 @@ class Context(object):
                 }
             },
         })
+
+
+class ContextFragment(object):
+    """ ContextFragment records the parameters, variables and resources added
+    by a single translator, as well as the default resources it requires,
+    without altering the translation context; so that they may be applied
+    to it later on through Context.apply_fragment.
+
+    Reads of the Heat resource references are passed on to the given
+    context, whose reference index is expected to be complete.
+    """
+    def __init__(self, context=None, name=None):
+        self._context = context
+
+        # name is the name of the Heat resource whose translation the
+        # fragment holds:
+        self.name = name
+
+        self.parameters = {}
+        self.variables = {}
+        self.resources = []
+
+        self.storage_account_required = False
+        self.virtual_network_required = False
+
+    def add_parameters(self, parameters):
+        """ add_parameters adds the given parameters to the fragment. """
+        self.parameters.update(parameters)
+
+    def add_variables(self, variables):
+        """ add_variables adds the given dict of variables to the fragment.
+        """
+        self.variables.update(variables)
+
+    def add_resource(self, resource):
+        """ add_resource adds a resource to the fragment's resources. """
+        self.resources.append(resource)
+
+    def get_referrers(self, referenced, referrer_type=None,
+                      property_name=None):
+        """ get_referrers returns the referrers of the given Heat resource
+        from the context; as described by Context.get_referrers.
+        """
+        return self._context.get_referrers(referenced, referrer_type,
+                                           property_name)
+
+    def set_storage_account_required(self):
+        """ set_storage_account_required records that the default storage
+        account is required.
+        """
+        self.storage_account_required = True
+
+    def set_virtual_network_required(self):
+        """ set_virtual_network_required records that the default virtual
+        network is required.
+        """
+        self.virtual_network_required = True
+
+    def __getstate__(self):
+        """ __getstate__ returns the state of the fragment to be pickled,
+        leaving out the context it reads from.
+        """
+        state = self.__dict__.copy()
+        state["_context"] = None
+        return state
+
+    def to_dict(self):
+        """ to_dict returns the fragment as a JSON-serializable dict. """
+        return {
+            "name": self.name,
+            "parameters": self.parameters,
+            "variables": self.variables,
+            "resources": self.resources,
+            "storage_account_required": self.storage_account_required,
+            "virtual_network_required": self.virtual_network_required,
+        }
+
+    @classmethod
+    def from_dict(cls, data, context=None):
+        """ from_dict returns the ContextFragment described by the given dict
+        returned by to_dict.
+        """
+        fragment = cls(context, data.get("name"))
+        fragment.parameters = data["parameters"]
+        fragment.variables = data["variables"]
+        fragment.resources = data["resources"]
+        fragment.storage_account_required = data["storage_account_required"]
+        fragment.virtual_network_required = data["virtual_network_required"]
+
+        return fragment
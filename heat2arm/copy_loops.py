@@ -0,0 +1,447 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Contains the compaction of ARM templates which rewrites groups of
+    homogeneous resources into copy loops.
+
+    Resources are grouped together if they are of the same type and API
+    version and their definitions only differ by the string literals, the
+    string variables and the parameters they reference, such as all the VMs
+    translated from identical Nova servers:
+        "name": "[variables('vmName_server1')]"
+        "name": "[variables('vmName_server2')]"
+    Each group is replaced by a single resource which is deployed in a loop,
+    with the differing values moved to array variables indexed by the loop:
+        "name": "[variables('vmName_vmNameLoop')[copyIndex()]]"
+        "copy": {"name": "vmNameLoop", "count": 2}
+    Values which only differed by the variables they were read from, such as
+    each VM's size, are inlined instead; while differing parameters, such as
+    the size of each VM's data disk, and variables holding expressions are
+    referenced from within the arrays, which ARM evaluates:
+        "size_vmNameLoop": ["[parameters('size_server1_volume')]", ...]
+
+    Groups whose members differ in any other way or which depend on one
+    another are left as they are.
+"""
+
+import collections
+import json
+import re
+
+from oslo_config import cfg
+
+from heat2arm import dependencies
+
+CONF = cfg.CONF
+
+# _TOKEN_REGEX matches the parts of ARM expressions which may differ between
+# the members of a copy loop; that is parameter and variable references and
+# string literals:
+_TOKEN_REGEX = re.compile(
+    r"parameters\('((?:[^']|'')*)'\)|variables\('([^']*)'\)|"
+    r"'((?:[^']|'')*)'")
+
+# _VARIABLE_REGEX matches all variable references in ARM expressions:
+_VARIABLE_REGEX = re.compile(r"variables\('([^']*)'\)")
+
+# _PLACEHOLDER replaces the tokens within the skeletons of strings:
+_PLACEHOLDER = "\0"
+
+# _KEY_FIELDS are the fields of resources which all the members of a copy
+# loop must share as they are, and which are never tokenized:
+_KEY_FIELDS = ("type", "apiVersion")
+
+# _LITERAL, _VARIABLE, _EXPRESSION and _PARAMETER are the kinds of tokens;
+# variables holding plain strings being _VARIABLE tokens and those holding
+# expressions _EXPRESSION ones:
+_LITERAL = "literal"
+_VARIABLE = "variable"
+_EXPRESSION = "expression"
+_PARAMETER = "parameter"
+
+# _REFERENCE_KINDS are the kinds of tokens which are referenced from within
+# array variables rather than inlined:
+_REFERENCE_KINDS = frozenset([_EXPRESSION, _PARAMETER])
+
+
+def _is_literal(value):
+    """ _is_literal is a helper function which checks whether the given
+    template value is a plain string rather than an expression.
+    """
+    return hasattr(value, "lower") and not value.startswith("[")
+
+
+def _quote(value):
+    """ _quote is a helper function which returns the ARM string literal of
+    the given value.
+    """
+    return "'%s'" % value.replace("'", "''")
+
+
+def _tokenize(value, variables):
+    """ _tokenize is a helper function which splits the given string from a
+    resource's definition into its skeleton, which holds all its parts which
+    may not differ within a copy loop, and the list of its tokens.
+
+    Each token is a tuple of its value, the name of the variable or
+    parameter it was read from, if any, and its kind. The value of parameter
+    tokens is the reference to the parameter and that of variable tokens the
+    string the variable holds, while references to variables holding
+    anything but strings are part of the skeleton.
+    """
+    if _is_literal(value):
+        return (_PLACEHOLDER, [(value, None, _LITERAL)])
+
+    skeleton = []
+    tokens = []
+    position = 0
+    for match in _TOKEN_REGEX.finditer(value):
+        (parameter, variable, literal) = match.groups()
+        if parameter is not None:
+            tokens.append((match.group(0), parameter, _PARAMETER))
+        elif variable is not None:
+            value_kind = _VARIABLE if _is_literal(
+                variables.get(variable)) else _EXPRESSION
+            if not hasattr(variables.get(variable), "lower"):
+                continue
+            tokens.append((variables[variable], variable, value_kind))
+        else:
+            tokens.append((literal.replace("''", "'"), None, _LITERAL))
+
+        skeleton.append(value[position:match.start()])
+        skeleton.append(_PLACEHOLDER)
+        position = match.end()
+    skeleton.append(value[position:])
+
+    return ("".join(skeleton), tokens)
+
+
+def _get_skeleton(value, variables, leaves, path=()):
+    """ _get_skeleton is a helper function which returns the skeleton of the
+    given resource definition, where all strings are replaced by their own
+    skeletons, recording the original value, skeleton and tokens of each
+    string in the given dict of leaves under its path.
+
+    The fields of the resource which make up its key are left as they are.
+    """
+    if len(path) == 1 and path[0] in _KEY_FIELDS:
+        return value
+    if isinstance(value, dict):
+        return dict((key, _get_skeleton(val, variables, leaves,
+                                        path + (key,)))
+                    for key, val in value.items())
+    if isinstance(value, list):
+        return [_get_skeleton(val, variables, leaves, path + (i,))
+                for i, val in enumerate(value)]
+    if hasattr(value, "lower"):
+        (skeleton, tokens) = _tokenize(value, variables)
+        leaves[path] = (value, skeleton, tokens)
+        return skeleton
+
+    return value
+
+
+def _rebuild(value, leaves, path=()):
+    """ _rebuild is a helper function which returns a copy of the given
+    resource definition with all its strings replaced by those of the given
+    dict of leaves under their path, if any.
+    """
+    if isinstance(value, dict):
+        return collections.OrderedDict(
+            (key, _rebuild(val, leaves, path + (key,)))
+            for key, val in value.items())
+    if isinstance(value, list):
+        return [_rebuild(val, leaves, path + (i,))
+                for i, val in enumerate(value)]
+    if hasattr(value, "lower"):
+        return leaves.get(path, value)
+
+    return value
+
+
+def _get_array_element(value, kind):
+    """ _get_array_element is a helper function which returns the element of
+    an array variable holding the given value of a token of the given kind.
+    """
+    if kind == _PARAMETER:
+        return "[%s]" % value
+    if kind == _EXPRESSION:
+        return value
+    if value.startswith("["):
+        return "[" + value
+
+    return value
+
+
+def _get_name_variable(resource):
+    """ _get_name_variable is a helper function which returns the name of the
+    variable the given resource's name is read from, if any.
+    """
+    match = _VARIABLE_REGEX.match(resource["name"][1:-1])
+    if match and resource["name"] == "[%s]" % match.group(0):
+        return match.group(1)
+
+    return None
+
+
+def _get_common_prefix(names):
+    """ _get_common_prefix is a helper function which returns the part before
+    the first underscore which all the given variable names share, if any.
+    """
+    if not all(names) or "_" not in names[0]:
+        return None
+
+    prefix = names[0].split("_")[0]
+    if all(name.startswith(prefix + "_") for name in names):
+        return prefix
+
+    return None
+
+
+class _LoopBuilder(object):
+    """ _LoopBuilder is a helper class which rewrites a group of homogeneous
+    resources into a single resource within a copy loop.
+    """
+    def __init__(self, members, variables, used_names, arrays):
+        if len(set(_get_group_key(res) for res in members)) != 1:
+            raise Exception(
+                "Resources of different types or API versions may not be "
+                "deployed in the same copy loop: %s." % ", ".join(
+                    sorted(set("%s@%s" % _get_group_key(res)
+                               for res in members))))
+
+        self.members = members
+        self.variables = variables
+
+        # arrays maps the tuples of the values of all the array variables
+        # added for all the loops to their names:
+        self.arrays = arrays
+
+        # NOTE: the translators name resources' variables after their type
+        # and Heat resource; for example vmName_server1. So loops and their
+        # arrays are named after the common prefix of those variables:
+        base = members[0]["type"].split("/")[-1]
+        prefix = _get_common_prefix(
+            [_get_name_variable(res) for res in members])
+        if prefix:
+            base = prefix
+
+        self.loop_name = "%sLoop" % base
+        count = 1
+        while self.loop_name in used_names:
+            count += 1
+            self.loop_name = "%s%dLoop" % (base, count)
+        used_names.add(self.loop_name)
+
+    def _is_free(self, name):
+        """ _is_free is a helper method which checks whether the given name
+        is neither used by a variable nor by another array.
+        """
+        return name not in self.variables and (
+            name not in self.arrays.values())
+
+    def _get_array_name(self, origins):
+        """ _get_array_name is a helper method which returns the name of a
+        new array variable for the values read from the variables with the
+        given names, if any.
+        """
+        prefix = _get_common_prefix(origins)
+        if prefix and self._is_free("%s_%s" % (prefix, self.loop_name)):
+            return "%s_%s" % (prefix, self.loop_name)
+
+        count = 0
+        name = "%s_%d" % (self.loop_name, count)
+        while not self._is_free(name):
+            count += 1
+            name = "%s_%d" % (self.loop_name, count)
+        return name
+
+    def _get_array(self, tokens):
+        """ _get_array is a helper method which returns the name of the array
+        variable holding the values of the given tokens, adding it if
+        required.
+
+        Parameter tokens are held as references to the parameters, which ARM
+        evaluates within variables, while literal values which would be
+        taken for expressions are escaped.
+        """
+        values = tuple(_get_array_element(value, kind)
+                       for (value, _, kind) in tokens)
+        if values not in self.arrays:
+            self.arrays[values] = self._get_array_name(
+                [origin for (_, origin, _) in tokens])
+
+        return self.arrays[values]
+
+    def _render_leaf(self, leaves):
+        """ _render_leaf is a helper method which returns the string which
+        replaces the given leaves of all the members within the loop.
+        """
+        if len(set(original for (original, _, _) in leaves)) == 1:
+            return leaves[0][0]
+
+        skeleton = leaves[0][1]
+        whole = skeleton in (_PLACEHOLDER, "[%s]" % _PLACEHOLDER)
+        parts = skeleton.split(_PLACEHOLDER)
+
+        tokens = []
+        for i in range(len(parts) - 1):
+            column = [tokens_list[i] for (_, _, tokens_list) in leaves]
+            values = set(value for (value, _, _) in column)
+            origins = set(origin for (_, origin, _) in column)
+            kinds = set(kind for (_, _, kind) in column)
+            if kinds == set([_PARAMETER]) and len(values) == 1:
+                # the same parameter is referenced by all:
+                tokens.append(values.pop())
+            elif (_PARAMETER not in kinds and len(origins) == 1 and
+                    None not in origins):
+                # the same variable is referenced by all:
+                tokens.append("variables('%s')" % origins.pop())
+            elif kinds & _REFERENCE_KINDS:
+                tokens.append("variables('%s')[copyIndex()]" % (
+                    self._get_array(column)))
+            elif len(values) == 1:
+                value = values.pop()
+                if whole:
+                    # the whole string is a single value shared by all:
+                    return value if not value.startswith("[") else (
+                        "[" + value)
+                tokens.append(_quote(value))
+            else:
+                tokens.append("variables('%s')[copyIndex()]" % (
+                    self._get_array(column)))
+
+        if skeleton == _PLACEHOLDER:
+            return "[%s]" % tokens[0]
+
+        rendered = [parts[0]]
+        for (token, part) in zip(tokens, parts[1:]):
+            rendered.extend([token, part])
+        return "".join(rendered)
+
+    def build(self, member_leaves):
+        """ build returns the resource deployed in a copy loop which replaces
+        all the members, out of the leaves of each of them.
+        """
+        leaves = dict(
+            (path, self._render_leaf([leaves[path]
+                                      for leaves in member_leaves]))
+            for path in member_leaves[0])
+
+        resource = _rebuild(self.members[0], leaves)
+        resource["copy"] = collections.OrderedDict([
+            ("name", self.loop_name),
+            ("count", len(self.members)),
+        ])
+
+        return resource
+
+
+def _get_group_key(resource):
+    """ _get_group_key is a helper function which returns the (type, API
+    version) tuple which all the members of a copy loop must share.
+    """
+    return tuple(resource.get(field) for field in _KEY_FIELDS)
+
+
+def _are_independent(members):
+    """ _are_independent is a helper function which checks that none of the
+    given resources depends on any other.
+    """
+    keys = set(dependencies.get_resource_key(res) for res in members)
+    for res in members:
+        for dependency in res.get("dependsOn", []):
+            if dependencies.parse_dependency(dependency) in keys:
+                return False
+
+    return True
+
+
+def _get_referenced_variables(value, referenced):
+    """ _get_referenced_variables is a helper function which adds the names
+    of all the variables referenced within the given value to the given set.
+    """
+    if isinstance(value, dict):
+        for val in value.values():
+            _get_referenced_variables(val, referenced)
+    elif isinstance(value, list):
+        for val in value:
+            _get_referenced_variables(val, referenced)
+    elif hasattr(value, "lower"):
+        referenced.update(_VARIABLE_REGEX.findall(value))
+
+
+def build_copy_loops(template_data, min_count=None):
+    """ build_copy_loops rewrites all the groups of at least the given number
+    of homogeneous resources of the given ARM template data into copy loops,
+    adding the array variables they require and removing any variables
+    which are no longer referenced.
+
+    min_count defaults to the value of the arm_copy_loop_min_count option.
+    """
+    if min_count is None:
+        CONF.import_opt("arm_copy_loop_min_count",
+                        "heat2arm.translation_engine")
+        min_count = CONF.arm_copy_loop_min_count
+
+    variables = template_data["variables"]
+    resources = template_data["resources"]
+
+    groups = collections.OrderedDict()
+    for i, resource in enumerate(resources):
+        if "copy" in resource or not hasattr(resource.get("name"), "lower"):
+            continue
+
+        leaves = {}
+        skeleton = _get_skeleton(resource, variables, leaves)
+        key = json.dumps([_get_group_key(resource), skeleton],
+                         sort_keys=True)
+        groups.setdefault(key, []).append((i, leaves))
+
+    replaced = {}
+    removed = set()
+    inlined = set()
+    loop_names = set()
+    arrays = collections.OrderedDict()
+    for group in groups.values():
+        members = [resources[i] for (i, _) in group]
+        if len(group) < min_count or not _are_independent(members):
+            continue
+
+        builder = _LoopBuilder(members, variables, loop_names, arrays)
+        replaced[group[0][0]] = builder.build(
+            [leaves for (_, leaves) in group])
+        removed.update(i for (i, _) in group[1:])
+
+        for member in members:
+            _get_referenced_variables(member, inlined)
+
+    if not replaced:
+        return
+
+    for (values, name) in arrays.items():
+        variables[name] = list(values)
+
+    template_data["resources"] = [
+        replaced.get(i, res) for i, res in enumerate(resources)
+        if i not in removed]
+
+    referenced = set()
+    _get_referenced_variables(template_data["resources"], referenced)
+    _get_referenced_variables(variables, referenced)
+    for name in inlined - referenced:
+        if hasattr(variables.get(name), "lower"):
+            del variables[name]
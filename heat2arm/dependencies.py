@@ -0,0 +1,262 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Contains the dependency graph between the resources of an ARM template,
+    which is built out of their dependsOn lists.
+
+    The graph is used to deduplicate the dependsOn lists emitted by the
+    translators and to reduce them to their transitive reduction, as any
+    dependency which is implied by another one only serializes the deployment
+    further.
+"""
+
+import re
+
+# _CONCAT_DEPENDENCY_REGEX matches dependencies of the form:
+#   [concat('Microsoft.Compute/virtualMachines/', variables('vmName'))]
+_CONCAT_DEPENDENCY_REGEX = re.compile(
+    r"^\[\s*concat\(\s*'([^']+?)/'\s*,(.*)\)\s*\]$")
+
+# _RESOURCE_ID_DEPENDENCY_REGEX matches dependencies of the form:
+#   [resourceId('Microsoft.Compute/virtualMachines', variables('vmName'))]
+_RESOURCE_ID_DEPENDENCY_REGEX = re.compile(
+    r"^\[\s*resourceId\(\s*'([^']+?)'\s*,(.*)\)\s*\]$")
+
+
+def split_args(args):
+    """ split_args splits the given string of comma-separated ARM function
+    arguments into the list of its top-level arguments, stripped of
+    whitespace.
+    """
+    parts = []
+    depth = 0
+    quoted = False
+    start = 0
+    for i, char in enumerate(args):
+        if char == "'":
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif char == "," and not depth:
+            parts.append(args[start:i].strip())
+            start = i + 1
+    parts.append(args[start:].strip())
+
+    return parts
+
+
+def _get_name_expression(args):
+    """ _get_name_expression is a helper function which returns the
+    normalized expression of a resource's name out of the given list of the
+    arguments which make it up.
+    """
+    args = split_args(args)
+    if len(args) == 1:
+        return args[0]
+
+    return "concat(%s)" % ",".join(args)
+
+
+def get_resource_key(resource):
+    """ get_resource_key returns the (type, name expression) key of the given
+    ARM resource, which is what dependencies on it are resolved against.
+
+    The name expression is the ARM expression of the resource's name without
+    its enclosing brackets or, for literal names, the quoted name.
+    """
+    name = resource["name"]
+    if name.startswith("[") and name.endswith("]"):
+        name = _get_name_expression(name[1:-1])
+    else:
+        name = "'%s'" % name
+
+    return (resource["type"], name)
+
+
+def parse_dependency(dependency):
+    """ parse_dependency returns the (type, name expression) key of the
+    resource referenced by the given dependsOn entry, or None if the entry
+    is not a resource ID expression, in which case it may be a plain name.
+    """
+    for regex in (_CONCAT_DEPENDENCY_REGEX, _RESOURCE_ID_DEPENDENCY_REGEX):
+        match = regex.match(dependency)
+        if match:
+            return (match.group(1), _get_name_expression(match.group(2)))
+
+    return None
+
+
+class DependencyGraph(object):
+    """ DependencyGraph is the directed graph of the dependencies between the
+    given list of ARM resources, each of them being designated by its index
+    within the list.
+
+    Any dependencies on resources outside of the list are kept aside as
+    unresolved and are never altered.
+    """
+    def __init__(self, resources):
+        self.resources = resources
+
+        self._indexes = {}
+        names = {}
+        for i, resource in enumerate(resources):
+            key = get_resource_key(resource)
+            self._indexes.setdefault(key, i)
+            names.setdefault(key[1], []).append(i)
+
+        # edges holds the ordered list of the indexes of the resources each
+        # resource depends on, and dependency_strings the original dependsOn
+        # entries each of those edges was built from:
+        self.edges = []
+        self.dependency_strings = []
+
+        # unresolved holds the dependsOn entries of each resource which do
+        # not match any resource in the list:
+        self.unresolved = []
+
+        for resource in resources:
+            edges = []
+            strings = {}
+            unresolved = []
+            for dependency in resource.get("dependsOn", []):
+                index = self._resolve(dependency, names)
+                if index is None:
+                    if dependency not in unresolved:
+                        unresolved.append(dependency)
+                elif index not in strings:
+                    edges.append(index)
+                    strings[index] = dependency
+
+            self.edges.append(edges)
+            self.dependency_strings.append(strings)
+            self.unresolved.append(unresolved)
+
+    def _resolve(self, dependency, names):
+        """ _resolve is a helper method which returns the index of the
+        resource the given dependsOn entry references, or None if there is
+        no such resource.
+        """
+        key = parse_dependency(dependency)
+        if key is not None:
+            return self._indexes.get(key)
+
+        # plain names are valid as long as they are unique:
+        matches = names.get("'%s'" % dependency, [])
+        if len(matches) == 1:
+            return matches[0]
+
+        return None
+
+    def _find_cycle(self, remaining):
+        """ _find_cycle is a helper method which returns the list of indexes
+        making up a dependency cycle between the given remaining resources.
+        """
+        start = min(remaining)
+        path = [start]
+        seen = {start: 0}
+        while True:
+            nxt = [dep for dep in self.edges[path[-1]] if dep in remaining][0]
+            if nxt in seen:
+                return path[seen[nxt]:] + [nxt]
+            seen[nxt] = len(path)
+            path.append(nxt)
+
+    def topological_order(self):
+        """ topological_order returns the list of the indexes of all the
+        resources, ordered so that every resource comes after all of its
+        dependencies.
+
+        It raises an exception describing the cycle if the dependencies of
+        the resources are circular.
+        """
+        dependents = [[] for _ in self.resources]
+        pending = [len(edges) for edges in self.edges]
+        for i, edges in enumerate(self.edges):
+            for dep in edges:
+                dependents[dep].append(i)
+
+        order = [i for i, count in enumerate(pending) if not count]
+        for i in order:
+            for dependent in dependents[i]:
+                pending[dependent] -= 1
+                if not pending[dependent]:
+                    order.append(dependent)
+
+        if len(order) < len(self.resources):
+            remaining = set(range(len(self.resources))) - set(order)
+            cycle = self._find_cycle(remaining)
+            raise Exception(
+                "Circular dependency between the ARM resources: %s" %
+                " -> ".join('%s "%s"' % (self.resources[i]["type"],
+                                          self.resources[i]["name"])
+                            for i in cycle))
+
+        return order
+
+    def reduce(self):
+        """ reduce removes all the edges of the graph which are implied by
+        others, leaving its transitive reduction.
+
+        The resources reachable from each resource are tracked as bitsets,
+        built up in topological order.
+        """
+        reachable = [0] * len(self.resources)
+        for i in self.topological_order():
+            indirect = 0
+            for dep in self.edges[i]:
+                indirect |= reachable[dep]
+
+            self.edges[i] = [dep for dep in self.edges[i]
+                             if not (indirect >> dep) & 1]
+
+            for dep in self.edges[i]:
+                indirect |= 1 << dep
+            reachable[i] = indirect
+
+    def apply(self):
+        """ apply rewrites the dependsOn lists of all the resources from the
+        edges of the graph, keeping their original entries and order.
+        """
+        for i, resource in enumerate(self.resources):
+            if "dependsOn" not in resource:
+                continue
+
+            kept = set(self.unresolved[i])
+            kept.update(self.dependency_strings[i][dep]
+                        for dep in self.edges[i])
+
+            dependencies = []
+            for dependency in resource["dependsOn"]:
+                if dependency in kept:
+                    dependencies.append(dependency)
+                    kept.remove(dependency)
+            resource["dependsOn"] = dependencies
+
+
+def reduce_dependencies(resources):
+    """ reduce_dependencies deduplicates the dependsOn lists of the given ARM
+    resources and strips them of all the dependencies which are implied by
+    others.
+
+    It raises an exception if the dependencies of the resources are circular.
+    """
+    graph = DependencyGraph(resources)
+    graph.reduce()
+    graph.apply()
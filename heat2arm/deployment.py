@@ -0,0 +1,322 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Contains the analysis of how an ARM template is going to be deployed,
+    based on the dependencies between its resources:
+        - the deployment waves: the resources in the Nth wave depend on
+        at least one resource of the previous wave, and on none of the later
+        ones; so all the resources of a wave may be deployed in parallel.
+        - the critical path: the chain of dependent resources which takes
+        the longest to deploy, according to the estimated deployment
+        duration of each type of resource.
+
+    Resources deployed in copy loops are expanded into one resource per
+    iteration beforehand, and the names of all the resources and of their
+    dependencies are evaluated against the template's variables where
+    possible; so that dependencies on single iterations of a loop, within a
+    loop through copyIndex() or on a whole loop by its name all resolve.
+
+        Usage example:
+
+    >>> from heat2arm import deployment
+    >>>
+    >>> analysis = deployment.analyze(arm_template_data["resources"],
+    ...                               arm_template_data["variables"])
+    >>> analysis.write_report(sys.stdout)
+"""
+
+import re
+
+from oslo_config import cfg
+
+from heat2arm import dependencies
+from heat2arm.dependencies import DependencyGraph
+
+CONF = cfg.CONF
+CONF.register_opts([
+    cfg.DictOpt(
+        'arm_resource_deploy_durations',
+        default={
+            "Microsoft.Compute/virtualMachines": "180",
+            "Microsoft.Compute/availabilitySets": "10",
+            "Microsoft.Network/virtualNetworks": "20",
+            "Microsoft.Network/networkInterfaces": "15",
+            "Microsoft.Network/publicIPAddresses": "15",
+            "Microsoft.Network/networkSecurityGroups": "15",
+            "Microsoft.Storage/storageAccounts": "30",
+        },
+        help='A map between ARM resource types and the estimated number of '
+             'seconds it takes to deploy them'),
+    cfg.FloatOpt(
+        'arm_default_deploy_duration',
+        default=15,
+        help='The estimated number of seconds it takes to deploy an ARM '
+             'resource of a type with no configured duration'),
+])
+
+# _COPY_INDEX_REGEX matches the calls to copyIndex within ARM expressions,
+# along with their optional offset:
+_COPY_INDEX_REGEX = re.compile(r"copyIndex\(\s*(\d*)\s*\)")
+
+# _LITERAL_REGEX matches string literals within name expressions:
+_LITERAL_REGEX = re.compile(r"^'((?:[^']|'')*)'$")
+
+# _VARIABLE_REGEX matches references to variables, optionally indexed,
+# within name expressions:
+_VARIABLE_REGEX = re.compile(
+    r"^variables\('([^']*)'\)(?:\[\s*(\d+)\s*\])?$")
+
+
+def get_deploy_duration(resource_type):
+    """ get_deploy_duration returns the estimated number of seconds it takes
+    to deploy an ARM resource of the given type.
+    """
+    duration = CONF.arm_resource_deploy_durations.get(resource_type)
+    if duration is None:
+        return CONF.arm_default_deploy_duration
+
+    return float(duration)
+
+
+def _evaluate(expression, variables):
+    """ _evaluate is a helper function which returns the string the given
+    name expression evaluates to against the given variables, or None if it
+    is made up of anything but string and integer literals, variables and
+    their concatenation.
+    """
+    if expression.isdigit():
+        return expression
+
+    match = _LITERAL_REGEX.match(expression)
+    if match:
+        return match.group(1).replace("''", "'")
+
+    match = _VARIABLE_REGEX.match(expression)
+    if match:
+        value = variables.get(match.group(1))
+        if match.group(2) is not None:
+            try:
+                value = value[int(match.group(2))]
+            except (IndexError, KeyError, TypeError):
+                return None
+        if hasattr(value, "lower") and not value.startswith("["):
+            return value
+        return None
+
+    if expression.startswith("concat(") and expression.endswith(")"):
+        parts = [_evaluate(arg, variables)
+                 for arg in dependencies.split_args(expression[7:-1])]
+        if None not in parts:
+            return "".join(parts)
+
+    return None
+
+
+def _substitute_copy_index(value, index):
+    """ _substitute_copy_index is a helper function which returns the given
+    ARM expression with all the calls to copyIndex replaced by their value
+    in the iteration with the given index.
+    """
+    return _COPY_INDEX_REGEX.sub(
+        lambda match: str(index + int(match.group(1) or 0)), value)
+
+
+def _get_copy_count(copy):
+    """ _get_copy_count is a helper function which returns the number of
+    iterations of the given copy loop, or 1 if it cannot be evaluated.
+    """
+    try:
+        return max(int(copy.get("count")), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def expand_resources(resources, variables=None):
+    """ expand_resources returns the list of the resources deployed by the
+    given list of ARM resources; with those within copy loops expanded into
+    one per iteration, and the names of all the resources and of their
+    dependencies evaluated against the given variables where possible.
+
+    Each of the returned resources only holds its type, name and dependsOn
+    list; where dependencies on a copy loop by its name are replaced by
+    dependencies on all its iterations.
+    """
+    variables = variables or {}
+
+    # loops maps the names of the copy loops to the list of the dependsOn
+    # entries of their iterations:
+    loops = {}
+
+    expanded = []
+    for resource in resources:
+        copy = resource.get("copy")
+        indexes = [None]
+        if isinstance(copy, dict):
+            indexes = range(_get_copy_count(copy))
+
+        for index in indexes:
+            name = resource["name"]
+            depends_on = list(resource.get("dependsOn", []))
+            if index is not None:
+                name = _substitute_copy_index(name, index)
+                depends_on = [_substitute_copy_index(dep, index)
+                              for dep in depends_on]
+
+            member = {
+                "type": resource["type"],
+                "name": name,
+                "dependsOn": depends_on,
+            }
+            value = _evaluate(dependencies.get_resource_key(member)[1],
+                              variables)
+            if value is not None:
+                member["name"] = value
+            expanded.append(member)
+
+            if index is not None:
+                loops.setdefault(copy.get("name"), []).append(
+                    "[resourceId('%s', %s)]" %
+                    dependencies.get_resource_key(member))
+
+    for member in expanded:
+        depends_on = []
+        for dependency in member["dependsOn"]:
+            if dependency in loops:
+                depends_on.extend(loops[dependency])
+                continue
+
+            key = dependencies.parse_dependency(dependency)
+            if key is not None:
+                value = _evaluate(key[1], variables)
+                if value is not None:
+                    dependency = "[resourceId('%s', '%s')]" % (key[0], value)
+            depends_on.append(dependency)
+        member["dependsOn"] = depends_on
+
+    return expanded
+
+
+class DeploymentAnalysis(object):
+    """ DeploymentAnalysis holds the deployment waves and critical path of
+    the given list of ARM resources, whose names are evaluated against the
+    given variables.
+    """
+    def __init__(self, resources, variables=None):
+        self.resources = expand_resources(resources, variables)
+        resources = self.resources
+
+        graph = DependencyGraph(resources)
+        order = graph.topological_order()
+
+        self.durations = [get_deploy_duration(res["type"])
+                          for res in resources]
+
+        # wave and finish hold the deployment wave of each resource and the
+        # estimated time at which its deployment finishes:
+        wave = [0] * len(resources)
+        finish = [0.] * len(resources)
+        previous = [None] * len(resources)
+        for i in order:
+            for dep in graph.edges[i]:
+                wave[i] = max(wave[i], wave[dep] + 1)
+                if previous[i] is None or finish[dep] > finish[previous[i]]:
+                    previous[i] = dep
+            finish[i] = self.durations[i]
+            if previous[i] is not None:
+                finish[i] += finish[previous[i]]
+
+        self.waves = [[] for _ in range(max(wave) + 1 if wave else 0)]
+        for i in order:
+            self.waves[wave[i]].append(i)
+
+        # critical_path holds the indexes of the resources along the
+        # critical path, in deployment order:
+        self.critical_path = []
+        if resources:
+            last = max(range(len(resources)), key=lambda i: finish[i])
+            while last is not None:
+                self.critical_path.append(last)
+                last = previous[last]
+            self.critical_path.reverse()
+
+        self.finish_times = finish
+        self.total_duration = max(finish) if finish else 0.
+        self.serial_duration = sum(self.durations)
+
+    @property
+    def max_width(self):
+        """ max_width is the largest number of resources which may be
+        deployed in parallel within a single wave.
+        """
+        return max(len(wave) for wave in self.waves) if self.waves else 0
+
+    def _describe(self, index):
+        """ _describe is a helper method which returns the dict describing
+        the resource with the given index.
+        """
+        resource = self.resources[index]
+        return {
+            "type": resource["type"],
+            "name": resource["name"],
+            "duration": self.durations[index],
+            "finish": self.finish_times[index],
+        }
+
+    def to_dict(self):
+        """ to_dict returns the analysis as a JSON-serializable dict. """
+        return {
+            "resources": len(self.resources),
+            "estimated_duration": self.total_duration,
+            "serial_duration": self.serial_duration,
+            "max_width": self.max_width,
+            "waves": [{
+                "width": len(wave),
+                "types": sorted(set(self.resources[i]["type"]
+                                    for i in wave)),
+            } for wave in self.waves],
+            "critical_path": [self._describe(i) for i in self.critical_path],
+        }
+
+    def write_report(self, stream):
+        """ write_report writes a human-readable report of the analysis to
+        the given stream.
+        """
+        stream.write(
+            "%d resources in %d waves, at most %d in parallel.\n"
+            "Estimated deployment time: %.0fs (%.0fs if serialized).\n" % (
+                len(self.resources), len(self.waves), self.max_width,
+                self.total_duration, self.serial_duration))
+
+        stream.write("\n%6s %6s  %s\n" % ("Wave", "Width", "Types"))
+        for i, wave in enumerate(self.waves):
+            stream.write("%6d %6d  %s\n" % (
+                i, len(wave), ", ".join(sorted(set(
+                    self.resources[j]["type"] for j in wave)))))
+
+        stream.write("\nCritical path:\n")
+        for i in self.critical_path:
+            res = self._describe(i)
+            stream.write("%8.0fs  %s %s (%.0fs)\n" % (
+                res["finish"], res["type"], res["name"], res["duration"]))
+
+
+def analyze(resources, variables=None):
+    """ analyze returns the DeploymentAnalysis of the given list of ARM
+    resources, whose names are evaluated against the given variables.
+
+    It raises an exception if the dependencies of the resources are circular.
+    """
+    return DeploymentAnalysis(resources, variables)
@@ -0,0 +1,279 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Contains the incremental translation of Heat templates, which only runs
+    the translators of the Heat resources which changed since the previous
+    translation of the template.
+
+    The state of a translation holds the hash of each Heat resource's
+    definition, the Heat resources each of them references or is referenced
+    by, and the ContextFragment its translator produced. On the next
+    translation, the resources which were changed, added or removed and
+    their direct neighbours, whose translations read those of the changed
+    resources, are translated again; while the fragments of all the others
+    are reused as they are.
+
+    The ordered context updates and the optimizations over the whole ARM
+    template are always run again, as they may alter the resources of any
+    translator.
+
+    Any change to the template other than to its resources, such as to its
+    parameters, or to the configuration leads to a full translation.
+
+        Usage example:
+
+    >>> from heat2arm import incremental
+    >>>
+    >>> (arm_template_data, state) = incremental.convert_template(
+    ...     heat_template_data, previous_state)
+"""
+
+import hashlib
+import json
+import logging
+
+from heat2arm import cache
+from heat2arm.context import ContextFragment
+from heat2arm import profiling
+from heat2arm import translation_engine as engine
+
+LOG = logging.getLogger(__name__)
+
+# STATE_VERSION is the version of the format of the translation states,
+# which is increased on any incompatible change to it:
+STATE_VERSION = 1
+
+# RESOURCES_SECTIONS are the names of the sections of HOT and CFN templates
+# holding the definitions of their resources:
+RESOURCES_SECTIONS = ("resources", "Resources")
+
+# _ENCODER is the JSON encoder used for hashing resource definitions:
+_ENCODER = json.JSONEncoder(sort_keys=True)
+
+
+def _get_resource_definitions(heat_template_data):
+    """ _get_resource_definitions is a helper function which returns the
+    dict of the definitions of the resources within the given Heat template
+    data.
+    """
+    for section in RESOURCES_SECTIONS:
+        if section in heat_template_data:
+            return heat_template_data[section] or {}
+
+    return {}
+
+
+def _get_template_key(heat_template_data):
+    """ _get_template_key is a helper function which returns the hash of all
+    the sections of the given Heat template data besides its resources,
+    together with the configuration the template is translated with.
+    """
+    return cache.get_key(dict(
+        (key, value) for (key, value) in heat_template_data.items()
+        if key not in RESOURCES_SECTIONS))
+
+
+def _get_resource_hashes(heat_template_data):
+    """ _get_resource_hashes is a helper function which returns the dict of
+    the hashes of the definitions of all the resources within the given Heat
+    template data.
+    """
+    return dict(
+        (name, hashlib.sha1(_ENCODER.encode(definition).encode(
+            "utf-8")).hexdigest())
+        for (name, definition) in _get_resource_definitions(
+            heat_template_data).items())
+
+
+def _get_neighbours(context):
+    """ _get_neighbours is a helper function which returns the dict of the
+    sets of the names of the Heat resources each resource references or is
+    referenced by, out of the reference index of the given context.
+    """
+    neighbours = {}
+    for (referenced, referrers) in context.references.items():
+        names = neighbours.setdefault(referenced, set())
+        for (referrer, _, _) in referrers:
+            names.add(referrer)
+            neighbours.setdefault(referrer, set()).add(referenced)
+
+    return neighbours
+
+
+class TranslationState(object):
+    """ TranslationState holds all the information about the translation of
+    a Heat template required to translate the next version of it
+    incrementally.
+
+    It is written one line per Heat resource, holding the JSON of its hash
+    and neighbours and of its fragment separated by a tab; so that only the
+    fragments which are reused have to be parsed, and only the new ones
+    have to be serialized.
+    """
+    def __init__(self, key=None, resources=None):
+        # key is the hash of the template's sections besides its resources
+        # together with the configuration:
+        self.key = key
+
+        # resources maps the names of the Heat resources to tuples of the
+        # hash of their definition, their neighbours and the JSON of their
+        # fragment, or None for those which could not be translated:
+        self.resources = resources or {}
+
+    def get_affected(self, key, hashes, neighbours):
+        """ get_affected returns the set of the names of all the Heat
+        resources which must be translated again, given the key of the new
+        template, the hashes of its resources and their neighbours; or None
+        if the whole template must be translated again.
+        """
+        if key != self.key:
+            return None
+
+        changed = set(name for name in hashes
+                      if name not in self.resources or
+                      self.resources[name][0] != hashes[name])
+        changed.update(set(self.resources) - set(hashes))
+
+        affected = set(changed)
+        for name in changed:
+            affected.update(neighbours.get(name, []))
+            if name in self.resources:
+                affected.update(self.resources[name][1])
+
+        return affected
+
+    def get_fragment_text(self, name):
+        """ get_fragment_text returns the JSON of the stored fragment of the
+        Heat resource with the given name, or None if there is none.
+        """
+        if name not in self.resources:
+            return None
+
+        return self.resources[name][2]
+
+    def dump(self, stream):
+        """ dump writes the state to the given stream. """
+        stream.write("%s\n" % json.dumps(
+            {"version": STATE_VERSION, "key": self.key}))
+        for (name, (res_hash, neighbours, text)) in sorted(
+                self.resources.items()):
+            stream.write("%s\t%s\n" % (
+                json.dumps([name, res_hash, sorted(neighbours)]),
+                text or "null"))
+
+    @classmethod
+    def load(cls, stream):
+        """ load reads the state from the given stream, returning an empty
+        state if it is of another version.
+        """
+        header = json.loads(stream.readline() or "{}")
+        if header.get("version") != STATE_VERSION:
+            LOG.warn("Ignoring translation state of version %s.",
+                     header.get("version"))
+            return cls()
+
+        resources = {}
+        for line in stream:
+            (info, text) = line.rstrip("\n").split("\t", 1)
+            (name, res_hash, neighbours) = json.loads(info)
+            resources[name] = (res_hash, neighbours,
+                               text if text != "null" else None)
+
+        return cls(header["key"], resources)
+
+
+def load_state(stream):
+    """ load_state reads the TranslationState from the given stream. """
+    return TranslationState.load(stream)
+
+
+def dump_state(state, stream):
+    """ dump_state writes the given TranslationState to the given stream. """
+    state.dump(stream)
+
+
+def convert_template(heat_template_data, state=None, fast=None,
+                     profiler=None):
+    """ convert_template converts the given Heat template data into an ARM
+    template, only translating the resources affected by the changes since
+    the translation the given TranslationState was returned by, if any.
+
+    It returns a tuple of the ARM template data and of the TranslationState
+    to pass on to the next translation.
+    """
+    if profiler is None:
+        profiler = profiling.NULL_PROFILER
+    if state is None:
+        state = TranslationState()
+
+    (context, arm_resources) = engine.prepare_translation(
+        heat_template_data, fast, profiler)
+
+    with profiler.phase("diff"):
+        key = _get_template_key(heat_template_data)
+        hashes = _get_resource_hashes(heat_template_data)
+        neighbours = _get_neighbours(context)
+        affected = state.get_affected(key, hashes, neighbours)
+
+    texts = {}
+    with profiler.phase("translate"):
+        pending = []
+        for resource in arm_resources:
+            text = None
+            if affected is not None and resource._name not in affected:
+                text = state.get_fragment_text(resource._name)
+
+            if text is None:
+                pending.append(resource)
+            else:
+                texts[resource._name] = text
+
+        fragments = dict(zip(
+            [resource._name for resource in pending],
+            engine.compute_fragments(
+                pending, engine.CONF.translation_workers, profiler)))
+
+        # NOTE: the fragments' resources may be altered from now on, so
+        # they are serialized beforehand:
+        for (name, fragment) in fragments.items():
+            texts[name] = json.dumps(fragment.to_dict())
+
+    LOG.info("Translated %d out of %d resources.", len(pending),
+             len(arm_resources))
+
+    with profiler.phase("merge"):
+        for resource in arm_resources:
+            fragment = fragments.get(resource._name)
+            if fragment is None:
+                fragment = ContextFragment.from_dict(
+                    json.loads(texts[resource._name]))
+            context.apply_fragment(fragment)
+
+    new_state = TranslationState(key, dict(
+        (name, (hashes[name], neighbours.get(name, ()), texts.get(name)))
+        for name in hashes))
+
+    with profiler.phase("update_context"):
+        engine.run_context_updates(arm_resources, profiler)
+
+    with profiler.phase("assemble"):
+        arm_template_data = engine.assemble_arm_template(context)
+
+    arm_template_data = engine.process_arm_template(arm_template_data,
+                                                    profiler)
+    engine.check_arm_template(arm_template_data, profiler)
+
+    return (arm_template_data, new_state)
@@ -0,0 +1,258 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Contains the pre-flight check of ARM templates against the limits Azure
+    Resource Manager enforces on deployments, so that a template which would
+    be rejected is reported before being uploaded.
+
+    The checked figures are:
+        - the size of the template, as compact JSON.
+        - the numbers of resources, parameters, variables and outputs.
+        - the length of every template expression.
+        - the size of the custom data of every VM once base64-encoded.
+    Along with the entries of the template which contribute the most to its
+    size.
+
+        Usage example:
+
+    >>> from heat2arm import limits
+    >>>
+    >>> report = limits.check(arm_template_data)
+    >>> report.write_report(sys.stderr)
+    >>> limits.enforce(arm_template_data)  # raises if any limit is exceeded
+"""
+
+import json
+
+# MAX_TEMPLATE_SIZE is the maximum size in bytes of a template:
+MAX_TEMPLATE_SIZE = 1024 * 1024
+
+# MAX_RESOURCES, MAX_PARAMETERS, MAX_VARIABLES and MAX_OUTPUTS are the
+# maximum numbers of entries of each section of a template:
+MAX_RESOURCES = 800
+MAX_PARAMETERS = 256
+MAX_VARIABLES = 256
+MAX_OUTPUTS = 64
+
+# MAX_EXPRESSION_LENGTH is the maximum length of a template expression:
+MAX_EXPRESSION_LENGTH = 24576
+
+# MAX_CUSTOM_DATA_SIZE is the maximum size of the base64-encoded custom data
+# of a VM:
+MAX_CUSTOM_DATA_SIZE = 87380
+
+# _COMPACT_SEPARATORS are the separators of compact JSON:
+_COMPACT_SEPARATORS = (",", ":")
+
+# _BASE64_PREFIX and _BASE64_SUFFIX wrap the custom data of the VMs built by
+# the instance translators:
+_BASE64_PREFIX = "[base64('"
+_BASE64_SUFFIX = "')]"
+
+
+def _get_size(value):
+    """ _get_size is a helper function which returns the size in bytes of the
+    given value as compact JSON.
+    """
+    return len(json.dumps(value, separators=_COMPACT_SEPARATORS).encode(
+        "utf-8"))
+
+
+def _get_custom_data_size(custom_data):
+    """ _get_custom_data_size is a helper function which returns the size of
+    the given custom data of a VM once base64-encoded.
+
+    Custom data given as a literal wrapped by the base64 function is
+    measured once encoded, and any other value as it is.
+    """
+    if (custom_data.startswith(_BASE64_PREFIX) and
+            custom_data.endswith(_BASE64_SUFFIX)):
+        literal = custom_data[len(_BASE64_PREFIX):-len(_BASE64_SUFFIX)]
+        size = len(literal.replace("''", "'").encode("utf-8"))
+        return 4 * ((size + 2) // 3)
+
+    return len(custom_data)
+
+
+def _describe_resource(resource):
+    """ _describe_resource is a helper function which returns the short
+    description of the given resource used within reports.
+    """
+    return '%s "%s"' % (resource.get("type"), resource.get("name"))
+
+
+class LimitsReport(object):
+    """ LimitsReport holds all the figures of the given ARM template data
+    which are subject to limits, and the list of the limits it exceeds.
+    """
+    def __init__(self, template_data):
+        self.template_size = _get_size(template_data)
+        self.resource_count = len(template_data.get("resources", []))
+        self.parameter_count = len(template_data.get("parameters", {}))
+        self.variable_count = len(template_data.get("variables", {}))
+        self.output_count = len(template_data.get("outputs", {}))
+
+        # contributors is the list of (size, description) tuples of all the
+        # resources, parameters and variables, largest first:
+        self.contributors = []
+
+        # longest_expression is the (length, location) tuple of the longest
+        # expression, if any:
+        self.longest_expression = None
+
+        # custom_data is the list of the (size, resource) tuples of the
+        # base64-encoded custom data of the VMs:
+        self.custom_data = []
+
+        self.violations = []
+
+        for section in ("parameters", "variables", "outputs"):
+            for (name, value) in template_data.get(section, {}).items():
+                location = '%s "%s"' % (section[:-1], name)
+                self.contributors.append((_get_size(value), location))
+                self._check_expressions(value, location)
+
+        for resource in template_data.get("resources", []):
+            location = "resource %s" % _describe_resource(resource)
+            self.contributors.append((_get_size(resource), location))
+            self._check_expressions(resource, location)
+
+            custom_data = resource.get("properties", {}).get(
+                "osProfile", {}).get("customData")
+            if hasattr(custom_data, "lower"):
+                self.custom_data.append((
+                    _get_custom_data_size(custom_data),
+                    _describe_resource(resource)))
+
+        self.contributors.sort(key=lambda item: -item[0])
+
+        self._check_counts()
+
+    def _check_expressions(self, value, location):
+        """ _check_expressions is a helper method which measures all the
+        expressions within the given value found at the given location.
+        """
+        if isinstance(value, dict):
+            for val in value.values():
+                self._check_expressions(val, location)
+        elif isinstance(value, list):
+            for val in value:
+                self._check_expressions(val, location)
+        elif (hasattr(value, "lower") and value.startswith("[") and
+                not value.startswith("[[")):
+            if (self.longest_expression is None or
+                    len(value) > self.longest_expression[0]):
+                self.longest_expression = (len(value), location)
+
+            if len(value) > MAX_EXPRESSION_LENGTH:
+                self.violations.append(
+                    "expression of %d characters within %s exceeds the "
+                    "maximum of %d" % (len(value), location,
+                                       MAX_EXPRESSION_LENGTH))
+
+    def _check_counts(self):
+        """ _check_counts is a helper method which checks the size of the
+        template and of all its sections against their limits.
+        """
+        for (figure, value, limit) in [
+                ("template size in bytes", self.template_size,
+                 MAX_TEMPLATE_SIZE),
+                ("number of resources", self.resource_count, MAX_RESOURCES),
+                ("number of parameters", self.parameter_count,
+                 MAX_PARAMETERS),
+                ("number of variables", self.variable_count, MAX_VARIABLES),
+                ("number of outputs", self.output_count, MAX_OUTPUTS)]:
+            if value > limit:
+                self.violations.append("%s of %d exceeds the maximum of %d" %
+                                       (figure, value, limit))
+
+        for (size, resource) in self.custom_data:
+            if size > MAX_CUSTOM_DATA_SIZE:
+                self.violations.append(
+                    "base64-encoded custom data of %d bytes of %s exceeds "
+                    "the maximum of %d" % (size, resource,
+                                           MAX_CUSTOM_DATA_SIZE))
+
+    def to_dict(self, top=10):
+        """ to_dict returns the report as a JSON-serializable dict, listing
+        the given number of largest contributors.
+        """
+        return {
+            "template_size": self.template_size,
+            "resources": self.resource_count,
+            "parameters": self.parameter_count,
+            "variables": self.variable_count,
+            "outputs": self.output_count,
+            "longest_expression": self.longest_expression[0]
+            if self.longest_expression else 0,
+            "largest_custom_data": max(
+                [size for (size, _) in self.custom_data] or [0]),
+            "top_contributors": [{"size": size, "entry": entry}
+                                 for (size, entry) in
+                                 self.contributors[:top]],
+            "violations": self.violations,
+        }
+
+    def write_report(self, stream, top=10):
+        """ write_report writes a human-readable report of the figures, the
+        given number of largest contributors and the violated limits to the
+        given stream.
+        """
+        row = "%-24s %10s %10s\n"
+        stream.write(row % ("Limit", "Value", "Maximum"))
+        for (figure, value, limit) in [
+                ("Template size (bytes)", self.template_size,
+                 MAX_TEMPLATE_SIZE),
+                ("Resources", self.resource_count, MAX_RESOURCES),
+                ("Parameters", self.parameter_count, MAX_PARAMETERS),
+                ("Variables", self.variable_count, MAX_VARIABLES),
+                ("Outputs", self.output_count, MAX_OUTPUTS),
+                ("Longest expression", self.to_dict()["longest_expression"],
+                 MAX_EXPRESSION_LENGTH),
+                ("Largest custom data", self.to_dict()[
+                    "largest_custom_data"], MAX_CUSTOM_DATA_SIZE)]:
+            stream.write(row % (figure, value, limit))
+
+        stream.write("\nLargest entries:\n")
+        for (size, entry) in self.contributors[:top]:
+            stream.write("%10d  %s\n" % (size, entry))
+
+        if self.violations:
+            stream.write("\nExceeded limits:\n")
+            for violation in self.violations:
+                stream.write("  %s\n" % violation)
+
+
+def check(template_data):
+    """ check returns the LimitsReport of the given ARM template data. """
+    return LimitsReport(template_data)
+
+
+def enforce(template_data, top=5):
+    """ enforce raises an exception describing all the ARM limits the given
+    ARM template data exceeds, along with the given number of entries which
+    contribute the most to its size, if it exceeds any.
+    """
+    report = check(template_data)
+    if not report.violations:
+        return
+
+    raise Exception(
+        "The ARM template exceeds the limits of Azure Resource Manager:\n"
+        "  %s\nIts largest entries are:\n  %s" % (
+            "\n  ".join(report.violations),
+            "\n  ".join("%s (%d bytes)" % (entry, size)
+                        for (size, entry) in report.contributors[:top])))
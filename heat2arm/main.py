@@ -20,17 +20,14 @@
 import argparse
 import json
 import logging
+import os
 import sys
 import warnings
 
-from oslo_config import cfg
-import yaml
-
 from heat2arm import constants
-from heat2arm import translation_engine as engine
+from heat2arm import profiling
 
 LOG = logging.getLogger(__name__)
-CONF = cfg.CONF
 
 
 def _parse_args():
@@ -39,13 +36,26 @@ def _parse_args():
     """
     parser = argparse.ArgumentParser(
         description='OpenStack Heat to Azure ARM template converter.')
-    parser.add_argument("--in", dest="heat_template", required=True,
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--in", dest="heat_template",
                         help="Path to the OpenStack Heat template to convert",
                         type=argparse.FileType('rb'))
+    source.add_argument("--batch", dest="batch_source",
+                        help="Directory, manifest file or glob pattern of "
+                        "the OpenStack Heat templates to convert in batch",
+                        type=str)
     parser.add_argument("--out", dest="arm_template",
                         help="Optional Azure ARM template output path",
                         type=argparse.FileType('w'),
                         default=sys.stdout)
+    parser.add_argument("--out-dir", dest="out_dir",
+                        help="Output directory of the ARM templates "
+                        "converted in batch mode",
+                        type=str, default=".")
+    parser.add_argument("--workers", dest="workers",
+                        help="Number of worker processes to use in batch "
+                        "mode; defaults to the number of CPUs",
+                        type=int)
     parser.add_argument("--config-file",
                         help="Path to an optional configuration file",
                         type=str)
@@ -53,6 +63,47 @@ def _parse_args():
                         help="Optional Azure ARM API version string of "
                         "the form YYYY-MM-DD[-preview].",
                         type=str)
+    parser.add_argument("--fast", dest="fast", action="store_true",
+                        help="Parse the Heat templates with the built-in "
+                        "lightweight template model instead of Heat; which "
+                        "applies the property defaults and requires the "
+                        "mandatory properties of the translatable resources, "
+                        "but does not validate property values nor resource "
+                        "types")
+    parser.add_argument("--compact", dest="compact", action="store_true",
+                        help="Write the ARM templates as compact JSON "
+                        "instead of pretty-printing them")
+    parser.add_argument("--state", dest="state",
+                        help="Optional path of the state of the previous "
+                        "translation of the template, so that only the "
+                        "resources affected by the changes since are "
+                        "translated again; it is updated afterwards",
+                        type=str)
+    parser.add_argument("--split-dir", dest="split_dir",
+                        help="Optional directory in which to write the "
+                        "linked templates the ARM template is split into; "
+                        "the master template deploying them is written to "
+                        "the output path", type=str)
+    parser.add_argument("--cache-dir", dest="cache_dir",
+                        help="Optional directory in which to cache the "
+                        "translations, so that unchanged templates are not "
+                        "converted again", type=str)
+    parser.add_argument("--check-limits", dest="check_limits",
+                        action="store_true",
+                        help="Check the ARM templates against the limits of "
+                        "Azure Resource Manager before writing them, failing "
+                        "if any is exceeded; with --split-dir, the master "
+                        "and each linked template are checked instead")
+    parser.add_argument("--deployment-report", dest="deployment_report",
+                        nargs="?", const="table", choices=["table", "json"],
+                        help="Write the deployment waves and critical path "
+                        "of the resulting ARM template to stderr, as a "
+                        "table or JSON; not available in batch mode")
+    parser.add_argument("--profile", dest="profile", nargs="?",
+                        const="table", choices=["table", "json"],
+                        help="Write the time spent in each phase of the "
+                        "conversion and in each translator to stderr, as a "
+                        "table or JSON; not available in batch mode")
     return parser.parse_args()
 
 
@@ -67,25 +118,171 @@ def _setup_logging():
     warnings.simplefilter("ignore")
 
 
+def _convert_incremental(heat_template_data, state_path, profiler):
+    """ _convert_incremental is a helper function which converts the given
+    Heat template data incrementally from the translation state at the
+    given path, if any, and then updates it.
+    """
+    from heat2arm import incremental
+
+    state = None
+    if os.path.isfile(state_path):
+        with open(state_path) as state_file:
+            state = incremental.load_state(state_file)
+
+    (arm_template_data, state) = incremental.convert_template(
+        heat_template_data, state, profiler=profiler)
+
+    with open(state_path, "w") as state_file:
+        incremental.dump_state(state, state_file)
+
+    return arm_template_data
+
+
+def _write_linked_templates(arm_template_data, split_dir, master_stream,
+                            compact, check_limits=False):
+    """ _write_linked_templates is a helper function which splits the given
+    ARM template data into linked templates written inside the given
+    directory and writes the master template deploying them to the given
+    stream.
+
+    If check_limits is set, none are written unless all of them are within
+    the limits of Azure Resource Manager.
+    """
+    from heat2arm import limits
+    from heat2arm import partitioning
+    from heat2arm import serialization
+
+    (master, linked_templates) = partitioning.split_template(
+        arm_template_data)
+
+    if check_limits:
+        limits.enforce(master)
+        for template_data in linked_templates.values():
+            limits.enforce(template_data)
+
+    if not os.path.isdir(split_dir):
+        os.makedirs(split_dir)
+
+    for (name, template_data) in linked_templates.items():
+        with open(os.path.join(split_dir, "%s.json" % name), "w") as out:
+            serialization.dump_arm_template(template_data, out, compact)
+
+    serialization.dump_arm_template(master, master_stream, compact)
+
+
 def main():
     """ main is the entry point of the application. """
     _setup_logging()
 
+    if sys.argv[1:2] == ["serve"]:
+        from heat2arm import server
+        return server.main(sys.argv[2:])
+
     args = _parse_args()
+
+    # NOTE: the translation engine and its dependencies are only imported
+    # once the arguments are parsed so that --help and usage errors are
+    # reported promptly:
+    from oslo_config import cfg
+
+    from heat2arm import cache
+    from heat2arm import serialization
+    from heat2arm import translation_engine as engine
+
+    CONF = cfg.CONF
     if args.config_file:
         CONF(["--config-file", args.config_file])
 
     if args.api_version:
         constants.ARM_API_VERSION = args.api_version
 
-    heat_template_data = yaml.load(args.heat_template, Loader=yaml.BaseLoader)
+    if args.fast:
+        CONF.set_override("fast_template_parser", True)
+
+    if args.cache_dir:
+        CONF.set_override("translation_cache_dir", args.cache_dir)
+
+    # NOTE: the limits apply to the templates which get deployed, which are
+    # the linked templates rather than the whole ARM template when split:
+    check_limits = args.check_limits or CONF.check_arm_limits
+    if args.split_dir:
+        CONF.set_override("check_arm_limits", False)
+    elif args.check_limits:
+        CONF.set_override("check_arm_limits", True)
+
+    if args.batch_source:
+        from heat2arm import batch
+
+        if (args.profile or args.deployment_report or args.state or
+                args.split_dir):
+            LOG.warning("Profiling, deployment reports, incremental "
+                        "translations and linked templates are not "
+                        "available in batch mode.")
+        return batch.main(args.batch_source, args.out_dir,
+                          workers=args.workers,
+                          config_file=args.config_file,
+                          api_version=args.api_version,
+                          stream=sys.stderr,
+                          compact=args.compact)
+
+    profiler = profiling.NULL_PROFILER
+    if args.profile:
+        profiler = profiling.Profiler()
+
+    with profiler.phase("load"):
+        heat_template_data = serialization.load_heat_template(
+            args.heat_template)
     args.heat_template.close()
 
-    arm_template_data = engine.convert_template(heat_template_data)
+    text = None
+    translation_cache = cache.get_translation_cache()
+    if args.state:
+        arm_template_data = _convert_incremental(
+            heat_template_data, args.state, profiler)
+    elif translation_cache is not None:
+        (text, _) = translation_cache.convert(heat_template_data,
+                                              args.compact, profiler)
+        if args.deployment_report or args.split_dir:
+            arm_template_data = json.loads(text)
+    else:
+        arm_template_data = engine.convert_template(heat_template_data,
+                                                    profiler=profiler)
 
-    args.arm_template.write(json.dumps(arm_template_data, indent=4))
+    if args.split_dir:
+        with profiler.phase("split"):
+            _write_linked_templates(arm_template_data, args.split_dir,
+                                    args.arm_template, args.compact,
+                                    check_limits)
+    else:
+        with profiler.phase("dump"):
+            if text is not None:
+                args.arm_template.write(text)
+            else:
+                serialization.dump_arm_template(
+                    arm_template_data, args.arm_template, args.compact)
     args.arm_template.close()
 
+    if args.deployment_report:
+        from heat2arm import deployment
+
+        analysis = deployment.analyze(arm_template_data["resources"],
+                                      arm_template_data.get("variables"))
+        if args.deployment_report == "json":
+            json.dump(analysis.to_dict(), sys.stderr, indent=4)
+            sys.stderr.write("\n")
+        else:
+            analysis.write_report(sys.stderr)
+
+    if args.profile == "json":
+        json.dump(profiler.to_dict(), sys.stderr, indent=4)
+        sys.stderr.write("\n")
+    elif args.profile:
+        profiler.write_table(sys.stderr)
+
+    if translation_cache is not None and not args.state:
+        translation_cache.write_stats(sys.stderr)
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,493 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Contains the partitioning of ARM templates into linked templates which
+    are deployed by a master template through Microsoft.Resources/deployments
+    resources.
+
+    The resources are split along the weakest points of their dependency
+    graph:
+        - the hubs which many other resources depend on, such as the
+        default virtual network or storage account, are moved to a base
+        template together with everything they depend on.
+        - the groups of resources which remain connected to one another,
+        such as a VM together with its NICs and public IPs, are then packed
+        into as few linked templates as possible.
+    All the linked templates but the base one depend on the base template
+    only, and are thus deployed in parallel. Resources with dependencies
+    which do not designate any single resource, such as those on copy
+    loops or indexed by copyIndex(), are moved to the base template as
+    well, together with all the resources those may designate.
+
+    Each linked template holds the parameters and variables its resources
+    require, the master template passing all the parameters through. As
+    resources are referenced by their resource IDs, which are computed from
+    the same variables in all templates, no outputs are required.
+
+        Usage example:
+
+    >>> from heat2arm import partitioning
+    >>>
+    >>> (master, linked_templates) = partitioning.split_template(
+    ...     arm_template_data)
+    >>> for (name, template_data) in linked_templates.items():
+    ...     # upload template_data as <base URI>/<name>.json
+"""
+
+import collections
+import copy
+import re
+
+from oslo_config import cfg
+
+from heat2arm import constants
+from heat2arm.dependencies import DependencyGraph
+from heat2arm.dependencies import get_resource_key
+from heat2arm.dependencies import parse_dependency
+
+CONF = cfg.CONF
+CONF.register_opts([
+    cfg.IntOpt(
+        'linked_template_max_resources',
+        default=800,
+        help='The maximum number of resources of each linked template the '
+             'ARM templates are split into'),
+    cfg.IntOpt(
+        'linked_template_max_parameters',
+        default=256,
+        help='The maximum number of parameters of each linked template the '
+             'ARM templates are split into'),
+    cfg.IntOpt(
+        'linked_template_max_variables',
+        default=256,
+        help='The maximum number of variables of each linked template the '
+             'ARM templates are split into'),
+])
+
+# LINKED_TEMPLATES_URI_PARAMETER is the name of the parameter of the master
+# template holding the URI all the linked templates are uploaded under:
+LINKED_TEMPLATES_URI_PARAMETER = "linkedTemplatesBaseUri"
+
+# BASE_TEMPLATE_NAME is the name of the linked template holding the hubs:
+BASE_TEMPLATE_NAME = "base"
+
+# DEPLOYMENTS_RESOURCE_TYPE is the type of the resources deploying the
+# linked templates:
+DEPLOYMENTS_RESOURCE_TYPE = "Microsoft.Resources/deployments"
+
+# _VARIABLE_REGEX and _PARAMETER_REGEX match all the variable and parameter
+# references in ARM expressions:
+_VARIABLE_REGEX = re.compile(r"variables\('([^']*)'\)")
+_PARAMETER_REGEX = re.compile(r"parameters\('([^']*)'\)")
+
+
+def _find_references(value, regex, found):
+    """ _find_references is a helper function which adds the names of all
+    the references matched by the given regex within the given value to the
+    given set.
+    """
+    if isinstance(value, dict):
+        for val in value.values():
+            _find_references(val, regex, found)
+    elif isinstance(value, list):
+        for val in value:
+            _find_references(val, regex, found)
+    elif hasattr(value, "lower"):
+        found.update(regex.findall(value))
+
+
+class _Requirements(object):
+    """ _Requirements is a helper class which computes the parameters and
+    variables the resources of the given ARM template data require.
+    """
+    def __init__(self, template_data):
+        self._variables = template_data["variables"]
+
+        # closures maps the names of variables to the sets of the names of
+        # the variables and parameters they transitively require:
+        self._closures = {}
+
+        self.resource_requirements = []
+        for resource in template_data["resources"]:
+            variables = set()
+            parameters = set()
+            _find_references(resource, _VARIABLE_REGEX, variables)
+            _find_references(resource, _PARAMETER_REGEX, parameters)
+            for name in list(variables):
+                (closure_vars, closure_params) = self._get_closure(name)
+                variables.update(closure_vars)
+                parameters.update(closure_params)
+            self.resource_requirements.append((variables, parameters))
+
+    def _get_closure(self, name, visiting=None):
+        """ _get_closure is a helper method which returns the tuple of the
+        sets of the names of the variables and parameters the variable with
+        the given name requires, itself included.
+        """
+        if name in self._closures:
+            return self._closures[name]
+
+        visiting = visiting or set()
+        visiting.add(name)
+
+        variables = set([name])
+        parameters = set()
+        referenced = set()
+        _find_references(self._variables.get(name), _VARIABLE_REGEX,
+                         referenced)
+        _find_references(self._variables.get(name), _PARAMETER_REGEX,
+                         parameters)
+        for ref in referenced - visiting:
+            (ref_vars, ref_params) = self._get_closure(ref, visiting)
+            variables.update(ref_vars)
+            parameters.update(ref_params)
+
+        self._closures[name] = (variables, parameters)
+        return self._closures[name]
+
+    def get(self, indexes):
+        """ get returns the tuple of the sets of the names of the variables
+        and parameters the resources with the given indexes require.
+        """
+        variables = set()
+        parameters = set()
+        for i in indexes:
+            variables.update(self.resource_requirements[i][0])
+            parameters.update(self.resource_requirements[i][1])
+
+        return (variables, parameters)
+
+
+class _Limits(object):
+    """ _Limits is a helper class which holds the maximum numbers of
+    resources, parameters and variables of a linked template.
+    """
+    def __init__(self, resources, parameters, variables):
+        self.resources = resources
+        self.parameters = parameters
+        self.variables = variables
+
+    def allow(self, resources, variables, parameters):
+        """ allow checks whether a linked template with the given numbers of
+        resources, variables and parameters is within the limits.
+        """
+        return (resources <= self.resources and
+                variables <= self.variables and
+                parameters <= self.parameters)
+
+
+def _get_adjacency(graph):
+    """ _get_adjacency is a helper function which returns the list of the
+    sets of the indexes of the resources each resource of the given
+    DependencyGraph depends on or is depended on by.
+    """
+    neighbours = [set() for _ in graph.resources]
+    for i, edges in enumerate(graph.edges):
+        for dep in edges:
+            neighbours[i].add(dep)
+            neighbours[dep].add(i)
+
+    return neighbours
+
+
+def _get_components(neighbours, excluded):
+    """ _get_components is a helper function which returns the list of the
+    sorted lists of the indexes of the resources in each connected component
+    of the given adjacency, leaving out the given excluded resources.
+    """
+    seen = set(excluded)
+    components = []
+    for start in range(len(neighbours)):
+        if start in seen:
+            continue
+
+        seen.add(start)
+        component = [start]
+        for i in component:
+            for j in neighbours[i]:
+                if j not in seen:
+                    seen.add(j)
+                    component.append(j)
+        components.append(sorted(component))
+
+    return components
+
+
+def _get_unresolved_targets(graph):
+    """ _get_unresolved_targets is a helper function which returns the list
+    of the sets of the indexes of the resources the unresolved dependencies
+    of each resource of the given DependencyGraph may designate; that is all
+    the resources of the type of a resource ID whose name is not matched,
+    such as those indexed by copyIndex(), or the resources of the copy loops
+    or with the plain names a plain dependency matches.
+    """
+    names = {}
+    types = {}
+    for i, resource in enumerate(graph.resources):
+        (res_type, name) = get_resource_key(resource)
+        types.setdefault(res_type, set()).add(i)
+        names.setdefault(name, set()).add(i)
+        loop_name = resource.get("copy", {}).get("name")
+        if loop_name is not None:
+            names.setdefault("'%s'" % loop_name, set()).add(i)
+
+    targets = []
+    for unresolved in graph.unresolved:
+        indexes = set()
+        for dependency in unresolved:
+            key = parse_dependency(dependency)
+            if key is not None:
+                indexes.update(types.get(key[0], ()))
+            else:
+                indexes.update(names.get("'%s'" % dependency, ()))
+        targets.append(indexes)
+
+    return targets
+
+
+def _add_with_dependencies(graph, targets, index, base):
+    """ _add_with_dependencies is a helper function which adds the given
+    resource and all the resources it transitively depends on, as per the
+    given DependencyGraph and unresolved dependency targets, to the given
+    set of the indexes of the resources of the base template.
+    """
+    pending = [index]
+    while pending:
+        i = pending.pop()
+        if i not in base:
+            base.add(i)
+            pending.extend(graph.edges[i])
+            pending.extend(targets[i])
+
+
+def _check_fits(fits, limits, indexes, description):
+    """ _check_fits is a helper function which raises an exception if the
+    resources with the given indexes and the given description do not fit
+    within a single linked template.
+    """
+    if not fits(indexes):
+        raise Exception(
+            "Could not split the ARM template into linked templates of at "
+            "most %d resources, %d parameters and %d variables: %s would "
+            "not fit in one." % (limits.resources, limits.parameters,
+                                 limits.variables, description))
+
+
+def partition_resources(graph, requirements, limits):
+    """ partition_resources returns a tuple of the sorted list of the indexes
+    of the resources of the given DependencyGraph which go into the base
+    template and of the sorted lists of the indexes of the resources which go
+    into each of the other linked templates, so that all of them are within
+    the given limits.
+
+    It raises an exception if the base template or any single resource
+    would not be.
+    """
+    neighbours = _get_adjacency(graph)
+    targets = _get_unresolved_targets(graph)
+
+    def fits(indexes):
+        (variables, parameters) = requirements.get(indexes)
+        return limits.allow(len(indexes), len(variables), len(parameters))
+
+    # NOTE: the dependencies which could not be resolved are only kept
+    # within the base template, along with all the resources they may
+    # designate, so that they never reference another linked template:
+    base = set()
+    for (i, unresolved) in enumerate(graph.unresolved):
+        if unresolved:
+            _add_with_dependencies(graph, targets, i, base)
+
+    # the most connected resource of any group which is too large is moved
+    # to the base template until all the groups fit:
+    while True:
+        components = _get_components(neighbours, base)
+        oversized = [component for component in components
+                     if not fits(component)]
+        if not oversized:
+            break
+
+        largest = max(oversized, key=len)
+        if len(largest) == 1:
+            _check_fits(fits, limits, largest, 'resource "%s"' %
+                        graph.resources[largest[0]].get("name"))
+
+        hub = max(largest, key=lambda i: (len(neighbours[i] - base), -i))
+        _add_with_dependencies(graph, targets, hub, base)
+
+    _check_fits(fits, limits, sorted(base), "the %d resources required by "
+                "all the others" % len(base))
+
+    # pack the groups into as few linked templates as possible, largest
+    # first:
+    bins = []
+    for component in sorted(components, key=len, reverse=True):
+        (variables, parameters) = requirements.get(component)
+        for (indexes, bin_vars, bin_params) in bins:
+            if limits.allow(len(indexes) + len(component),
+                            len(bin_vars | variables),
+                            len(bin_params | parameters)):
+                indexes.extend(component)
+                bin_vars.update(variables)
+                bin_params.update(parameters)
+                break
+        else:
+            bins.append((list(component), variables, parameters))
+
+    return (sorted(base), sorted(sorted(indexes)
+                                 for (indexes, _, _) in bins))
+
+
+def _build_linked_template(template_data, graph, requirements, indexes):
+    """ _build_linked_template is a helper function which returns the data
+    of the linked template holding the resources of the given DependencyGraph
+    with the given indexes, along with all the parameters and variables they
+    require.
+
+    Dependencies on resources outside of the linked template are dropped, as
+    those are deployed beforehand through the dependencies of the master
+    template's deployments. Unresolved dependencies are kept, as the
+    resources they may designate are all within the same template.
+    """
+    members = set(indexes)
+
+    resources = []
+    for i in indexes:
+        resource = graph.resources[i]
+        if "dependsOn" in resource:
+            kept = set(graph.unresolved[i])
+            kept.update(graph.dependency_strings[i][dep]
+                        for dep in graph.edges[i] if dep in members)
+
+            resource = copy.copy(resource)
+            resource["dependsOn"] = [dependency for dependency
+                                     in resource["dependsOn"]
+                                     if dependency in kept]
+        resources.append(resource)
+
+    (variables, parameters) = requirements.get(indexes)
+
+    return collections.OrderedDict([
+        ("contentVersion", constants.ARM_TEMPLATE_VERSION),
+        ("$schema", constants.ARM_SCHEMA_URL),
+        ("parameters", collections.OrderedDict(
+            (name, value)
+            for (name, value) in template_data["parameters"].items()
+            if name in parameters)),
+        ("variables", collections.OrderedDict(
+            (name, value)
+            for (name, value) in template_data["variables"].items()
+            if name in variables)),
+        ("resources", resources),
+    ])
+
+
+def _get_deployment_name(name):
+    """ _get_deployment_name is a helper function which returns the
+    expression of the name of the deployment of the linked template with
+    the given name, which is unique to the master template's deployment.
+    """
+    return "[concat(deployment().name, '-%s')]" % name
+
+
+def _build_deployment(name, linked_template_data, depends_on):
+    """ _build_deployment is a helper function which returns the resource
+    deploying the given linked template with the given name after the
+    linked templates with the given names.
+    """
+    resource = collections.OrderedDict([
+        ("type", DEPLOYMENTS_RESOURCE_TYPE),
+        ("apiVersion", constants.ARM_DEPLOYMENTS_API_VERSION),
+        ("name", _get_deployment_name(name)),
+    ])
+
+    if depends_on:
+        resource["dependsOn"] = [
+            "[resourceId('%s', %s)]" % (
+                DEPLOYMENTS_RESOURCE_TYPE,
+                _get_deployment_name(dep)[1:-1])
+            for dep in depends_on]
+
+    resource["properties"] = collections.OrderedDict([
+        ("mode", "Incremental"),
+        ("templateLink", collections.OrderedDict([
+            ("uri", "[concat(parameters('%s'), '/%s.json')]" % (
+                LINKED_TEMPLATES_URI_PARAMETER, name)),
+            ("contentVersion", constants.ARM_TEMPLATE_VERSION),
+        ])),
+        ("parameters", collections.OrderedDict(
+            (param, {"value": "[parameters('%s')]" % param})
+            for param in linked_template_data["parameters"])),
+    ])
+
+    return resource
+
+
+def split_template(template_data, max_resources=None, max_parameters=None,
+                   max_variables=None):
+    """ split_template splits the given ARM template data into linked
+    templates of at most the given numbers of resources, parameters and
+    variables each, which default to the values of the linked_template_max_*
+    options.
+
+    It returns a tuple of the data of the master template deploying all the
+    linked templates and of the ordered dict of the data of each linked
+    template by name, which the master template expects to find at
+    <linkedTemplatesBaseUri>/<name>.json.
+    """
+    limits = _Limits(
+        max_resources or CONF.linked_template_max_resources,
+        max_parameters or CONF.linked_template_max_parameters,
+        max_variables or CONF.linked_template_max_variables)
+
+    graph = DependencyGraph(template_data["resources"])
+    requirements = _Requirements(template_data)
+    (base, others) = partition_resources(graph, requirements, limits)
+
+    linked_templates = collections.OrderedDict()
+    if base:
+        linked_templates[BASE_TEMPLATE_NAME] = _build_linked_template(
+            template_data, graph, requirements, base)
+    for i, indexes in enumerate(others):
+        linked_templates["part%d" % (i + 1)] = _build_linked_template(
+            template_data, graph, requirements, indexes)
+
+    parameters = collections.OrderedDict(template_data["parameters"])
+    parameters[LINKED_TEMPLATES_URI_PARAMETER] = {
+        "type": "string",
+        "metadata": {
+            "description": "Base URI under which all the linked templates "
+                           "of the deployment are available."
+        }
+    }
+
+    deployments = []
+    for name, linked_template_data in linked_templates.items():
+        depends_on = []
+        if base and name != BASE_TEMPLATE_NAME:
+            depends_on = [BASE_TEMPLATE_NAME]
+        deployments.append(_build_deployment(name, linked_template_data,
+                                             depends_on))
+
+    master = collections.OrderedDict([
+        ("contentVersion", constants.ARM_TEMPLATE_VERSION),
+        ("$schema", constants.ARM_SCHEMA_URL),
+        ("parameters", parameters),
+        ("variables", collections.OrderedDict()),
+        ("resources", deployments),
+    ])
+
+    return (master, linked_templates)
@@ -0,0 +1,269 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Defines the instrumentation of the conversion process, which records the
+    wall and CPU time spent in each phase of a conversion and in each method
+    of every translator.
+
+        Usage example:
+
+    >>> from heat2arm import profiling
+    >>> from heat2arm.translation_engine import convert_template
+    >>>
+    >>> class MetricsHook(profiling.ProfilerHook):
+    ...     def phase_finished(self, phase, wall, cpu):
+    ...         metrics.observe("heat2arm_phase_seconds", wall, phase=phase)
+    >>>
+    >>> profiler = profiling.Profiler(hooks=[MetricsHook()])
+    >>> arm_template = convert_template(heat_template, profiler=profiler)
+    >>> profiler.to_dict()["phases"]["translate"]["wall"]
+"""
+
+import collections
+import threading
+import time
+
+# _cpu_time returns the CPU time of the whole process; which the phases are
+# measured with, as they may run work on other threads:
+_cpu_time = getattr(time, "process_time", None) or time.clock
+
+# _thread_cpu_time returns the CPU time of the current thread if possible,
+# or of the whole process otherwise; which the translators are measured
+# with, as they may be run by multiple threads at once:
+_thread_cpu_time = getattr(time, "thread_time", None) or _cpu_time
+
+
+class ProfilerHook(object):
+    """ ProfilerHook is the interface of the callbacks notified by a Profiler
+    of every measurement; all its methods are no-ops to be overridden.
+    """
+    def phase_finished(self, phase, wall, cpu):
+        """ phase_finished is called with the wall and CPU time in seconds
+        spent in the given phase of the conversion.
+        """
+        pass
+
+    def translator_finished(self, translator_class, resource_name, method,
+                            wall, cpu):
+        """ translator_finished is called with the wall and CPU time in
+        seconds spent in the given method of the translator of the given
+        class for the resource with the given name.
+        """
+        pass
+
+
+class _Measurement(object):
+    """ _Measurement is a context manager which measures the wall time and
+    the CPU time as per the given clock spent within it and hands them to
+    the given callback.
+    """
+    def __init__(self, cpu_clock, callback, *args):
+        self._cpu_clock = cpu_clock
+        self._callback = callback
+        self._args = args
+
+    def __enter__(self):
+        self._wall = time.time()
+        self._cpu = self._cpu_clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._callback(*(self._args + (time.time() - self._wall,
+                                       self._cpu_clock() - self._cpu)))
+
+
+class _NullMeasurement(object):
+    """ _NullMeasurement is a context manager which measures nothing. """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def measure(callback, *args):
+    """ measure returns a context manager which calls the given callback with
+    the given arguments followed by the wall time and the CPU time of the
+    current thread in seconds spent within it.
+    """
+    return _Measurement(_thread_cpu_time, callback, *args)
+
+
+def _new_stats():
+    """ _new_stats is a helper function which returns the initial
+    statistics of a phase or translator method.
+    """
+    return {"wall": 0.0, "cpu": 0.0, "calls": 0}
+
+
+def _add_stats(stats, wall, cpu):
+    """ _add_stats is a helper function which adds a measurement to the
+    given statistics.
+    """
+    stats["wall"] += wall
+    stats["cpu"] += cpu
+    stats["calls"] += 1
+
+
+class Profiler(ProfilerHook):
+    """ Profiler aggregates the timings of the phases of conversions and of
+    translators' methods, and forwards every measurement to its hooks.
+
+    It may be passed on to translation_engine.convert_template, and reused
+    across conversions to aggregate their timings.
+    """
+    def __init__(self, hooks=None):
+        self.hooks = list(hooks or [])
+
+        # phases maps the names of phases to their statistics:
+        self.phases = collections.OrderedDict()
+
+        # translators maps (translator class name, method) tuples to their
+        # statistics:
+        self.translators = collections.OrderedDict()
+
+        # resources maps (translator class name, resource name, method)
+        # tuples to their statistics:
+        self.resources = collections.OrderedDict()
+
+        # notes is the list of the caveats about the recorded statistics:
+        self.notes = []
+
+        # NOTE: translators may be run from multiple threads at once:
+        self._lock = threading.Lock()
+
+    def phase(self, phase):
+        """ phase returns a context manager which measures the time spent
+        within it as part of the given phase, with the CPU time of the whole
+        process.
+        """
+        return _Measurement(_cpu_time, self.phase_finished, phase)
+
+    def translator(self, translator, method):
+        """ translator returns a context manager which measures the time
+        spent within it as part of the given method of the given translator,
+        with the CPU time of the current thread.
+        """
+        return _Measurement(_thread_cpu_time, self.translator_finished,
+                            translator.__class__, translator._name, method)
+
+    def note(self, message):
+        """ note records the given caveat about the recorded statistics,
+        unless already recorded.
+        """
+        with self._lock:
+            if message not in self.notes:
+                self.notes.append(message)
+
+    def phase_finished(self, phase, wall, cpu):
+        """ phase_finished records the given timings of the given phase. """
+        with self._lock:
+            if phase not in self.phases:
+                self.phases[phase] = _new_stats()
+            _add_stats(self.phases[phase], wall, cpu)
+
+        for hook in self.hooks:
+            hook.phase_finished(phase, wall, cpu)
+
+    def translator_finished(self, translator_class, resource_name, method,
+                            wall, cpu):
+        """ translator_finished records the given timings of the given method
+        of a translator.
+        """
+        class_name = translator_class.__name__
+
+        with self._lock:
+            key = (class_name, method)
+            if key not in self.translators:
+                self.translators[key] = _new_stats()
+            _add_stats(self.translators[key], wall, cpu)
+
+            key = (class_name, resource_name, method)
+            if key not in self.resources:
+                self.resources[key] = _new_stats()
+            _add_stats(self.resources[key], wall, cpu)
+
+        for hook in self.hooks:
+            hook.translator_finished(translator_class, resource_name, method,
+                                     wall, cpu)
+
+    def to_dict(self):
+        """ to_dict returns all the recorded statistics as a JSON-serializable
+        dict.
+        """
+        return {
+            "phases": dict(self.phases),
+            "translators": [
+                dict(stats, translator=cls, method=method)
+                for (cls, method), stats in self.translators.items()],
+            "resources": [
+                dict(stats, translator=cls, resource=res, method=method)
+                for (cls, res, method), stats in self.resources.items()],
+            "notes": list(self.notes),
+        }
+
+    def write_table(self, stream, top=10):
+        """ write_table writes human-readable tables of the recorded phases,
+        translators and the given number of slowest resources to the given
+        stream.
+        """
+        row = "%-50s %10s %10s %8s\n"
+
+        stream.write(row % ("Phase", "Wall (s)", "CPU (s)", "Calls"))
+        for phase, stats in self.phases.items():
+            stream.write(row % (phase, "%.4f" % stats["wall"],
+                                "%.4f" % stats["cpu"], stats["calls"]))
+
+        stream.write("\n" + row % ("Translator", "Wall (s)", "CPU (s)",
+                                   "Calls"))
+        for (cls, method), stats in sorted(
+                self.translators.items(), key=lambda i: -i[1]["wall"]):
+            stream.write(row % ("%s.%s" % (cls, method),
+                                "%.4f" % stats["wall"],
+                                "%.4f" % stats["cpu"], stats["calls"]))
+
+        stream.write("\n" + row % ("Slowest resources", "Wall (s)", "CPU (s)",
+                                   "Calls"))
+        for (cls, res, method), stats in sorted(
+                self.resources.items(), key=lambda i: -i[1]["wall"])[:top]:
+            stream.write(row % ("%s (%s.%s)" % (res, cls, method),
+                                "%.4f" % stats["wall"],
+                                "%.4f" % stats["cpu"], stats["calls"]))
+
+        for message in self.notes:
+            stream.write("\nNOTE: %s\n" % message)
+
+
+class NullProfiler(ProfilerHook):
+    """ NullProfiler is the default profiler of conversions, which does not
+    measure anything and ignores all the measurements handed to it.
+    """
+    _measurement = _NullMeasurement()
+
+    def phase(self, phase):
+        """ phase returns a context manager which measures nothing. """
+        return self._measurement
+
+    def translator(self, translator, method):
+        """ translator returns a context manager which measures nothing. """
+        return self._measurement
+
+    def note(self, message):
+        """ note ignores the given caveat. """
+        pass
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,368 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Contains the logic for obtaining the ARM template JSON schema, together
+    with all the sub-schemas it references, and validating templates against
+    it.
+
+    Schemas are looked up in order:
+        - in the bundled schemas directory, if any.
+        - in the on-disk cache, as long as they have not expired.
+        - at their URL, in which case they are saved to the cache.
+        - in the schemas shipped with heat2arm, when offline or if they
+        cannot be downloaded.
+
+    The shipped schemas are a self-contained copy of the ARM template schema
+    covering the structure of templates, but not the properties of each
+    resource type; which the full schemas describe.
+
+    The bundled and shipped schemas directories and the cache lay schemas out
+    by their URL; for example:
+        <dir>/schema.management.azure.com/schemas/2015-01-01/
+            deploymentTemplate.json
+    so a populated cache directory may be used as-is as a bundle for
+    running in offline mode with the full schemas.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    from urllib import parse as urlparse
+except ImportError:
+    import urlparse
+
+from oslo_config import cfg
+
+from heat2arm import constants
+
+LOG = logging.getLogger(__name__)
+
+CONF = cfg.CONF
+CONF.register_opts([
+    cfg.StrOpt(
+        'arm_schema_cache_dir',
+        default=os.path.join(os.path.expanduser("~"), ".cache", "heat2arm",
+                             "schemas"),
+        help='Directory in which the downloaded ARM schemas are cached'),
+    cfg.IntOpt(
+        'arm_schema_cache_ttl',
+        default=7 * 24 * 60 * 60,
+        help='Number of seconds after which a cached ARM schema is fetched '
+             'again; 0 means cached schemas never expire'),
+    cfg.StrOpt(
+        'arm_schema_bundle_dir',
+        default=None,
+        help='Optional directory containing bundled ARM schemas, which are '
+             'used before the cached and downloaded ones'),
+    cfg.IntOpt(
+        'arm_schema_download_timeout',
+        default=30,
+        help='Timeout in seconds of the download of an ARM schema'),
+    cfg.BoolOpt(
+        'arm_schema_offline',
+        default=False,
+        help='Never download ARM schemas; only use the bundled or '
+             'cached ones, regardless of their age'),
+])
+
+# SHIPPED_SCHEMAS_DIR is the directory of the schemas shipped with heat2arm:
+SHIPPED_SCHEMAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   "schemas")
+
+# _replace atomically replaces the destination path with the source one:
+_replace = getattr(os, "replace", os.rename)
+
+
+def _iter_refs(schema, base_url):
+    """ _iter_refs is a helper function which yields the absolute URLs of
+    all the documents referenced by the given schema through "$ref"s.
+    """
+    if isinstance(schema, dict):
+        if hasattr(schema.get("id"), "lower"):
+            base_url = urlparse.urljoin(base_url, schema["id"])
+
+        for key, value in schema.items():
+            if key == "$ref" and hasattr(value, "lower"):
+                yield urlparse.urldefrag(
+                    urlparse.urljoin(base_url, value))[0]
+            else:
+                for ref in _iter_refs(value, base_url):
+                    yield ref
+    elif isinstance(schema, list):
+        for value in schema:
+            for ref in _iter_refs(value, base_url):
+                yield ref
+
+
+class SchemaStore(object):
+    """ SchemaStore provides access to JSON schemas by their URL, looking
+    them up in the bundled schemas directory and in the on-disk cache before
+    downloading them, and falling back to the shipped ones.
+
+    All the schemas loaded so far are also kept in memory. Each schema is
+    loaded by a single thread at a time, without blocking the threads which
+    get the other schemas.
+    """
+    def __init__(self, cache_dir, ttl=0, bundle_dir=None, offline=False,
+                 timeout=None, fallback_dir=SHIPPED_SCHEMAS_DIR):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.bundle_dir = bundle_dir
+        self.offline = offline
+        self.timeout = timeout
+        self.fallback_dir = fallback_dir
+
+        self.schemas = {}
+        self._lock = threading.Lock()
+
+        # _loading maps the URL of each schema being loaded to the event set
+        # once its loading is over:
+        self._loading = {}
+
+    @staticmethod
+    def _get_path(base_dir, url):
+        """ _get_path is a helper method which returns the path of the file
+        in which the schema with the given URL is stored under base_dir.
+        """
+        parsed = urlparse.urlparse(url)
+        parts = [p for p in parsed.path.split("/") if p not in ("", ".", "..")]
+        return os.path.join(base_dir, parsed.netloc, *parts)
+
+    @staticmethod
+    def _read(path):
+        """ _read is a helper method which loads the schema from the given
+        file path.
+        """
+        with open(path) as schema_file:
+            return json.load(schema_file)
+
+    def _write_cache(self, url, text):
+        """ _write_cache is a helper method which atomically saves the given
+        schema text to the cache.
+        """
+        path = self._get_path(self.cache_dir, url)
+        cache_dir = os.path.dirname(path)
+
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+
+            (fd, tmp_path) = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, "w") as tmp_file:
+                tmp_file.write(text)
+            _replace(tmp_path, path)
+        except (IOError, OSError) as ex:
+            LOG.warn('Could not cache ARM schema "%s": %s', url, ex)
+
+    def _load(self, url):
+        """ _load is a helper method which loads the schema with the given
+        URL from the first of the bundle, the cache or the network which
+        can provide it.
+        """
+        if self.bundle_dir:
+            path = self._get_path(self.bundle_dir, url)
+            if os.path.isfile(path):
+                return self._read(path)
+
+        cached_path = None
+        if self.cache_dir:
+            path = self._get_path(self.cache_dir, url)
+            if os.path.isfile(path):
+                cached_path = path
+                age = time.time() - os.path.getmtime(path)
+                if self.offline or self.ttl <= 0 or age < self.ttl:
+                    return self._read(path)
+
+        fallback_path = None
+        if self.fallback_dir:
+            path = self._get_path(self.fallback_dir, url)
+            if os.path.isfile(path):
+                fallback_path = path
+
+        if self.offline:
+            if fallback_path:
+                return self._read(fallback_path)
+            raise Exception(
+                'ARM schema "%s" is neither bundled nor cached and cannot be '
+                'downloaded in offline mode.' % url)
+
+        # NOTE: requests is only imported when actually downloading:
+        import requests
+
+        try:
+            response = requests.get(url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            if cached_path:
+                LOG.warn('Could not download ARM schema "%s"; using the '
+                         'expired cached one.', url)
+                return self._read(cached_path)
+            if fallback_path:
+                LOG.warn('Could not download ARM schema "%s"; using the '
+                         'shipped one.', url)
+                return self._read(fallback_path)
+            raise
+
+        schema = json.loads(response.text)
+        if self.cache_dir:
+            self._write_cache(url, response.text)
+
+        return schema
+
+    def get(self, url):
+        """ get returns the schema with the given URL. """
+        url = urlparse.urldefrag(url)[0]
+
+        while True:
+            with self._lock:
+                if url in self.schemas:
+                    return self.schemas[url]
+
+                loading = self._loading.get(url)
+                if loading is None:
+                    loading = self._loading[url] = threading.Event()
+                    break
+
+            # NOTE: another thread is loading the schema; which is loaded
+            # again here should it fail:
+            loading.wait()
+
+        try:
+            schema = self._load(url)
+            with self._lock:
+                self.schemas[url] = schema
+        finally:
+            with self._lock:
+                del self._loading[url]
+            loading.set()
+
+        return schema
+
+    def load_all(self, url):
+        """ load_all loads the schema with the given URL together with all
+        the schemas it references, directly or indirectly, and returns the
+        mapping between the URLs and the contents of all of them.
+        """
+        url = urlparse.urldefrag(url)[0]
+
+        pending = [url]
+        loaded = {}
+        while pending:
+            current = pending.pop()
+            if current in loaded:
+                continue
+
+            loaded[current] = self.get(current)
+            for ref in _iter_refs(loaded[current], current):
+                if ref not in loaded and ref.startswith(("http:", "https:")):
+                    pending.append(ref)
+
+        return loaded
+
+
+# _STORE is the SchemaStore set up from the configuration on first use:
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+# _VALIDATORS holds the validators compiled by each thread; as the reference
+# resolvers of jsonschema validators may not be shared between threads:
+_VALIDATORS = threading.local()
+
+# _GENERATION is increased on every reset, so that all the threads discard
+# the validators they compiled beforehand:
+_GENERATION = 0
+
+
+def get_schema_store():
+    """ get_schema_store returns the SchemaStore configured through the
+    arm_schema_* configuration options.
+    """
+    global _STORE
+
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = SchemaStore(
+                CONF.arm_schema_cache_dir,
+                ttl=CONF.arm_schema_cache_ttl,
+                bundle_dir=CONF.arm_schema_bundle_dir,
+                offline=CONF.arm_schema_offline,
+                timeout=CONF.arm_schema_download_timeout,
+            )
+        return _STORE
+
+
+def reset():
+    """ reset discards the schema store and the validators compiled by all
+    the threads so that any configuration changes are picked up on next use.
+    """
+    global _STORE
+    global _GENERATION
+
+    with _STORE_LOCK:
+        _STORE = None
+        _GENERATION += 1
+
+
+def get_validator(schema_url=None):
+    """ get_validator returns the validator for the schema with the given
+    URL, which defaults to the ARM template schema.
+
+    The validator is compiled on first use, with all the referenced schemas
+    preloaded, and reused from there on.
+
+    NOTE: jsonschema is only imported on first use as it is rather heavy.
+    """
+    import jsonschema
+
+    schema_url = schema_url or constants.ARM_SCHEMA_URL
+
+    if getattr(_VALIDATORS, "generation", None) != _GENERATION:
+        _VALIDATORS.generation = _GENERATION
+        _VALIDATORS.validators = {}
+
+    validators = _VALIDATORS.validators
+    if schema_url not in validators:
+        store = get_schema_store()
+        schemas = store.load_all(schema_url)
+        schema = store.get(schema_url)
+
+        resolver = jsonschema.RefResolver(
+            schema_url, schema, store=schemas,
+            handlers={"http": store.get, "https": store.get})
+
+        validator_class = jsonschema.validators.validator_for(schema)
+        validators[schema_url] = validator_class(schema, resolver=resolver)
+
+    return validators[schema_url]
+
+
+def get_schema(schema_url=None):
+    """ get_schema returns the schema with the given URL, which defaults to
+    the ARM template schema.
+    """
+    return get_schema_store().get(schema_url or constants.ARM_SCHEMA_URL)
+
+
+def validate(template_data, schema_url=None):
+    """ validate validates the given template data against the schema with
+    the given URL, which defaults to the ARM template schema.
+    """
+    get_validator(schema_url).validate(template_data)
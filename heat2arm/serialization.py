@@ -0,0 +1,162 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Contains the helpers for loading Heat templates and writing out the
+    resulting ARM templates.
+"""
+
+import json
+
+import yaml
+
+# _YAML_LOADER is the loader of YAML Heat templates, which loads all scalar
+# values as strings:
+_YAML_LOADER = getattr(yaml, "CBaseLoader", yaml.BaseLoader)
+
+# ARM_TEMPLATE_INDENT is the indentation of pretty-printed ARM templates:
+ARM_TEMPLATE_INDENT = 4
+
+# STREAMED_DEPTH is the number of nesting levels of the ARM template which are
+# written out piece by piece; deeper values, such as each resource, are
+# encoded whole:
+STREAMED_DEPTH = 2
+
+
+def _stringify_json_constants(data):
+    """ _stringify_json_constants is a helper function which replaces all the
+    booleans and nulls within the given JSON data with their literal strings,
+    as YAML's BaseLoader would have loaded them.
+    """
+    if isinstance(data, dict):
+        for key, value in data.items():
+            data[key] = _stringify_json_constants(value)
+    elif isinstance(data, list):
+        for i, value in enumerate(data):
+            data[i] = _stringify_json_constants(value)
+    elif data is True:
+        return "true"
+    elif data is False:
+        return "false"
+    elif data is None:
+        return "null"
+
+    return data
+
+
+def _load_json(text):
+    """ _load_json is a helper function which loads the given JSON text with
+    all of its scalar values as strings, or returns None if it is not valid
+    JSON.
+    """
+    try:
+        data = json.loads(text, parse_int=str, parse_float=str,
+                          parse_constant=str)
+    except ValueError:
+        return None
+
+    return _stringify_json_constants(data)
+
+
+def load_heat_template(stream):
+    """ load_heat_template reads and returns the data of the Heat template
+    from the given stream or string.
+
+    JSON templates are loaded with the json module, and YAML ones with
+    libyaml's loader if available.
+
+    NOTE: all scalar values are loaded as strings, which is what the
+    translators expect.
+    """
+    text = stream.read() if hasattr(stream, "read") else stream
+    if isinstance(text, bytes):
+        text = text.decode("utf-8-sig")
+
+    if text.lstrip()[:1] == "{":
+        data = _load_json(text)
+        if data is not None:
+            return data
+
+    return yaml.load(text, Loader=_YAML_LOADER)
+
+
+def _get_encoder(compact):
+    """ _get_encoder is a helper function which returns the JSON encoder of
+    ARM templates; either a compact or a pretty-printing one.
+
+    NOTE: the separators are left to their defaults in pretty mode so that
+    the output is the same as json.dumps's on all Python versions.
+    """
+    if compact:
+        return json.JSONEncoder(separators=(",", ":"))
+
+    return json.JSONEncoder(indent=ARM_TEMPLATE_INDENT)
+
+
+def _write_value(encoder, value, stream, level, depth):
+    """ _write_value is a helper function which writes the JSON of the given
+    value found at the given indentation level to the given stream, writing
+    out the items of containers separately up to the given depth.
+    """
+    if not depth or not value or not isinstance(value, (dict, list)):
+        chunk = encoder.encode(value)
+        if encoder.indent is not None and level:
+            # NOTE: newlines within strings are always escaped, so all the
+            # remaining ones are between items:
+            chunk = chunk.replace(
+                "\n", "\n" + " " * (ARM_TEMPLATE_INDENT * level))
+        stream.write(chunk)
+        return
+
+    newline = ""
+    closing_newline = ""
+    if encoder.indent is not None:
+        newline = "\n" + " " * (ARM_TEMPLATE_INDENT * (level + 1))
+        closing_newline = "\n" + " " * (ARM_TEMPLATE_INDENT * level)
+
+    is_dict = isinstance(value, dict)
+    stream.write("{" if is_dict else "[")
+
+    items = value.items() if is_dict else enumerate(value)
+    for i, (key, item) in enumerate(items):
+        if i:
+            stream.write(encoder.item_separator)
+        stream.write(newline)
+        if is_dict:
+            stream.write(encoder.encode(key))
+            stream.write(encoder.key_separator)
+        _write_value(encoder, item, stream, level + 1, depth - 1)
+
+    stream.write(closing_newline)
+    stream.write("}" if is_dict else "]")
+
+
+def dump_arm_template(arm_template_data, stream, compact=False):
+    """ dump_arm_template writes the given ARM template data as JSON to the
+    given stream, either pretty-printed or compact.
+
+    The template is written out resource by resource, so its whole JSON is
+    never held in memory at once; the output is the same as that of
+    dumps_arm_template.
+    """
+    _write_value(_get_encoder(compact), arm_template_data, stream, 0,
+                 STREAMED_DEPTH)
+
+
+def dumps_arm_template(arm_template_data, compact=False):
+    """ dumps_arm_template returns the JSON string of the given ARM template
+    data as it is written by dump_arm_template.
+    """
+    return _get_encoder(compact).encode(arm_template_data)
@@ -0,0 +1,635 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Defines the long-running conversion service started through
+    `heat2arm serve`.
+
+    The service keeps Heat, oslo.config and all the translators loaded and
+    converts the Heat templates POST-ed to /convert into ARM templates:
+
+    $ heat2arm serve --port 8080 &
+    $ curl --data-binary @heat_template.yaml http://127.0.0.1:8080/convert
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+from multiprocessing import pool as mp_pool
+import os
+import threading
+import time
+
+try:
+    from http import server as http_server
+    import queue
+    import socketserver
+except ImportError:
+    import BaseHTTPServer as http_server
+    import Queue as queue
+    import SocketServer as socketserver
+
+from oslo_config import cfg
+
+from heat2arm import batch
+from heat2arm import cache
+from heat2arm import serialization
+from heat2arm import translation_engine as engine
+from heat2arm.translators import registry
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+# WORKER_TYPES are the supported kinds of conversion workers:
+WORKER_TYPES = ["process", "thread"]
+
+# OUTCOMES maps the HTTP status codes of conversions to the names of their
+# outcomes within the server's status:
+OUTCOMES = {
+    200: "succeeded",
+    400: "failed",
+    500: "crashed",
+    503: "rejected",
+    504: "timed_out",
+}
+
+
+def _convert_request(body):
+    """ _convert_request is a helper function which converts the given Heat
+    template body inside a worker and returns a tuple of a success flag,
+    either the resulting ARM template's JSON or the error message and the
+    statistics of the use of the translation cache.
+
+    NOTE: errors are returned rather than raised, so that they can be sent
+    back from the conversion processes, along with the statistics.
+    """
+    cache_stats = cache.new_stats()
+    try:
+        heat_template_data = serialization.load_heat_template(body)
+
+        translation_cache = cache.get_translation_cache()
+        if translation_cache is not None:
+            return (True, translation_cache.convert(
+                heat_template_data, stats=cache_stats)[0], cache_stats)
+
+        arm_template_data = engine.convert_template(heat_template_data)
+        return (True, serialization.dumps_arm_template(arm_template_data),
+                cache_stats)
+    except Exception as ex:
+        LOG.debug("Failed converting template:", exc_info=True)
+        return (False, "%s: %s" % (ex.__class__.__name__, ex), cache_stats)
+
+
+def _run_worker(conn, config_file, api_version, overrides):
+    """ _run_worker is a helper function which runs inside a persistent
+    conversion process: it sets up the configuration from the given
+    configuration file, ARM API version and dict of option overrides, warms
+    up, signals it is ready and then converts all the Heat template bodies
+    received through the given connection until it gets closed.
+    """
+    batch.init_worker(config_file, api_version)
+    for (name, value) in overrides.items():
+        CONF.set_override(name, value)
+    _preload()
+    conn.send(_WORKER_READY)
+
+    while True:
+        try:
+            body = conn.recv()
+        except EOFError:
+            break
+        conn.send(_convert_request(body))
+
+
+# _WORKER_READY is sent by conversion processes once warmed up:
+_WORKER_READY = "ready"
+
+
+def _get_process_context():
+    """ _get_process_context is a helper function which returns the
+    multiprocessing context conversion processes are started with.
+
+    Processes are started by a fork server where possible, as replacements
+    of timed out processes are started while the server's threads run and
+    forking a multithreaded process may deadlock; or are plainly forked
+    otherwise.
+    """
+    if not hasattr(multiprocessing, "get_context"):
+        return multiprocessing
+
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        return context
+
+    return multiprocessing.get_context()
+
+
+class _WorkerProcess(object):
+    """ _WorkerProcess is a persistent conversion process started within the
+    given multiprocessing context with the given arguments of _run_worker,
+    along with the connection to it.
+    """
+    def __init__(self, context, args):
+        (self.conn, child_conn) = context.Pipe()
+        self.process = context.Process(target=_run_worker,
+                                       args=(child_conn,) + args)
+        self.process.daemon = True
+        self.process.start()
+        # NOTE: the child's end is closed here so that the parent's one
+        # gets EOF if the child dies:
+        child_conn.close()
+
+        # ready is set once the process signalled it is warmed up:
+        self.ready = False
+
+    def wait_ready(self, timeout):
+        """ wait_ready waits at most the given number of seconds for the
+        process to be warmed up, and returns whether it is.
+
+        It raises EOFError if the process died in the meantime.
+        """
+        if not self.ready and self.conn.poll(timeout):
+            self.conn.recv()
+            self.ready = True
+
+        return self.ready
+
+    def stop(self):
+        """ stop stops the process, killing it if still running, and returns
+        its exit code.
+        """
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+
+        return self.process.exitcode
+
+
+class _Slots(object):
+    """ _Slots is a counter of the given number of free slots which may be
+    acquired with a timeout on all the supported Python versions.
+    """
+    def __init__(self, count):
+        self._count = count
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=0):
+        """ acquire takes a slot, waiting at most the given number of seconds
+        for one to be freed, and returns whether it got one.
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._count == 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+
+            self._count -= 1
+            return True
+
+    def release(self):
+        """ release frees a slot. """
+        with self._cond:
+            self._count += 1
+            self._cond.notify()
+
+
+class ConversionServer(socketserver.ThreadingMixIn, http_server.HTTPServer):
+    """ ConversionServer is the HTTP server which runs the conversions of the
+    templates it receives on a bounded number of workers.
+
+    At most workers + max_pending conversions are admitted at a time, any
+    additional request being promptly rejected until a slot frees up.
+
+    Process workers are persistent processes, warmed up once, which take
+    the conversions from the server one at a time; a process whose
+    conversion times out is killed and replaced by a new one. Thread
+    workers cannot be stopped, so a timed out conversion keeps its slot
+    until it is over, and is reported as abandoned in the status meanwhile.
+
+    The outcomes of all the conversions and the statistics of the use of the
+    translation cache by all the workers are aggregated into its status.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, workers, worker_type="process",
+                 request_timeout=30, max_pending=None,
+                 max_body_size=10 * 1024 * 1024, config_file=None,
+                 api_version=None, overrides=None):
+        http_server.HTTPServer.__init__(self, address,
+                                        ConversionRequestHandler)
+
+        if max_pending is None:
+            max_pending = workers * 4
+
+        self.request_timeout = request_timeout
+        self.max_body_size = max_body_size
+
+        self._worker_count = workers
+        self._worker_type = worker_type
+        self._outcomes = dict((outcome, 0) for outcome in OUTCOMES.values())
+        self._cache_stats = cache.new_stats()
+        self._abandoned = 0
+        self._stats_lock = threading.Lock()
+
+        self._slots = _Slots(workers + max_pending)
+        self._pool = None
+        if worker_type == "process":
+            self._context = _get_process_context()
+            self._worker_args = (config_file, api_version,
+                                 dict(overrides or {}))
+
+            # _processes holds all the worker processes, and _idle those
+            # waiting for a conversion:
+            self._processes = set()
+            self._processes_lock = threading.Lock()
+            self._idle = queue.Queue()
+            for _ in range(workers):
+                self._idle.put(self._start_worker())
+        else:
+            self._pool = mp_pool.ThreadPool(processes=workers)
+
+    def convert(self, body):
+        """ convert runs the conversion of the given Heat template body and
+        returns a tuple of the HTTP status code and either the resulting ARM
+        template's JSON or the error message.
+        """
+        result = self._convert(body)
+        with self._stats_lock:
+            self._outcomes[OUTCOMES[result[0]]] += 1
+
+        return result
+
+    def _convert(self, body):
+        """ _convert is a helper method which runs the conversion of the
+        given Heat template body on the server's workers.
+        """
+        if not self._slots.acquire():
+            return (503, "Too many conversions underway.")
+
+        if self._pool is not None:
+            return self._convert_in_thread(body)
+
+        try:
+            return self._convert_in_process(body)
+        finally:
+            self._slots.release()
+
+    def _start_worker(self):
+        """ _start_worker is a helper method which starts a new worker
+        process.
+        """
+        worker = _WorkerProcess(self._context, self._worker_args)
+        with self._processes_lock:
+            self._processes.add(worker)
+
+        return worker
+
+    def _replace_worker(self, worker):
+        """ _replace_worker is a helper method which stops the given worker
+        process, hands a new one over to the idle ones in its place and
+        returns the exit code of the stopped one.
+        """
+        with self._processes_lock:
+            self._processes.discard(worker)
+        exitcode = worker.stop()
+        self._idle.put(self._start_worker())
+
+        return exitcode
+
+    def _add_cache_stats(self, cache_stats):
+        """ _add_cache_stats is a helper method which adds the given
+        statistics of the use of the translation cache by a conversion to
+        the server's.
+        """
+        with self._stats_lock:
+            cache.add_stats(self._cache_stats, cache_stats)
+
+    def get_status(self):
+        """ get_status returns the JSON-serializable status of the server,
+        with the outcomes of all the conversions and the statistics of the
+        use of the translation cache, if enabled.
+        """
+        with self._stats_lock:
+            return {
+                "worker_type": self._worker_type,
+                "workers": self._worker_count,
+                "abandoned": self._abandoned,
+                "conversions": dict(self._outcomes),
+                "translation_cache": dict(self._cache_stats) if (
+                    cache.get_translation_cache() is not None) else None,
+            }
+
+    def _run_in_thread(self, body, job):
+        """ _run_in_thread is a helper method which runs the conversion of
+        the given Heat template body within a thread worker and frees its
+        slot once over, whatever happens; job being the dict tracking
+        whether the conversion was abandoned by its request.
+        """
+        try:
+            (success, output, cache_stats) = _convert_request(body)
+            # NOTE: the statistics are added here so that those of timed
+            # out conversions are not lost:
+            self._add_cache_stats(cache_stats)
+            return (success, output)
+        except BaseException as ex:
+            # NOTE: even fatal errors are only reported, as they would
+            # otherwise take the worker thread down:
+            LOG.error("Conversion worker failed:", exc_info=True)
+            return (False, "%s: %s" % (ex.__class__.__name__, ex))
+        finally:
+            with self._stats_lock:
+                job["done"] = True
+                if job["abandoned"]:
+                    self._abandoned -= 1
+            self._slots.release()
+
+    def _convert_in_thread(self, body):
+        """ _convert_in_thread is a helper method which hands the conversion
+        of the given Heat template body over to the thread workers and waits
+        for it at most the request timeout.
+
+        NOTE: threads cannot be stopped, so a timed out conversion runs on
+        to its end, holding both its slot and its worker thread, and is
+        counted as abandoned until then.
+        """
+        job = {"abandoned": False, "done": False}
+        result = self._pool.apply_async(self._run_in_thread, (body, job))
+        try:
+            (success, output) = result.get(self.request_timeout)
+        except multiprocessing.TimeoutError:
+            with self._stats_lock:
+                if not job["done"]:
+                    job["abandoned"] = True
+                    self._abandoned += 1
+            return (504, "Conversion timed out after %ss." %
+                    self.request_timeout)
+
+        return (200 if success else 400, output)
+
+    def _convert_in_process(self, body):
+        """ _convert_in_process is a helper method which hands the conversion
+        of the given Heat template body over to the first idle worker
+        process, replacing the process if it does not complete within the
+        request timeout or dies.
+        """
+        deadline = time.time() + self.request_timeout
+        try:
+            worker = self._idle.get(timeout=self.request_timeout)
+        except queue.Empty:
+            return (504, "Conversion timed out after %ss waiting for a "
+                    "worker." % self.request_timeout)
+
+        try:
+            if not worker.wait_ready(max(deadline - time.time(), 0)):
+                # NOTE: the process is only still warming up, so it is
+                # kept for the following conversions:
+                self._idle.put(worker)
+                return (504, "Conversion timed out after %ss waiting for a "
+                        "worker." % self.request_timeout)
+
+            worker.conn.send(body)
+            if not worker.conn.poll(max(deadline - time.time(), 0)):
+                self._replace_worker(worker)
+                return (504, "Conversion timed out after %ss." %
+                        self.request_timeout)
+            (success, output, cache_stats) = worker.conn.recv()
+        except (EOFError, IOError, OSError):
+            return (500, "Conversion worker exited with code %s." %
+                    self._replace_worker(worker))
+
+        self._add_cache_stats(cache_stats)
+        self._idle.put(worker)
+
+        return (200 if success else 400, output)
+
+    def server_close(self):
+        """ server_close closes the server's socket and stops all of its
+        workers.
+        """
+        http_server.HTTPServer.server_close(self)
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+        else:
+            with self._processes_lock:
+                processes = list(self._processes)
+                self._processes.clear()
+            for worker in processes:
+                worker.stop()
+
+
+class ConversionRequestHandler(http_server.BaseHTTPRequestHandler):
+    """ ConversionRequestHandler handles the requests of the
+    ConversionServer:
+        - GET /healthz: returns 200 as long as the service is up.
+        - GET /status: returns the status of the server, with the outcomes
+        of the conversions and the statistics of the translation cache.
+        - POST /convert: converts the Heat template in the body of the
+        request and returns the resulting ARM template.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, code, body, content_type="application/json"):
+        """ _send is a helper method which sends the response with the
+        given code and body.
+        """
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, code, message):
+        """ _send_error is a helper method which sends a JSON error response
+        with the given code and message.
+        """
+        self._send(code, json.dumps({"error": message}))
+
+    def do_GET(self):
+        """ do_GET handles the health check and status requests. """
+        if self.path == "/healthz":
+            self._send(200, "OK", content_type="text/plain")
+        elif self.path == "/status":
+            self._send(200, json.dumps(self.server.get_status()))
+        else:
+            self._send_error(404, "Not found.")
+
+    def do_POST(self):
+        """ do_POST handles the conversion requests. """
+        if self.path != "/convert":
+            self._send_error(404, "Not found.")
+            return
+
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self._send_error(411, "Content-Length is required.")
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._send_error(400, "Invalid Content-Length.")
+            return
+        if length > self.server.max_body_size:
+            self._send_error(413, "Template exceeds %d bytes." %
+                             self.server.max_body_size)
+            return
+
+        body = self.rfile.read(length)
+
+        (code, output) = self.server.convert(body)
+        if code != 200:
+            self._send_error(code, output)
+            return
+
+        self._send(200, output)
+
+    def log_message(self, fmt, *args):
+        """ log_message redirects the access logs to the module's logger. """
+        LOG.info("%s - %s", self.address_string(), fmt % args)
+
+
+def _parse_args(argv):
+    """ _parse_args is a helper function which parses the provided command
+    line arguments of the serve command and returns the parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="heat2arm serve",
+        description='OpenStack Heat to Azure ARM template conversion '
+        'service.')
+    parser.add_argument("--host", dest="host", default="127.0.0.1",
+                        help="Address to listen on", type=str)
+    parser.add_argument("--port", dest="port", default=8080,
+                        help="Port to listen on", type=int)
+    parser.add_argument("--workers", dest="workers",
+                        default=multiprocessing.cpu_count(),
+                        help="Number of conversion workers; defaults to "
+                        "the number of CPUs", type=int)
+    parser.add_argument("--worker-type", dest="worker_type",
+                        default="process", choices=WORKER_TYPES,
+                        help="Whether conversions run in persistent "
+                        "processes, which are replaced once timed out, or "
+                        "in threads, which cannot be stopped")
+    parser.add_argument("--max-pending", dest="max_pending",
+                        help="Number of conversions which may be queued "
+                        "while all workers are busy; defaults to four "
+                        "times the number of workers", type=int)
+    parser.add_argument("--timeout", dest="timeout", default=30,
+                        help="Timeout in seconds of a single conversion",
+                        type=float)
+    parser.add_argument("--max-body-size", dest="max_body_size",
+                        default=10 * 1024 * 1024,
+                        help="Maximum size in bytes of a Heat template",
+                        type=int)
+    parser.add_argument("--config-file",
+                        help="Path to an optional configuration file",
+                        type=str)
+    parser.add_argument("--api-version", dest="api_version",
+                        help="Optional Azure ARM API version string of "
+                        "the form YYYY-MM-DD[-preview].",
+                        type=str)
+    parser.add_argument("--fast", dest="fast", action="store_true",
+                        help="Parse the Heat templates with the built-in "
+                        "lightweight template model instead of Heat")
+    parser.add_argument("--cache-dir", dest="cache_dir",
+                        help="Optional directory in which to cache the "
+                        "translations, so that unchanged templates are not "
+                        "converted again", type=str)
+    parser.add_argument("--check-limits", dest="check_limits",
+                        action="store_true",
+                        help="Fail the conversions of the Heat templates "
+                        "whose ARM templates exceed the limits of Azure "
+                        "Resource Manager")
+    return parser.parse_args(argv)
+
+
+def _preload():
+    """ _preload is a helper function which sets up everything conversions
+    would otherwise set up on first use, so that the first requests are not
+    slower: all the translators, the mapping provider and lookup tables,
+    the translation cache and, as configured, Heat and the ARM schema
+    validator.
+    """
+    for heat_resource_type in registry.get_registered_types():
+        registry.get_translator(heat_resource_type)
+
+    # NOTE: imported here as the instances translators and the mapping
+    # providers are loaded lazily:
+    from heat2arm.translators.instances import lookup_tables
+    from heat2arm.translators.instances import mapping_providers
+    mapping_providers.get_provider()
+    lookup_tables.get_tables()
+
+    cache.get_translation_cache()
+
+    if not CONF.fast_template_parser:
+        engine.init_heat()
+
+    if CONF.validate_arm_template_schema:
+        from heat2arm import schema
+        schema.get_validator()
+
+
+def main(argv):
+    """ main parses the given arguments of the serve command and runs the
+    conversion service until interrupted.
+    """
+    args = _parse_args(argv)
+
+    # NOTE: the configuration is loaded only once for the whole lifetime of
+    # the service and handed down to all the workers:
+    batch.init_worker(args.config_file, args.api_version)
+    overrides = {}
+    if args.fast:
+        overrides["fast_template_parser"] = True
+    if args.cache_dir:
+        overrides["translation_cache_dir"] = args.cache_dir
+    if args.check_limits:
+        overrides["check_arm_limits"] = True
+    for (name, value) in overrides.items():
+        CONF.set_override(name, value)
+
+    if args.worker_type == "thread":
+        _preload()
+
+    server = ConversionServer(
+        (args.host, args.port), args.workers,
+        worker_type=args.worker_type,
+        request_timeout=args.timeout,
+        max_pending=args.max_pending,
+        max_body_size=args.max_body_size,
+        config_file=args.config_file,
+        api_version=args.api_version,
+        overrides=overrides,
+    )
+
+    LOG.warn("Serving conversions on http://%s:%d with %d %s workers.",
+             args.host, args.port, args.workers, args.worker_type)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,395 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Defines a lightweight in-memory model of both HOT and CFN templates which
+    may be used by the translators in place of a full-blown Heat stack.
+
+    It exposes the same accessors the translators use on Heat stacks and
+    resources, namely:
+        - stack[resource_name] and stack.iter_resources().
+        - resource.name, resource.type() and resource.stack.
+        - resource.properties[name], which returns the resolved value.
+        - resource.properties.data[name], which returns the raw value, where
+        intrinsic functions are represented by objects with an args field.
+
+    Like Heat, the model applies the defaults of the properties of all the
+    resource types which can be translated and requires their mandatory
+    properties; but only the structure of the template and its references
+    are validated, the values of properties and unknown resource types are
+    not.
+"""
+
+import copy
+
+# FUNCTIONS is the set of names of all the supported intrinsic functions
+# in both HOT and CFN templates:
+FUNCTIONS = frozenset([
+    "get_param", "get_resource", "get_attr", "get_file", "str_replace",
+    "list_join", "resource_facade", "Ref", "Fn::GetAtt", "Fn::Join",
+    "Fn::Base64", "Fn::FindInMap", "Fn::Select", "Fn::GetAZs", "Fn::Split",
+    "Fn::Replace", "Fn::ResourceFacade", "Fn::MemberListToMap",
+])
+
+# PROPERTY_SCHEMAS maps the types of all the resources which can be
+# translated to the (defaults, required properties) tuples of their
+# properties; as defined by the schemas of the corresponding Heat resources:
+PROPERTY_SCHEMAS = {
+    "OS::Nova::Server": ({
+        "user_data": "",
+        "user_data_format": "HEAT_CFNTOOLS",
+        "flavor_update_policy": "RESIZE",
+        "image_update_policy": "REBUILD",
+        "software_config_transport": "POLL_SERVER_CFN",
+        "personality": {},
+        "security_groups": [],
+    }, ("flavor",)),
+    "AWS::EC2::Instance": ({}, ("ImageId", "InstanceType")),
+    "OS::Neutron::Net": ({
+        "admin_state_up": True,
+        "shared": False,
+    }, ()),
+    "OS::Neutron::Subnet": ({
+        "ip_version": 4,
+        "enable_dhcp": True,
+        "dns_nameservers": [],
+    }, ()),
+    "OS::Neutron::Port": ({"admin_state_up": True}, ()),
+    "OS::Neutron::Router": ({"admin_state_up": True}, ()),
+    "OS::Cinder::VolumeAttachment": ({}, ("instance_uuid", "volume_id")),
+    "AWS::EC2::VolumeAttachment": ({}, ("InstanceId", "VolumeId",
+                                        "Device")),
+    "AWS::EC2::Volume": ({}, ("AvailabilityZone",)),
+    "AWS::AutoScaling::AutoScalingGroup": ({}, ("AvailabilityZones",
+                                                "MaxSize", "MinSize")),
+}
+
+# PSEUDO_PARAMETERS are the values of the CFN pseudo parameters; as they
+# would be in the dummy stack built by Heat:
+PSEUDO_PARAMETERS = {
+    "AWS::StackName": "Dummy",
+    "AWS::StackId": "None",
+    "AWS::Region": "ap-southeast-1",
+}
+
+
+def _is_string(value):
+    """ _is_string is a helper function which checks whether the given value
+    is a string on both Python 2 and 3.
+    """
+    return hasattr(value, "lower")
+
+
+def _stringify(value):
+    """ _stringify is a helper function which returns the string form of
+    the given resolved value to be joined or replaced into another string.
+    """
+    if value is None:
+        return ""
+    return value if _is_string(value) else str(value)
+
+
+class Function(object):
+    """ Function represents an intrinsic function call within the template.
+
+    Like Heat's own functions, it keeps its raw arguments in args and may
+    be compared to its result.
+    """
+    def __init__(self, stack, fn_name, args):
+        self.stack = stack
+        self.fn_name = fn_name
+        self.args = args
+
+    def __eq__(self, other):
+        return self.result() == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return "{%s: %r}" % (self.fn_name, self.args)
+
+    def _get_ref(self, name):
+        """ _get_ref is a helper method which returns the value a reference
+        to the given name resolves to; either a parameter value or the
+        reference ID of a resource, which is its name for an undeployed
+        resource.
+        """
+        if name in self.stack.parameters:
+            return self.stack.parameters[name]
+        if name in PSEUDO_PARAMETERS:
+            return PSEUDO_PARAMETERS[name]
+        return name
+
+    def result(self):
+        """ result returns the resolved value of the function call. """
+        name = self.fn_name
+        args = resolve(self.args)
+
+        if name in ("get_param", "Ref"):
+            if isinstance(args, list):
+                # get_param may also index into the parameter's value:
+                value = self._get_ref(args[0])
+                for key in args[1:]:
+                    try:
+                        value = value[key]
+                    except (IndexError, KeyError, TypeError):
+                        return None
+                return value
+            return self._get_ref(args)
+
+        if name == "get_resource":
+            return args
+
+        if name in ("Fn::Join", "list_join"):
+            (delim, values) = args
+            return _stringify(delim).join(_stringify(v) for v in values or [])
+
+        if name == "str_replace":
+            value = _stringify(args.get("template"))
+            for key, val in (args.get("params") or {}).items():
+                value = value.replace(key, _stringify(val))
+            return value
+
+        if name == "Fn::Replace":
+            (params, value) = args
+            value = _stringify(value)
+            for key, val in params.items():
+                value = value.replace(key, _stringify(val))
+            return value
+
+        if name == "Fn::Split":
+            (delim, value) = args
+            return _stringify(value).split(delim)
+
+        if name == "Fn::Select":
+            (index, values) = args
+            try:
+                if isinstance(values, dict):
+                    return values[index]
+                return values[int(index)]
+            except (IndexError, KeyError, TypeError, ValueError):
+                return ""
+
+        if name == "Fn::FindInMap":
+            (map_name, key, value) = args
+            try:
+                return self.stack.mappings[map_name][key][value]
+            except (KeyError, TypeError):
+                return None
+
+        if name == "Fn::Base64":
+            # NOTE: Heat does not actually encode the value either:
+            return args
+
+        if name == "Fn::GetAZs":
+            return []
+
+        # NOTE: attributes, files and facades are not available before the
+        # stack is actually deployed:
+        return None
+
+
+def parse(stack, data):
+    """ parse returns the given raw template snippet with all the intrinsic
+    function calls within it replaced by Function objects.
+    """
+    if isinstance(data, dict):
+        if len(data) == 1:
+            (key, value) = list(data.items())[0]
+            if key in FUNCTIONS:
+                return Function(stack, key, parse(stack, value))
+        return dict((key, parse(stack, value)) for key, value in data.items())
+
+    if isinstance(data, list):
+        return [parse(stack, value) for value in data]
+
+    return data
+
+
+def resolve(data):
+    """ resolve returns the given parsed template snippet with all the
+    Function objects within it replaced by their results.
+    """
+    if isinstance(data, Function):
+        return data.result()
+
+    if isinstance(data, dict):
+        return dict((key, resolve(value)) for key, value in data.items())
+
+    if isinstance(data, list):
+        return [resolve(value) for value in data]
+
+    return data
+
+
+class Properties(object):
+    """ Properties represents the properties of a resource. The raw values
+    are available in data, while indexing returns the resolved values or
+    the given defaults of the properties which are not set.
+    """
+    def __init__(self, data, defaults=None):
+        self.data = data
+        self.defaults = defaults or {}
+
+    def __contains__(self, key):
+        return key in self.data or key in self.defaults
+
+    def __getitem__(self, key):
+        if key not in self.data and key in self.defaults:
+            return copy.deepcopy(self.defaults[key])
+        return resolve(self.data.get(key))
+
+    def get(self, key, default=None):
+        """ get returns the resolved value of the given property or the
+        default if the property is neither set nor has a default.
+        """
+        if key not in self:
+            return default
+        return self[key]
+
+
+class Resource(object):
+    """ Resource represents a single resource definition of the template. """
+    def __init__(self, stack, name, resource_type, properties):
+        self.stack = stack
+        self.name = name
+        self._type = resource_type
+
+        (defaults, required) = PROPERTY_SCHEMAS.get(resource_type, ({}, ()))
+        for key in required:
+            if key not in properties:
+                raise Exception(
+                    'Resource "%s" is missing required property "%s".' % (
+                        name, key))
+        self.properties = Properties(properties, defaults)
+
+    def type(self):
+        """ type returns the Heat type of the resource. """
+        return self._type
+
+    def __repr__(self):
+        return "Resource(%r, %r)" % (self.name, self._type)
+
+
+class Stack(object):
+    """ Stack is the lightweight model of a HOT or CFN template, resolved
+    against the default values of its parameters.
+    """
+    def __init__(self, template_data, parameters=None):
+        if not isinstance(template_data, dict):
+            raise Exception("The template must be a mapping.")
+
+        if "heat_template_version" in template_data:
+            sections = ("parameters", "resources", "type", "properties",
+                        "default", "depends_on")
+            self.mappings = {}
+        else:
+            sections = ("Parameters", "Resources", "Type", "Properties",
+                        "Default", "DependsOn")
+            self.mappings = template_data.get("Mappings") or {}
+        (params_key, resources_key, type_key, props_key, default_key,
+         depends_key) = sections
+
+        self.parameters = {}
+        for name, param in (template_data.get(params_key) or {}).items():
+            if isinstance(param, dict):
+                self.parameters[name] = param.get(default_key)
+        self.parameters.update(parameters or {})
+
+        self._resources = {}
+        self._resource_names = []
+        resources = template_data.get(resources_key) or {}
+        if not isinstance(resources, dict):
+            raise Exception('The "%s" section must be a mapping.' %
+                            resources_key)
+
+        for name, definition in resources.items():
+            if (not isinstance(definition, dict) or
+                    not _is_string(definition.get(type_key))):
+                raise Exception('Resource "%s" must have a "%s".' % (
+                    name, type_key))
+
+            self._resources[name] = Resource(
+                self, name, definition[type_key],
+                parse(self, definition.get(props_key) or {}))
+            self._resource_names.append(name)
+
+        self._validate_references(resources, depends_key)
+
+    def _validate_references(self, resources, depends_key):
+        """ _validate_references is a helper method which checks that all the
+        references within the resources' properties and dependencies point to
+        either a resource or a parameter of the template.
+        """
+        for name in self._resource_names:
+            depends_on = resources[name].get(depends_key) or []
+            if _is_string(depends_on):
+                depends_on = [depends_on]
+            for dep in depends_on:
+                if dep not in self._resources:
+                    raise Exception(
+                        'Resource "%s" depends on unknown resource "%s".' % (
+                            name, dep))
+
+            pending = [self._resources[name].properties.data]
+            while pending:
+                data = pending.pop()
+                if isinstance(data, dict):
+                    pending.extend(data.values())
+                elif isinstance(data, list):
+                    pending.extend(data)
+                elif isinstance(data, Function):
+                    self._validate_function(name, data)
+                    pending.append(data.args)
+
+    def _validate_function(self, resource_name, function):
+        """ _validate_function is a helper method which checks that the
+        given function call within the given resource refers to an existing
+        resource or parameter.
+        """
+        args = function.args
+        if function.fn_name in ("get_resource", "get_attr", "Fn::GetAtt"):
+            target = args[0] if isinstance(args, list) else args
+            if _is_string(target) and target not in self._resources:
+                raise Exception(
+                    'Resource "%s" references unknown resource "%s".' % (
+                        resource_name, target))
+        elif function.fn_name in ("get_param", "Ref"):
+            target = args[0] if isinstance(args, list) else args
+            if (_is_string(target) and target not in self.parameters and
+                    target not in self._resources and
+                    target not in PSEUDO_PARAMETERS):
+                raise Exception(
+                    'Resource "%s" references unknown parameter or resource '
+                    '"%s".' % (resource_name, target))
+
+    def __getitem__(self, name):
+        return self._resources[name]
+
+    def __contains__(self, name):
+        return name in self._resources
+
+    def __len__(self):
+        return len(self._resources)
+
+    def iter_resources(self):
+        """ iter_resources iterates through all the resources of the stack
+        in the order in which they were defined.
+        """
+        for name in self._resource_names:
+            yield self._resources[name]
@@ -18,23 +18,18 @@
 """
 
 import collections
-import json
-import jsonschema
 import logging
-import requests
+import multiprocessing
+from multiprocessing import pool as mp_pool
+import os
+import threading
 
 from oslo_config import cfg
 
-from heat.engine import stack
-from heat.engine import template
-from heat.tests import utils as test_utils
-
 from heat2arm import constants
 from heat2arm.context import Context
-from heat2arm.translators import autoscaling
-from heat2arm.translators import instances
-from heat2arm.translators import networking
-from heat2arm.translators import storage
+from heat2arm import profiling
+from heat2arm.translators import registry
 
 
 LOG = logging.getLogger(__name__)
@@ -63,77 +58,349 @@ CONF.register_opts([
         'validate_arm_template_schema',
         default=False,
         help='Validate the generated ARM template schema'),
+    cfg.BoolOpt(
+        'fast_template_parser',
+        default=False,
+        help='Parse Heat templates with the built-in lightweight template '
+             'model instead of building a full Heat stack. Only the '
+             'structure and references of the template are validated'),
+    cfg.BoolOpt(
+        'reduce_arm_dependencies',
+        default=True,
+        help='Deduplicate the dependencies of the generated ARM resources '
+             'and drop those implied by others, so that as many resources '
+             'as possible are deployed in parallel'),
+    cfg.BoolOpt(
+        'deduplicate_arm_variables',
+        default=False,
+        help='Merge all the ARM template variables holding identical values '
+             'into shared variables'),
+    cfg.BoolOpt(
+        'arm_copy_loops',
+        default=False,
+        help='Rewrite groups of homogeneous ARM resources into copy loops'),
+    cfg.IntOpt(
+        'arm_copy_loop_min_count',
+        default=3,
+        help='The minimum number of homogeneous ARM resources to rewrite '
+             'into a copy loop'),
+    cfg.BoolOpt(
+        'check_arm_limits',
+        default=False,
+        help='Check the resulting ARM templates against the limits of Azure '
+             'Resource Manager, failing translations which exceed any'),
+    cfg.IntOpt(
+        'translation_workers',
+        default=1,
+        help='Number of workers translating the resources of a template in '
+             'parallel; the context updates are always run serially'),
+    cfg.StrOpt(
+        'translation_worker_type',
+        default='thread',
+        choices=["process", "thread"],
+        help='Whether resources are translated in parallel by threads or by '
+             'forked worker processes. Threads are used wherever processes '
+             'cannot be safely forked, such as within batch conversion '
+             'workers or whenever other threads are running'),
 ])
 
-CTX = Context(CONF.default_azure_location)
-
+# RESOURCE_TRANSLATORS is the list of the Heat resource types handled by the
+# built-in translators together with their import paths; their modules are
+# only imported once a resource of their type is first translated:
 RESOURCE_TRANSLATORS = [
-    autoscaling.AWSAutoScalingGroupARMTranslator,
-    instances.NovaServerARMTranslator,
-    instances.EC2InstanceARMTranslator,
-    networking.EC2SecurityGroupARMTranslator,
-    networking.NeutronSecurityGroupARMTranslator,
-    networking.NeutronRouterARMTranslator,
-    networking.NeutronRouterInterfaceARMTranslator,
-    networking.EC2eipARMTranslator,
-    networking.NeutronFloatingIPARMTranslator,
-    networking.NeutronNetARMTranslator,
-    networking.NeutronSubnetARMTranslator,
-    networking.EC2eipAssocARMTranslator,
-    networking.NeutronPortARMTranslator,
-    storage.CinderVolumeARMTranslator,
-    storage.CinderVolumeAttachmentARMTranslator,
-    storage.EBSVolumeARMTranslator,
-    storage.EBSVolumeAttachmentARMTranslator,
+    ("AWS::AutoScaling::AutoScalingGroup",
+     "heat2arm.translators.autoscaling:AWSAutoScalingGroupARMTranslator"),
+    ("OS::Nova::Server",
+     "heat2arm.translators.instances:NovaServerARMTranslator"),
+    ("AWS::EC2::Instance",
+     "heat2arm.translators.instances:EC2InstanceARMTranslator"),
+    ("AWS::EC2::SecurityGroup",
+     "heat2arm.translators.networking:EC2SecurityGroupARMTranslator"),
+    ("OS::Neutron::SecurityGroup",
+     "heat2arm.translators.networking:NeutronSecurityGroupARMTranslator"),
+    ("OS::Neutron::Router",
+     "heat2arm.translators.networking:NeutronRouterARMTranslator"),
+    ("OS::Neutron::RouterInterface",
+     "heat2arm.translators.networking:NeutronRouterInterfaceARMTranslator"),
+    ("AWS::EC2::EIP",
+     "heat2arm.translators.networking:EC2eipARMTranslator"),
+    ("OS::Neutron::FloatingIP",
+     "heat2arm.translators.networking:NeutronFloatingIPARMTranslator"),
+    ("OS::Neutron::Net",
+     "heat2arm.translators.networking:NeutronNetARMTranslator"),
+    ("OS::Neutron::Subnet",
+     "heat2arm.translators.networking:NeutronSubnetARMTranslator"),
+    ("AWS::EC2::EIPAssociation",
+     "heat2arm.translators.networking:EC2eipAssocARMTranslator"),
+    ("OS::Neutron::Port",
+     "heat2arm.translators.networking:NeutronPortARMTranslator"),
+    ("OS::Cinder::Volume",
+     "heat2arm.translators.storage:CinderVolumeARMTranslator"),
+    ("OS::Cinder::VolumeAttachment",
+     "heat2arm.translators.storage:CinderVolumeAttachmentARMTranslator"),
+    ("AWS::EC2::Volume",
+     "heat2arm.translators.storage:EBSVolumeARMTranslator"),
+    ("AWS::EC2::VolumeAttachment",
+     "heat2arm.translators.storage:EBSVolumeAttachmentARMTranslator"),
 ]
 
+# register all the built-in translators:
+for (_heat_resource_type, _path) in RESOURCE_TRANSLATORS:
+    registry.register_translator(_path, _heat_resource_type)
+
+# NOTE: Heat lazily sets up its global resource environment on first use,
+# which is not thread-safe; so it's done under this lock instead:
+_HEAT_INIT_LOCK = threading.Lock()
+
 
 def validate_template_data(template_data):
     """ validate_template_data validates the given template against the ARM
-    schema obtained through calling get_arm_schema.
+    schema using a validator which is compiled only once.
     """
-    schema = get_arm_schema()
-    jsonschema.validate(template_data, schema)
+    from heat2arm import schema
 
+    schema.validate(template_data)
 
-def get_resource_translator(heat_resource):
-    """ get_resource_translator runs through all the available trainslators and
-    finds the appropriate one for the given heat resource type or logs a
-    warning message if no translator is available.
+
+def get_resource_translator(heat_resource, context):
+    """ get_resource_translator looks up the translator registered for the
+    given heat resource's type and returns an instance of it bound to the
+    given context or logs a warning message if no translator is available.
     """
-    res_trans = None
-    for trans in RESOURCE_TRANSLATORS:
-        if trans.heat_resource_type == heat_resource.type():
-            res_trans = trans
+    heat_resource_type = heat_resource.type()
 
+    res_trans = registry.get_translator(heat_resource_type)
     if res_trans:
-        return res_trans(heat_resource, CTX)
+        return res_trans(heat_resource, context)
     else:
         LOG.warn('Could not find a corresponding ARM resource for Heat '
-                 'resource "%s"', heat_resource.type())
+                 'resource "%s"', heat_resource_type)
+
+
+def _iter_references(value):
+    """ _iter_references is a helper function which yields all the strings
+    which may name another resource from the given raw Heat property value.
+
+    Those include the arguments of reference functions such as get_resource,
+    Ref or get_attr, as well as any plain string values.
+    """
+    if hasattr(value, "args"):
+        args = value.args
+        if isinstance(args, list) and args and hasattr(args[0], "lower"):
+            # get_attr and Fn::GetAtt reference the resource first:
+            yield args[0]
+        for ref in _iter_references(args):
+            yield ref
+    elif isinstance(value, dict):
+        for val in value.values():
+            for ref in _iter_references(val):
+                yield ref
+    elif isinstance(value, list):
+        for val in value:
+            for ref in _iter_references(val):
+                yield ref
+    elif hasattr(value, "lower"):
+        yield value
+
+
+def build_reference_index(heat_stack, context):
+    """ build_reference_index runs once through all the resources of the
+    given Heat stack and records in the context which resources reference
+    which others and through which properties.
+    """
+    heat_resources = list(heat_stack.iter_resources())
+    names = set(heat_resource.name for heat_resource in heat_resources)
+
+    for heat_resource in heat_resources:
+        heat_resource_type = heat_resource.type()
+        for prop, value in heat_resource.properties.data.items():
+            seen = set()
+            for ref in _iter_references(value):
+                if ref in names and ref not in seen:
+                    seen.add(ref)
+                    context.add_reference(ref, heat_resource.name, prop,
+                                          heat_resource_type)
 
 
 def get_arm_schema():
-    """ get_arm_schema fetches the ARM schema from its default URL. """
-    response = requests.get(constants.ARM_SCHEMA_URL)
-    response.raise_for_status()
-    return json.loads(response.text)
+    """ get_arm_schema returns the ARM schema from either the bundled
+    schemas, the schema cache or its default URL.
+    """
+    from heat2arm import schema
 
+    return schema.get_schema(constants.ARM_SCHEMA_URL)
 
-def get_arm_template(resources):
-    """ get_arm_template takes a list of resources and returns a dict which is
-    directly renderable into the JSON of an ARM template.
+
+def get_resource_translators(heat_stack, context):
+    """ get_resource_translators returns the list of translators bound to the
+    given context for all the resources of the given stack which can be
+    translated.
     """
-    # run each resource translator:
+    arm_resources = []
+    for heat_resource in heat_stack.iter_resources():
+        res_trans = get_resource_translator(heat_resource, context)
+        if res_trans:
+            arm_resources.append(res_trans)
+
+    return arm_resources
+
+
+def resolve_mappings(resources):
+    """ resolve_mappings resolves all the entries of the mapping provider
+    the translations of the given translators look up at once, before any
+    of them runs.
+    """
+    lookups = []
     for resource in resources:
-        resource.translate()
+        lookups.extend(resource.get_mapping_lookups())
+    if not lookups:
+        return
+
+    # NOTE: the mapping providers are only imported once required, as they
+    # load the instance translators and the modules of all the providers:
+    from heat2arm.translators.instances import mapping_providers
+
+    mapping_providers.bulk_resolve(lookups)
+
+
+# _WORKER_TRANSLATORS holds, within each forked translation worker process
+# only, the translators it was started with:
+_WORKER_TRANSLATORS = []
+
+# TRANSLATION_CHUNKS_PER_WORKER is the number of chunks the translators are
+# split into per translation worker, so that the work is evenly balanced:
+TRANSLATION_CHUNKS_PER_WORKER = 4
+
+
+def _translate_chunk(translators):
+    """ _translate_chunk is a helper function which returns the list of the
+    (fragment, wall time, CPU time) tuples of the translations of the given
+    translators.
+    """
+    results = []
+    for translator in translators:
+        timings = []
+        with profiling.measure(lambda *timing: timings.extend(timing)):
+            fragment = translator.translate_fragment()
+        results.append((fragment, timings[0], timings[1]))
+
+    return results
+
+
+def _init_forked_worker(resources):
+    """ _init_forked_worker is a helper function which sets up a forked
+    translation worker process with the given translators, which it
+    inherits from its parent rather than having them pickled.
+    """
+    global _WORKER_TRANSLATORS
+
+    _WORKER_TRANSLATORS = resources
+
+
+def _translate_forked_chunk(bounds):
+    """ _translate_forked_chunk is a helper function which runs within a
+    forked worker process and translates the given (start, end) slice of
+    the translators it was set up with.
+    """
+    return _translate_chunk(_WORKER_TRANSLATORS[bounds[0]:bounds[1]])
+
+
+def _can_fork():
+    """ _can_fork is a helper function which checks whether translation
+    workers may be forked from the current process; which they may only be
+    if enabled and if no other thread runs, as those may hold locks the
+    forked workers would then wait upon forever.
+    """
+    return (CONF.translation_worker_type == "process" and
+            hasattr(os, "fork") and
+            not multiprocessing.current_process().daemon and
+            threading.active_count() == 1)
+
+
+def _run_pool(resources, chunks, workers):
+    """ _run_pool is a helper function which translates the given (start,
+    end) chunks of the given translators with a pool of the given number of
+    workers and returns the list of the results of each chunk.
+    """
+    if not _can_fork():
+        pool = mp_pool.ThreadPool(processes=workers)
+        try:
+            return pool.map(_translate_chunk, [resources[start:end]
+                                               for (start, end) in chunks])
+        finally:
+            pool.close()
+            pool.join()
+
+    if hasattr(multiprocessing, "get_context"):
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing
+    pool = context.Pool(workers, initializer=_init_forked_worker,
+                        initargs=(resources,))
+
+    try:
+        return pool.map(_translate_forked_chunk, chunks)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def compute_fragments(resources, workers=1,
+                      profiler=profiling.NULL_PROFILER):
+    """ compute_fragments returns the list of the ContextFragments holding
+    the translations of each of the given resource translators, which are
+    computed in parallel by the given number of workers.
+    """
+    if workers > 1 and len(resources) > workers:
+        size = max(1, len(resources) // (
+            workers * TRANSLATION_CHUNKS_PER_WORKER))
+        chunks = [(start, min(start + size, len(resources)))
+                  for start in range(0, len(resources), size)]
+        if _can_fork():
+            profiler.note(
+                "The CPU time of the phases does not include that of the "
+                "translation worker processes, which is only accounted for "
+                "in the CPU time of the translators.")
+        results = [result for chunk in _run_pool(resources, chunks, workers)
+                   for result in chunk]
+    else:
+        results = _translate_chunk(resources)
+
+    fragments = []
+    for (resource, (fragment, wall, cpu)) in zip(resources, results):
+        profiler.translator_finished(resource.__class__, resource._name,
+                                     "translate", wall, cpu)
+        fragments.append(fragment)
+
+    return fragments
+
+
+def merge_fragments(context, fragments):
+    """ merge_fragments applies all the given ContextFragments to the given
+    context in order.
+
+    It raises an exception if the translations of any two resources define
+    the same parameter or variable differently.
+    """
+    for fragment in fragments:
+        context.apply_fragment(fragment)
+
 
-    # also, let all the resource translators apply any changes
-    # to the context they require:
+def run_context_updates(resources, profiler=profiling.NULL_PROFILER):
+    """ run_context_updates lets all the given resource translators apply
+    any changes to the context they require.
+    """
     for resource in resources:
-        resource.update_context()
+        with profiler.translator(resource, "update_context"):
+            resource.update_context()
+
 
-    template_data = CTX.get_template_data()
+def assemble_arm_template(context):
+    """ assemble_arm_template returns a dict which is directly renderable into
+    the JSON of an ARM template out of the data stored within the given
+    context.
+    """
+    template_data = context.get_template_data()
     template_data.update({
         "$schema": constants.ARM_SCHEMA_URL,
         "contentVersion": constants.ARM_TEMPLATE_VERSION
@@ -148,26 +415,164 @@ def get_arm_template(resources):
     ])
 
 
-def convert_template(heat_template_data):
-    """ convert_template takes a heat template and converts it into an ARM
-    template.
+def get_arm_template(resources, context, profiler=profiling.NULL_PROFILER):
+    """ get_arm_template takes a list of resource translators bound to the
+    given context and returns a dict which is directly renderable into the
+    JSON of an ARM template.
     """
-    temp = template.Template(heat_template_data)
-    temp.validate()
+    with profiler.phase("translate"):
+        fragments = compute_fragments(resources, CONF.translation_workers,
+                                      profiler)
+    with profiler.phase("merge"):
+        merge_fragments(context, fragments)
 
-    ctx = test_utils.dummy_context()
+    with profiler.phase("update_context"):
+        run_context_updates(resources, profiler)
 
-    heat_stack = stack.Stack(context=ctx, stack_name="Dummy", tmpl=temp)
-    temp.validate_resource_definitions(heat_stack)
+    with profiler.phase("assemble"):
+        arm_template_data = assemble_arm_template(context)
 
-    arm_resources = []
-    for heat_resource in heat_stack.iter_resources():
-        res_trans = get_resource_translator(heat_resource)
-        if res_trans:
-            arm_resources.append(res_trans)
+    return process_arm_template(arm_template_data, profiler)
 
-    arm_template_data = get_arm_template(arm_resources)
+
+def process_arm_template(arm_template_data,
+                         profiler=profiling.NULL_PROFILER):
+    """ process_arm_template applies all the enabled optimizations over the
+    whole of the given freshly assembled ARM template data and returns it.
+
+    NOTE: the module of each optimization is only imported once it is
+    enabled and run, as are those of the checks in check_arm_template.
+    """
+    if CONF.reduce_arm_dependencies:
+        with profiler.phase("dependencies"):
+            from heat2arm import dependencies
+            dependencies.reduce_dependencies(arm_template_data["resources"])
+
+    if CONF.deduplicate_arm_variables:
+        with profiler.phase("variables"):
+            from heat2arm import variables
+            variables.deduplicate_variables(arm_template_data)
+
+    if CONF.arm_copy_loops:
+        with profiler.phase("copy_loops"):
+            from heat2arm import copy_loops
+            copy_loops.build_copy_loops(arm_template_data)
+
+    return arm_template_data
+
+
+def check_arm_template(arm_template_data,
+                       profiler=profiling.NULL_PROFILER):
+    """ check_arm_template runs all the enabled checks of the given final
+    ARM template data, raising an exception if any fails.
+    """
     if CONF.validate_arm_template_schema:
-        validate_template_data(arm_template_data)
+        with profiler.phase("schema_validate"):
+            validate_template_data(arm_template_data)
+
+    if CONF.check_arm_limits:
+        with profiler.phase("limits"):
+            from heat2arm import limits
+            limits.enforce(arm_template_data)
+
+
+def init_heat():
+    """ init_heat imports Heat and initialises its resources, if not already.
+
+    NOTE: Heat is only imported on first use as it is rather heavy.
+    """
+    from heat.engine import resources as heat_resources
+
+    with _HEAT_INIT_LOCK:
+        heat_resources.initialise()
+
+
+def build_heat_stack(heat_template_data, profiler=profiling.NULL_PROFILER):
+    """ build_heat_stack builds and validates a full Heat stack out of the
+    given Heat template data.
+    """
+    with profiler.phase("heat_init"):
+        init_heat()
+
+        from heat.engine import stack
+        from heat.engine import template
+        from heat.tests import utils as test_utils
+
+    with profiler.phase("template_validate"):
+        temp = template.Template(heat_template_data)
+        temp.validate()
+
+    with profiler.phase("stack_build"):
+        heat_ctx = test_utils.dummy_context()
+        heat_stack = stack.Stack(context=heat_ctx, stack_name="Dummy",
+                                 tmpl=temp)
+
+    with profiler.phase("resource_validate"):
+        temp.validate_resource_definitions(heat_stack)
+
+    return heat_stack
+
+
+def build_stack(heat_template_data, fast=None,
+                profiler=profiling.NULL_PROFILER):
+    """ build_stack returns the stack the translators will work with out of
+    the given Heat template data; either a lightweight template model if
+    fast is set or a full Heat stack otherwise.
+
+    fast defaults to the value of the fast_template_parser option.
+    """
+    if fast is None:
+        fast = CONF.fast_template_parser
+
+    if fast:
+        with profiler.phase("stack_build"):
+            from heat2arm import template_model
+            return template_model.Stack(heat_template_data)
+
+    return build_heat_stack(heat_template_data, profiler)
+
+
+def prepare_translation(heat_template_data, fast=None,
+                        profiler=profiling.NULL_PROFILER):
+    """ prepare_translation builds the stack out of the given Heat template
+    data and returns a tuple of a new translation context, holding the index
+    of the references between the stack's resources, and of the list of the
+    translators of the stack's resources bound to it, whose mapping lookups
+    are all resolved beforehand.
+    """
+    heat_stack = build_stack(heat_template_data, fast, profiler)
+
+    context = Context(CONF.default_azure_location)
+    with profiler.phase("index"):
+        build_reference_index(heat_stack, context)
+
+    with profiler.phase("translators"):
+        arm_resources = get_resource_translators(heat_stack, context)
+
+    with profiler.phase("resolve_mappings"):
+        resolve_mappings(arm_resources)
+
+    return (context, arm_resources)
+
+
+def convert_template(heat_template_data, fast=None, profiler=None):
+    """ convert_template takes a heat template and converts it into an ARM
+    template. If fast is set, the template is parsed using the lightweight
+    template model instead of Heat itself.
+
+    If a profiling.Profiler is given, the time spent in each phase of the
+    conversion and in each translator is recorded within it.
+
+    Each call works within its own translation context, so conversions may
+    safely be run concurrently from multiple threads.
+    """
+    if profiler is None:
+        profiler = profiling.NULL_PROFILER
+
+    (context, arm_resources) = prepare_translation(
+        heat_template_data, fast, profiler)
+
+    arm_template_data = get_arm_template(arm_resources, context, profiler)
+    check_arm_template(arm_template_data, profiler)
 
     return arm_template_data
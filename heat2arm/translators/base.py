@@ -17,6 +17,11 @@
     Defines the base class for all the heat to ARM translators.
 """
 
+import copy
+import functools
+
+from heat2arm.context import ContextFragment
+
 
 def get_ref_heat_resource(heat_resource, property_name):
     """ get_ref_heat_resource is a helper function which returns the property
@@ -26,6 +31,29 @@ def get_ref_heat_resource(heat_resource, property_name):
     return heat_resource.stack[resource_name]
 
 
+def memoized(method):
+    """ memoized is a decorator for argument-less translator methods which
+    derive data from the Heat resource and the context. The result of the
+    method is computed only once per translator instance and stored under
+    the method's name until invalidated through invalidate_memoized.
+
+    Mutable results are copied on every call, as callers place them within
+    the ARM resources, which later passes are free to alter in-place.
+    """
+    @functools.wraps(method)
+    def wrapper(self):
+        try:
+            result = self._memoized[method.__name__]
+        except KeyError:
+            result = self._memoized[method.__name__] = method(self)
+
+        if isinstance(result, (dict, list)):
+            return copy.deepcopy(result)
+        return result
+
+    return wrapper
+
+
 class BaseHeatARMTranslator(object):
     """ BaseHeatARMTranslator is the base class for all heat to ARM translators
 
@@ -41,6 +69,20 @@ class BaseHeatARMTranslator(object):
         self._name = self._heat_resource.name
         self._context = context
 
+        # _memoized holds the results of all the memoized methods
+        # of this translator which were called so far:
+        self._memoized = {}
+
+    def invalidate_memoized(self, *method_names):
+        """ invalidate_memoized discards the stored results of the memoized
+        methods with the given names, or of all of them if none are given.
+        """
+        if not method_names:
+            self._memoized.clear()
+
+        for method_name in method_names:
+            self._memoized.pop(method_name, None)
+
     def _make_var_name(self, var):
         """ _get_var_name is a helper method which constructs the
         name to be used as an ARM template variable.
@@ -66,6 +108,13 @@ class BaseHeatARMTranslator(object):
         """
         return []
 
+    def get_mapping_lookups(self):
+        """ get_mapping_lookups returns the list of the (map name, name)
+        tuples of all the entries of the mapping provider the translation
+        looks up, so that they can be resolved in bulk beforehand.
+        """
+        return []
+
     def get_resource_data(self):
         """ get_resource_data returns a list of all the ARM resources
         representing the resource's translation  which can be directly
@@ -91,3 +140,19 @@ class BaseHeatARMTranslator(object):
         self._context.add_variables(self.get_variables())
         for res in self.get_resource_data():
             self._context.add_resource(res)
+
+    def translate_fragment(self):
+        """ translate_fragment runs the translation against a new
+        ContextFragment instead of the context and returns it; leaving the
+        context unaltered.
+        """
+        fragment = ContextFragment(self._context, self._name)
+
+        context = self._context
+        self._context = fragment
+        try:
+            self.translate()
+        finally:
+            self._context = context
+
+        return fragment
@@ -22,6 +22,7 @@ import json
 
 from heat2arm import constants
 from heat2arm.translators.base import BaseHeatARMTranslator
+from heat2arm.translators.base import memoized
 
 
 class BaseInstanceARMTranslator(BaseHeatARMTranslator):
@@ -82,6 +83,7 @@ class BaseInstanceARMTranslator(BaseHeatARMTranslator):
         """
         pass
 
+    @memoized
     def _get_network_interfaces(self):
         """ _get_network_interfaces is a helper method which returns a list of
         all the network interfaces which are attached to this Nova server.
@@ -18,6 +18,7 @@
 """
 
 from heat2arm import constants
+from heat2arm.translators.base import memoized
 from heat2arm.translators.instances import ec2_utils as utils
 from heat2arm.translators.instances.base_instance import (
     BaseInstanceARMTranslator
@@ -39,6 +40,15 @@ class EC2InstanceARMTranslator(BaseInstanceARMTranslator):
     #   - get_dependencies.
     #   - get_resource_data.
 
+    def get_mapping_lookups(self):
+        """ get_mapping_lookups returns the list of the (map name, name)
+        tuples of the flavor and image of the instance.
+        """
+        return [
+            ("ec2_flavors", self._heat_resource.properties["InstanceType"]),
+            ("ec2_images", self._heat_resource.properties["ImageId"]),
+        ]
+
     def get_variables(self):
         """ get_variables returns a dict of ARM template variables
         associated with the Heat template's resource translation.
@@ -113,26 +123,24 @@ class EC2InstanceARMTranslator(BaseInstanceARMTranslator):
 
         return base_props
 
+    @memoized
     def _get_ref_port_resource_names(self):
         """ _get_ref_port_resource_name is a helper method which returns a list
         of all the Neurton port resources wich reference this EC2 instance.
         """
         port_resource_names = []
 
-        for resource in self._heat_resource.stack.iter_resources():
-            # NOTE: because you can define both Neutron networking resources
-            # and AWS ones in heat templates; we must check for both here:
-            if (resource.type() == "OS::Neutron::Port"
-                    and "device_id" in resource.properties.data
-                    and resource.properties.data["device_id"] == self._name):
-                port_resource_names.append(resource.name)
-            if (resource.type() == "AWS::EC2::EIPAssociation"
-                    and "InstanceId" in resource.properties.data
-                    and resource.properties.data["InstanceId"] == self._name):
-                port_resource_names.append(resource.name)
+        # NOTE: because you can define both Neutron networking resources
+        # and AWS ones in heat templates; we must check for both here:
+        for (name, prop, res_type) in self._context.get_referrers(self._name):
+            if ((res_type == "OS::Neutron::Port" and prop == "device_id") or
+                    (res_type == "AWS::EC2::EIPAssociation" and
+                     prop == "InstanceId")):
+                port_resource_names.append(name)
 
         return port_resource_names
 
+    @memoized
     def _get_availability_zone(self):
         """ _get_availability_zone is a helper method which returns the
         AvailabilityZone this instance is located in, if any.
@@ -18,33 +18,7 @@
     which aid in instance translations.
 """
 
-from oslo.config import cfg
-
-# Get the config instance and add options:
-CONF = cfg.CONF
-CONF.register_opts({
-    cfg.DictOpt(
-        "ec2_vm_type_to_size_map",
-        default={
-            "m1.tiny": "Basic_A0",
-            "m1.small": "Basic_A1",
-            "m1.medium": "Basic_A2",
-            "m1.large": "Basic_A3",
-            "m1.xlarge": "basic_A4",
-        },
-        help="A mapping between EC2 VM types and Azure machine sizes."
-    ),
-    cfg.DictOpt(
-        "ec2_vm_image_map",
-        default={
-            "U10-x86_64-cfntools":
-            "Canonical;UbuntuServer;12.04.5-LTS",
-            "F17-x86_64-cfntools":
-            "Canonical;UbuntuServer;12.04.5-LTS"
-        },
-        help="A map between EC2 image names and Azure ones.",
-    )
-})
+from heat2arm.translators import mapping_options  # noqa
 
 
 def get_azure_flavor(flavor):
@@ -52,23 +26,30 @@ def get_azure_flavor(flavor):
     appropriate Azure VM size corresponding to the given Amazon
     image flavor or a the pre-set sensible default.
     """
-    return CONF.ec2_vm_type_to_size_map.get(flavor, CONF.vm_default_size)
+    # NOTE: the mapping providers are only imported once needed, as they
+    # load the modules of all the providers:
+    from heat2arm.translators.instances import mapping_providers
+
+    provider = mapping_providers.get_provider()
+    size = provider.resolve("ec2_flavors", flavor)
+    if size is None:
+        return provider.default_size
+
+    return size
 
 
 def get_azure_image_info(ec2_image):
     """ get_azure_image_info is a helper function which returns
     the info of the image.
     """
-    azure_image_info_str = CONF.ec2_vm_image_map.get(ec2_image)
-    if not azure_image_info_str:
-        raise Exception(
-            'Nova image "%s" cannot be mapped to an Azure equivalent. Please '
-            'update the "ec2_vm_image_map" configuration option' % ec2_image)
+    from heat2arm.translators.instances import mapping_providers
 
-    azure_image_info = tuple(azure_image_info_str.split(";"))
-    if len(azure_image_info) != 3:
+    azure_image_info = mapping_providers.get_provider().resolve(
+        "ec2_images", ec2_image)
+    if azure_image_info is None:
         raise Exception(
-            '"%s" does not contain valid Azure image data. The required '
-            'format is "publisher;offer;sku"')
+            'EC2 image "%s" cannot be mapped to an Azure equivalent. Please '
+            'update the "ec2_vm_image_map" configuration option or the '
+            '"ec2_images" map of the mapping file' % ec2_image)
 
     return azure_image_info
@@ -0,0 +1,166 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    This module contains the compiled lookup tables of the flavor and image
+    maps of the instance translators.
+
+    All the maps are compiled at once on first use into read-only dicts of
+    already parsed values, every entry being validated up front; so that a
+    bad entry is reported straight away rather than when the first instance
+    using it is translated, and so that looking up an instance's flavor or
+    image is a plain dict hit.
+
+    The tables must be invalidated whenever the configuration is reloaded or
+    any of the maps is overridden, which is done automatically on mutation
+    of the configuration where oslo.config supports it.
+"""
+
+import collections
+import threading
+
+from oslo.config import cfg
+
+from heat2arm.translators import mapping_options  # noqa
+
+CONF = cfg.CONF
+
+# IMAGE_INFO_FIELDS are the fields of the Azure image data within the image
+# maps, separated by semicolons:
+IMAGE_INFO_FIELDS = ("publisher", "offer", "sku")
+
+
+class FrozenTable(dict):
+    """ FrozenTable is a dict which may not be altered once built. """
+    def _readonly(self, *args, **kwargs):
+        """ _readonly prevents altering the table. """
+        raise TypeError("Lookup tables are read-only.")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+
+# LookupTables holds the compiled tables of all the maps, along with the
+# default Azure VM size:
+LookupTables = collections.namedtuple("LookupTables", [
+    "nova_flavors",
+    "nova_images",
+    "ec2_flavors",
+    "ec2_images",
+    "default_size",
+])
+
+
+def compile_flavor_map(source, flavor_map):
+    """ compile_flavor_map returns the FrozenTable of the given flavor map
+    read from the given source, after checking that all its entries map to
+    an Azure VM size.
+    """
+    for (flavor, size) in flavor_map.items():
+        if not size:
+            raise Exception(
+                'Flavor "%s" of %s is not mapped to any Azure VM size.' %
+                (flavor, source))
+
+    return FrozenTable(flavor_map)
+
+
+def compile_image_map(source, image_map):
+    """ compile_image_map returns the FrozenTable of the (publisher, offer,
+    sku) tuples of the given image map read from the given source, after
+    checking that all its entries are valid.
+    """
+    table = {}
+    for (image, info) in image_map.items():
+        image_info = tuple((info or "").split(";"))
+        if len(image_info) != len(IMAGE_INFO_FIELDS) or not all(image_info):
+            raise Exception(
+                'Image "%s" of %s does not contain valid Azure image data: '
+                '"%s". The required format is "publisher;offer;sku"' %
+                (image, source, info))
+        table[image] = image_info
+
+    return FrozenTable(table)
+
+
+def _describe_option(option_name):
+    """ _describe_option is a helper function which returns the description
+    of the configuration option with the given name used within errors.
+    """
+    return 'the "%s" configuration option' % option_name
+
+
+# _TABLES are the LookupTables compiled from the current configuration:
+_TABLES = None
+_TABLES_LOCK = threading.Lock()
+
+
+def get_tables():
+    """ get_tables returns the LookupTables compiled from the current
+    configuration, compiling them on first use.
+    """
+    tables = _TABLES
+    if tables is not None:
+        return tables
+
+    return _compile_tables()
+
+
+def _compile_tables():
+    """ _compile_tables is a helper function which compiles the LookupTables
+    out of the current configuration.
+    """
+    global _TABLES
+
+    with _TABLES_LOCK:
+        if _TABLES is None:
+            _TABLES = LookupTables(
+                nova_flavors=compile_flavor_map(
+                    _describe_option("nova_vm_flavor_size_map"),
+                    CONF.nova_vm_flavor_size_map),
+                nova_images=compile_image_map(
+                    _describe_option("nova_vm_image_map"),
+                    CONF.nova_vm_image_map),
+                ec2_flavors=compile_flavor_map(
+                    _describe_option("ec2_vm_type_to_size_map"),
+                    CONF.ec2_vm_type_to_size_map),
+                ec2_images=compile_image_map(
+                    _describe_option("ec2_vm_image_map"),
+                    CONF.ec2_vm_image_map),
+                default_size=CONF.vm_default_size,
+            )
+        return _TABLES
+
+
+def invalidate(*args):
+    """ invalidate discards the compiled LookupTables, so that they get
+    compiled again from the configuration on next use.
+
+    It accepts and ignores the arguments of oslo.config's mutate hooks.
+    """
+    global _TABLES
+
+    with _TABLES_LOCK:
+        _TABLES = None
+
+
+# NOTE: only recent versions of oslo.config support mutate hooks:
+if hasattr(CONF, "register_mutate_hook"):
+    CONF.register_mutate_hook(invalidate)
@@ -0,0 +1,315 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    This module contains the providers of the mappings between Nova and EC2
+    flavors and images and Azure VM sizes and images, which the instance
+    translators resolve through.
+
+    The provider is selected through the vm_mapping_provider option:
+        - "config": the maps within the configuration options.
+        - "json": a JSON file holding a dict of each map:
+            {"nova_images": {"ubuntu": "Canonical;UbuntuServer;12.04.5-LTS"}}
+        - "csv": a CSV file holding one "map,name,value" row per entry:
+            nova_images,ubuntu,Canonical;UbuntuServer;12.04.5-LTS
+        - "sqlite": an SQLite database holding all the entries within a
+        table indexed by map and name:
+            CREATE TABLE mappings (map TEXT NOT NULL, name TEXT NOT NULL,
+                                   value TEXT NOT NULL,
+                                   PRIMARY KEY (map, name));
+    The maps are named "nova_flavors", "nova_images", "ec2_flavors" and
+    "ec2_images", and hold the values in the same format as the
+    corresponding configuration options.
+
+    Files are only read on the first lookup; the JSON and CSV ones wholly,
+    with all their entries validated, while only the entries which are
+    looked up are read from SQLite databases.
+
+    Resolved entries are kept by the provider, so all the flavors and images
+    of a stack are resolved in bulk by the translation engine before any
+    translator runs, in a single query for SQLite databases.
+"""
+
+import csv
+import json
+import sqlite3
+import threading
+
+from oslo.config import cfg
+
+from heat2arm.translators.instances import lookup_tables
+from heat2arm.translators import mapping_options  # noqa
+
+CONF = cfg.CONF
+
+# MAP_NAMES are the names of all the maps of a provider:
+MAP_NAMES = ("nova_flavors", "nova_images", "ec2_flavors", "ec2_images")
+
+# SQLITE_MAX_VARIABLES is the maximum number of names looked up in a single
+# SQLite query, within SQLite's default limit of variables per statement:
+SQLITE_MAX_VARIABLES = 500
+
+
+def _compile_map(map_name, source, raw_map):
+    """ _compile_map is a helper function which returns the FrozenTable of
+    the given raw map with the given name read from the given source.
+    """
+    label = 'the "%s" map of mapping file "%s"' % (map_name, source)
+    if map_name.endswith("_images"):
+        return lookup_tables.compile_image_map(label, raw_map)
+
+    return lookup_tables.compile_flavor_map(label, raw_map)
+
+
+class MappingProvider(object):
+    """ MappingProvider is the base class of all the mapping providers.
+
+    It keeps all the resolved entries, including the missing ones, so that
+    each is only read once from the underlying source; which subclasses read
+    from by implementing _read.
+    """
+    def __init__(self, default_size):
+        # default_size is the Azure VM size of the unmapped flavors:
+        self.default_size = default_size
+
+        # _resolved maps each map name to the dict of its resolved entries,
+        # holding None for those which are missing:
+        self._resolved = dict((map_name, {}) for map_name in MAP_NAMES)
+        self._lock = threading.Lock()
+
+    def _read(self, map_name, names):
+        """ _read returns the dict of the compiled entries of the map with
+        the given name for all the given names which are mapped.
+        """
+        raise NotImplementedError()
+
+    def resolve(self, map_name, name):
+        """ resolve returns the entry of the map with the given name for the
+        given name, or None if it is not mapped.
+        """
+        resolved = self._resolved[map_name]
+        try:
+            return resolved[name]
+        except KeyError:
+            self.bulk_resolve([(map_name, name)])
+            return resolved[name]
+
+    def bulk_resolve(self, lookups):
+        """ bulk_resolve resolves the entries for all the given (map name,
+        name) tuples which were not resolved yet at once, so that looking
+        them up afterwards does not hit the underlying source.
+        """
+        pending = dict((map_name, set()) for map_name in MAP_NAMES)
+        for (map_name, name) in lookups:
+            if name not in self._resolved[map_name]:
+                pending[map_name].add(name)
+
+        with self._lock:
+            for (map_name, names) in pending.items():
+                resolved = self._resolved[map_name]
+                names = [name for name in names if name not in resolved]
+                if not names:
+                    continue
+
+                found = self._read(map_name, names)
+                for name in names:
+                    resolved[name] = found.get(name)
+
+
+class ConfigMappingProvider(MappingProvider):
+    """ ConfigMappingProvider provides the maps within the configuration
+    options through their compiled lookup tables.
+    """
+    def resolve(self, map_name, name):
+        """ resolve returns the entry of the map with the given name for the
+        given name, or None if it is not mapped.
+        """
+        return getattr(lookup_tables.get_tables(), map_name).get(name)
+
+    def bulk_resolve(self, lookups):
+        """ bulk_resolve compiles the lookup tables, if not already. """
+        lookup_tables.get_tables()
+
+
+class FileMappingProvider(MappingProvider):
+    """ FileMappingProvider is the base class of the providers which read
+    the whole of the maps from the file at the given path, on first lookup,
+    by implementing _load.
+    """
+    def __init__(self, default_size, path):
+        super(FileMappingProvider, self).__init__(default_size)
+        self.path = path
+
+        # _tables maps the map names to the FrozenTables of their entries,
+        # once loaded:
+        self._tables = None
+
+    def _load(self, stream):
+        """ _load returns the dict of all the raw maps within the given
+        stream.
+        """
+        raise NotImplementedError()
+
+    def _read(self, map_name, names):
+        """ _read returns the dict of the compiled entries of the map with
+        the given name for all the given names which are mapped.
+        """
+        if self._tables is None:
+            with open(self.path) as stream:
+                raw_maps = self._load(stream)
+
+            unknown = set(raw_maps) - set(MAP_NAMES)
+            if unknown:
+                raise Exception(
+                    'Mapping file "%s" holds unknown maps: %s. The supported '
+                    'ones are: %s.' % (self.path, ", ".join(sorted(unknown)),
+                                       ", ".join(MAP_NAMES)))
+
+            self._tables = dict(
+                (name, _compile_map(name, self.path, raw_maps.get(name, {})))
+                for name in MAP_NAMES)
+
+        table = self._tables[map_name]
+        return dict((name, table[name]) for name in names if name in table)
+
+
+class JSONMappingProvider(FileMappingProvider):
+    """ JSONMappingProvider reads the maps from a JSON file. """
+    def _load(self, stream):
+        """ _load returns the dict of all the raw maps within the given
+        stream.
+        """
+        raw_maps = json.load(stream)
+        if not isinstance(raw_maps, dict) or not all(
+                isinstance(raw_map, dict) for raw_map in raw_maps.values()):
+            raise Exception(
+                'Mapping file "%s" must hold a dict of maps.' % self.path)
+
+        return raw_maps
+
+
+class CSVMappingProvider(FileMappingProvider):
+    """ CSVMappingProvider reads the maps from a CSV file of map,name,value
+    rows.
+    """
+    def _load(self, stream):
+        """ _load returns the dict of all the raw maps within the given
+        stream.
+        """
+        raw_maps = {}
+        for (line, row) in enumerate(csv.reader(stream), 1):
+            if not row:
+                continue
+            if len(row) != 3:
+                raise Exception(
+                    'Line %d of mapping file "%s" does not hold a '
+                    'map,name,value row.' % (line, self.path))
+            raw_maps.setdefault(row[0], {})[row[1]] = row[2]
+
+        return raw_maps
+
+
+class SQLiteMappingProvider(MappingProvider):
+    """ SQLiteMappingProvider looks the entries up within an SQLite database
+    at the given path, only reading those which are looked up.
+    """
+    def __init__(self, default_size, path):
+        super(SQLiteMappingProvider, self).__init__(default_size)
+        self.path = path
+
+    def _read(self, map_name, names):
+        """ _read returns the dict of the compiled entries of the map with
+        the given name for all the given names which are mapped.
+        """
+        # NOTE: a connection is opened for each read, so that providers
+        # may be shared between threads and inherited by forked processes:
+        connection = sqlite3.connect(self.path)
+        try:
+            raw_map = {}
+            for i in range(0, len(names), SQLITE_MAX_VARIABLES):
+                chunk = names[i:i + SQLITE_MAX_VARIABLES]
+                raw_map.update(connection.execute(
+                    "SELECT name, value FROM mappings "
+                    "WHERE map = ? AND name IN (%s)" % ", ".join(
+                        "?" * len(chunk)),
+                    [map_name] + list(chunk)).fetchall())
+        finally:
+            connection.close()
+
+        return _compile_map(map_name, self.path, raw_map)
+
+
+# PROVIDERS maps the names of the mapping providers to their classes:
+PROVIDERS = {
+    "json": JSONMappingProvider,
+    "csv": CSVMappingProvider,
+    "sqlite": SQLiteMappingProvider,
+}
+
+# _PROVIDER is the MappingProvider set up from the configuration on first
+# use:
+_PROVIDER = None
+_PROVIDER_LOCK = threading.Lock()
+
+
+def get_provider():
+    """ get_provider returns the MappingProvider configured through the
+    vm_mapping_* configuration options, setting it up on first use.
+    """
+    global _PROVIDER
+
+    provider = _PROVIDER
+    if provider is not None:
+        return provider
+
+    with _PROVIDER_LOCK:
+        if _PROVIDER is None:
+            if CONF.vm_mapping_provider == "config":
+                _PROVIDER = ConfigMappingProvider(CONF.vm_default_size)
+            elif not CONF.vm_mapping_file:
+                raise Exception(
+                    'The "%s" mapping provider requires the '
+                    '"vm_mapping_file" configuration option to be set.' %
+                    CONF.vm_mapping_provider)
+            else:
+                _PROVIDER = PROVIDERS[CONF.vm_mapping_provider](
+                    CONF.vm_default_size, CONF.vm_mapping_file)
+        return _PROVIDER
+
+
+def bulk_resolve(lookups):
+    """ bulk_resolve resolves all the given (map name, name) tuples at once
+    through the configured provider.
+    """
+    get_provider().bulk_resolve(lookups)
+
+
+def invalidate(*args):
+    """ invalidate discards the configured provider and the compiled lookup
+    tables, so that they are set up again from the configuration on next
+    use.
+
+    It accepts and ignores the arguments of oslo.config's mutate hooks.
+    """
+    global _PROVIDER
+
+    with _PROVIDER_LOCK:
+        _PROVIDER = None
+    lookup_tables.invalidate()
+
+
+# NOTE: only recent versions of oslo.config support mutate hooks:
+if hasattr(CONF, "register_mutate_hook"):
+    CONF.register_mutate_hook(invalidate)
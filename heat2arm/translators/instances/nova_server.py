@@ -20,6 +20,7 @@
 
 import logging
 
+from heat2arm.translators.base import memoized
 from heat2arm.translators.instances.base_instance import (
     BaseInstanceARMTranslator
 )
@@ -35,6 +36,15 @@ class NovaServerARMTranslator(BaseInstanceARMTranslator):
     """
     heat_resource_type = "OS::Nova::Server"
 
+    def get_mapping_lookups(self):
+        """ get_mapping_lookups returns the list of the (map name, name)
+        tuples of the flavor and image of the instance.
+        """
+        return [
+            ('nova_flavors', self._heat_resource.properties['flavor']),
+            ('nova_images', self._heat_resource.properties['image']),
+        ]
+
     def get_variables(self):
         """ get_variables returns the dict of ARM template variables
         associated with the Heat template's resource translation.
@@ -60,6 +70,7 @@ class NovaServerARMTranslator(BaseInstanceARMTranslator):
     #   - get_resource_data.
     #   - update_context.
 
+    @memoized
     def _get_ref_port_resource_names(self):
         """ _get_ref_port_resource_names is a helper method which returns a
         list containing the names of all port resources which are referenced
@@ -18,31 +18,7 @@
     which aid in instance translations.
 """
 
-from oslo.config import cfg
-
-# Get the config instance and add options:
-CONF = cfg.CONF
-CONF.register_opts([
-    # Dict option for mapping Nova sizes to Azure sizes:
-    cfg.DictOpt(
-        'nova_vm_flavor_size_map',
-        default={
-            'm1.tiny': "Basic_A0",
-            'm1.small': "Basic_A1",
-            'm1.medium': "Basic_A2",
-            'm1.large': "Basic_A3",
-            'm1.xlarge': "Basic_A4",
-        },
-        help='A map between OpenStack Nova flavors and Azure VM sizes'),
-    # Mapping between Nova image names and Azure images:
-    cfg.DictOpt(
-        'nova_vm_image_map',
-        default={
-            'ubuntu.12.04.LTS.x86_64':
-            "Canonical;UbuntuServer;12.04.5-LTS",
-        },
-        help='A map between OpenStack Nova and Azure VM images'),
-])
+from heat2arm.translators import mapping_options  # noqa
 
 
 def get_azure_flavor(flavor):
@@ -50,23 +26,30 @@ def get_azure_flavor(flavor):
     appropriate Azure VM size corresponding to the given image flavor
     or a the pre-set sensible default.
     """
-    return CONF.nova_vm_flavor_size_map.get(flavor, CONF.vm_default_size)
+    # NOTE: the mapping providers are only imported once needed, as they
+    # load the modules of all the providers:
+    from heat2arm.translators.instances import mapping_providers
+
+    provider = mapping_providers.get_provider()
+    size = provider.resolve("nova_flavors", flavor)
+    if size is None:
+        return provider.default_size
+
+    return size
 
 
 def get_azure_image_info(nova_image):
     """ get_azure_image_info is a helper function which returns
     the info of the image.
     """
-    azure_image_info_str = CONF.nova_vm_image_map.get(nova_image)
-    if not azure_image_info_str:
-        raise Exception(
-            'Nova image "%s" cannot be mapped to an Azure equivalent. Please '
-            'update the "nova_vm_image_map" configuration option' % nova_image)
+    from heat2arm.translators.instances import mapping_providers
 
-    azure_image_info = tuple(azure_image_info_str.split(";"))
-    if len(azure_image_info) != 3:
+    azure_image_info = mapping_providers.get_provider().resolve(
+        "nova_images", nova_image)
+    if azure_image_info is None:
         raise Exception(
-            '"%s" does not contain valid Azure image data. The required '
-            'format is "publisher;offer;sku"')
+            'Nova image "%s" cannot be mapped to an Azure equivalent. Please '
+            'update the "nova_vm_image_map" configuration option or the '
+            '"nova_images" map of the mapping file' % nova_image)
 
     return azure_image_info
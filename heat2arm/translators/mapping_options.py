@@ -0,0 +1,86 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    This module registers the configuration options of the mappings between
+    flavors and images and Azure VM sizes and images.
+
+    It is kept apart from the instances package so that the options may be
+    read, for example by the translation cache, without loading any of the
+    translators or the mapping providers.
+"""
+
+from oslo.config import cfg
+
+CONF = cfg.CONF
+CONF.register_opts([
+    cfg.StrOpt(
+        "vm_default_size",
+        default="Basic_A1",
+        help="Default Azure size in case of an EC2 VM type "
+             "could not be mapped.",
+    ),
+    cfg.StrOpt(
+        'vm_mapping_provider',
+        default='config',
+        choices=['config', 'json', 'csv', 'sqlite'],
+        help='Provider of the mappings between flavors and images and Azure '
+             'VM sizes and images'),
+    cfg.StrOpt(
+        'vm_mapping_file',
+        default=None,
+        help='Path of the file the mappings are read from with the json, csv '
+             'and sqlite mapping providers'),
+    # Dict option for mapping Nova sizes to Azure sizes:
+    cfg.DictOpt(
+        'nova_vm_flavor_size_map',
+        default={
+            'm1.tiny': "Basic_A0",
+            'm1.small': "Basic_A1",
+            'm1.medium': "Basic_A2",
+            'm1.large': "Basic_A3",
+            'm1.xlarge': "Basic_A4",
+        },
+        help='A map between OpenStack Nova flavors and Azure VM sizes'),
+    # Mapping between Nova image names and Azure images:
+    cfg.DictOpt(
+        'nova_vm_image_map',
+        default={
+            'ubuntu.12.04.LTS.x86_64':
+            "Canonical;UbuntuServer;12.04.5-LTS",
+        },
+        help='A map between OpenStack Nova and Azure VM images'),
+    cfg.DictOpt(
+        "ec2_vm_type_to_size_map",
+        default={
+            "m1.tiny": "Basic_A0",
+            "m1.small": "Basic_A1",
+            "m1.medium": "Basic_A2",
+            "m1.large": "Basic_A3",
+            "m1.xlarge": "basic_A4",
+        },
+        help="A mapping between EC2 VM types and Azure machine sizes."
+    ),
+    cfg.DictOpt(
+        "ec2_vm_image_map",
+        default={
+            "U10-x86_64-cfntools":
+            "Canonical;UbuntuServer;12.04.5-LTS",
+            "F17-x86_64-cfntools":
+            "Canonical;UbuntuServer;12.04.5-LTS"
+        },
+        help="A map between EC2 image names and Azure ones.",
+    ),
+])
@@ -18,6 +18,7 @@
 """
 
 from heat2arm.translators.base import get_ref_heat_resource
+from heat2arm.translators.base import memoized
 from heat2arm.translators.networking.nics.base_nic import BaseNICARMTranslator
 
 
@@ -35,6 +36,7 @@ class EC2eipAssocARMTranslator(BaseNICARMTranslator):
     #   - get_dependencies
     #   - get_resource_data
 
+    @memoized
     def _get_floating_ip_resource_name(self):
         """ _get_floating_ip_resource_name is a helper function which
         returns the name of the floating IP resource associated to
@@ -45,6 +47,7 @@ class EC2eipAssocARMTranslator(BaseNICARMTranslator):
         if "EIP" in self._heat_resource.properties.data:
             return self._heat_resource.properties.data["EIP"].args
 
+    @memoized
     def _get_ref_network(self):
         """ _get_ref_network is a helper function which returns the name
         of the network which references this NIC-like resource.
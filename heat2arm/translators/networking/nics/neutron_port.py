@@ -18,6 +18,7 @@
 """
 
 from heat2arm.translators.base import get_ref_heat_resource
+from heat2arm.translators.base import memoized
 from heat2arm.translators.networking.nics.base_nic import BaseNICARMTranslator
 
 
@@ -35,18 +36,18 @@ class NeutronPortARMTranslator(BaseNICARMTranslator):
     #   - get_dependencies
     #   - get_resource_data
 
+    @memoized
     def _get_floating_ip_resource_name(self):
         """ _get_floating_ip_resource_name is a helper function which
         returns the name of the floating IP resource associated to
         this NIC-like resource.
         """
-        for heat_resource in self._heat_resource.stack.iter_resources():
-            if heat_resource.type() == "OS::Neutron::FloatingIP":
-                port_resource = get_ref_heat_resource(
-                    heat_resource, 'port_id')
-                if port_resource is self._heat_resource:
-                    return heat_resource.name
+        referrers = self._context.get_referrers(
+            self._name, "OS::Neutron::FloatingIP", "port_id")
+        if referrers:
+            return referrers[0][0]
 
+    @memoized
     def _get_ref_network(self):
         """ _get_ref_network is a helper function which returns the name
         of the network which references this NIC-like resource.
@@ -0,0 +1,124 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Defines the registry which maps Heat resource types to the translators
+    which handle them.
+
+    Third-party translators may be made available to the translation engine
+    by registering them here:
+
+    >>> from heat2arm.translators import registry
+    >>>
+    >>> registry.register_translator(MyCustomResourceARMTranslator)
+
+    Translators may also be registered by their import path, in which case
+    their module is only imported once a translator is first requested for
+    their Heat resource type:
+
+    >>> registry.register_translator(
+    ...     "mypackage.translators:MyCustomResourceARMTranslator",
+    ...     "My::Custom::Resource")
+"""
+
+import importlib
+
+# _TRANSLATORS is the mapping between Heat resource types and either the
+# classes of the translators registered for them or their import paths,
+# until they are first requested:
+_TRANSLATORS = {}
+
+
+def _get_name(translator):
+    """ _get_name is a helper function which returns the name of the given
+    translator class or import path.
+    """
+    return getattr(translator, "__name__", translator)
+
+
+def _import_translator(heat_resource_type, path):
+    """ _import_translator is a helper function which imports and returns the
+    translator class with the given "package.module:ClassName" import path,
+    checking it handles the given Heat resource type.
+    """
+    (module_name, _, class_name) = path.partition(":")
+    if not module_name or not class_name:
+        raise Exception(
+            'Invalid translator import path "%s"; expected one of the form '
+            '"package.module:ClassName".' % path)
+
+    translator = getattr(importlib.import_module(module_name), class_name)
+    if translator.heat_resource_type != heat_resource_type:
+        raise Exception(
+            'Translator "%s" was registered for Heat resource type "%s" but '
+            'handles "%s".' % (path, heat_resource_type,
+                               translator.heat_resource_type))
+
+    return translator
+
+
+def register_translator(translator, heat_resource_type=None):
+    """ register_translator adds the given translator to the registry under
+    the given Heat resource type, which defaults to its heat_resource_type.
+
+    The translator may either be a class or its "package.module:ClassName"
+    import path, in which case the Heat resource type must be given.
+
+    It raises an exception if the Heat resource type is missing or if
+    another translator was already registered for the same type.
+    """
+    if heat_resource_type is None:
+        heat_resource_type = getattr(translator, "heat_resource_type", None)
+    if not heat_resource_type:
+        raise Exception(
+            'Translator "%s" does not define a heat_resource_type.' %
+            _get_name(translator))
+
+    existing = _TRANSLATORS.get(heat_resource_type)
+    if existing is not None:
+        raise Exception(
+            'Cannot register translator "%s" for Heat resource type "%s" as '
+            'it is already handled by "%s".' % (
+                _get_name(translator), heat_resource_type,
+                _get_name(existing)))
+
+    _TRANSLATORS[heat_resource_type] = translator
+
+
+def unregister_translator(heat_resource_type):
+    """ unregister_translator removes the translator registered for the given
+    Heat resource type, if any, and returns its class or import path.
+    """
+    return _TRANSLATORS.pop(heat_resource_type, None)
+
+
+def get_translator(heat_resource_type):
+    """ get_translator returns the translator class registered for the given
+    Heat resource type or None if there is none, importing it first if it
+    was registered by its import path.
+    """
+    translator = _TRANSLATORS.get(heat_resource_type)
+    if hasattr(translator, "lower"):
+        translator = _import_translator(heat_resource_type, translator)
+        _TRANSLATORS[heat_resource_type] = translator
+
+    return translator
+
+
+def get_registered_types():
+    """ get_registered_types returns a sorted list of all the Heat resource
+    types which currently have a translator registered.
+    """
+    return sorted(_TRANSLATORS)
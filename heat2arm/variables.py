@@ -0,0 +1,124 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+    Contains the deduplication of the variables of ARM templates, which
+    merges all the variables holding identical values into shared ones.
+
+    For example, the sizes of identical VMs:
+        "vmSize_server1": "Basic_A1",
+        "vmSize_server2": "Basic_A1",
+    get merged into a single variable named after their common prefix:
+        "vmSize_shared": "Basic_A1",
+    with all the references to the former variables rewritten to use it.
+
+    As variables referencing merged variables may then become identical
+    themselves, merging is repeated until no more variables can be merged.
+"""
+
+import collections
+import json
+import re
+
+# _VARIABLE_REGEX matches all variable references in ARM expressions:
+_VARIABLE_REGEX = re.compile(r"variables\('([^']*)'\)")
+
+
+def _get_shared_name(names, variables, taken):
+    """ _get_shared_name is a helper function which returns the name of the
+    variable which replaces the variables with the given names.
+
+    It is the common prefix of the names suffixed with "_shared" if there is
+    one which is neither an existing variable nor among the given taken
+    names, or the first name otherwise.
+    """
+    prefix = names[0].split("_")[0]
+    if "_" in names[0] and all(name.startswith(prefix + "_")
+                               for name in names):
+        shared_name = "%s_shared" % prefix
+        if shared_name in names or (
+                shared_name not in variables and shared_name not in taken):
+            return shared_name
+
+    return names[0]
+
+
+def _rewrite_references(value, renames):
+    """ _rewrite_references is a helper function which returns the given
+    value with all the references to the renamed variables within it
+    replaced according to the given mapping.
+    """
+    if isinstance(value, dict):
+        for key, val in value.items():
+            value[key] = _rewrite_references(val, renames)
+    elif isinstance(value, list):
+        for i, val in enumerate(value):
+            value[i] = _rewrite_references(val, renames)
+    elif hasattr(value, "lower") and "variables(" in value:
+        return _VARIABLE_REGEX.sub(
+            lambda match: "variables('%s')" % renames.get(
+                match.group(1), match.group(1)),
+            value)
+
+    return value
+
+
+def _merge_once(template_data):
+    """ _merge_once is a helper function which merges all the variables of
+    the given template data holding identical values once, and returns
+    whether any were merged.
+    """
+    variables = template_data["variables"]
+
+    groups = collections.OrderedDict()
+    for name, value in variables.items():
+        key = json.dumps(value, sort_keys=True)
+        groups.setdefault(key, []).append(name)
+
+    renames = {}
+    taken = set()
+    for names in groups.values():
+        if len(names) < 2:
+            continue
+
+        shared_name = _get_shared_name(names, variables, taken)
+        taken.add(shared_name)
+        for name in names:
+            if name != shared_name:
+                renames[name] = shared_name
+
+    if not renames:
+        return False
+
+    merged = collections.OrderedDict()
+    for name, value in variables.items():
+        name = renames.get(name, name)
+        if name not in merged:
+            merged[name] = value
+
+    template_data["variables"] = _rewrite_references(merged, renames)
+    template_data["resources"] = _rewrite_references(
+        template_data["resources"], renames)
+
+    return True
+
+
+def deduplicate_variables(template_data):
+    """ deduplicate_variables merges all the variables of the given ARM
+    template data which hold identical values into shared variables,
+    rewriting all the references to them.
+    """
+    while _merge_once(template_data):
+        pass